@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Measure throughput and latency of a real SlackBot against a fake Slack.
+
+Each scenario runs in a fresh process: events are pushed through the fake
+RTM websocket, go through `_start` -> `handle_message` -> `send_reply`, and
+come back to the fake ``chat.postMessage``.
+
+    python benchmark/bench.py --events 5000 --handlers 1,100 --directory 100:20,40000:10000
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+import logging
+import resource
+import itertools
+import multiprocessing
+import click
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from jin import SlackBot  # noqa
+from jin import metrics  # noqa
+from fake_slack import FakeSlack  # noqa
+
+
+# Share of each kind of event in the stream
+EVENT_MIX = (
+    ('ping', 0.2),  # matches a handler which replies
+    ('chatter', 0.5),  # message that matches no pattern
+    ('user_typing', 0.2),
+    ('presence_change', 0.1),
+)
+
+
+def make_events(n, slack, seed=0):
+    rand = random.Random(seed)
+    kinds = [kind for kind, _ in EVENT_MIX]
+    weights = [weight for _, weight in EVENT_MIX]
+    channels = [c['id'] for c in slack.channels]
+    users = [u['id'] for u in slack.users]
+
+    events = []
+    for i in range(n):
+        kind = _choose(rand, kinds, weights)
+        channel = rand.choice(channels)
+        user = rand.choice(users)
+        ts = '%d.%06d' % (1500000000 + i, i)
+        if kind == 'ping':
+            raw = {'type': 'message', 'channel': channel, 'user': user, 'text': 'ping %d' % i, 'ts': ts}
+        elif kind == 'chatter':
+            raw = {'type': 'message', 'channel': channel, 'user': user, 'text': 'just talking %d' % i, 'ts': ts}
+        elif kind == 'user_typing':
+            raw = {'type': 'user_typing', 'channel': channel, 'user': user}
+        else:
+            raw = {'type': 'presence_change', 'user': user, 'presence': 'active'}
+        events.append((kind, raw))
+    return events
+
+
+def _choose(rand, kinds, weights):
+    x = rand.random() * sum(weights)
+    for kind, weight in zip(kinds, weights):
+        x -= weight
+        if x <= 0:
+            return kind
+    return kinds[-1]
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def run_scenario(params):
+    slack = FakeSlack(params['users'], params['channels'])
+    slack.listen()
+
+    bot = SlackBot({
+        'SLACK_TOKEN': 'bench',
+        'SLACK_API_URL': slack.api_url,
+        'DEBUG': False,
+        'METRICS_PATH': None,
+        'HANDLER_CONCURRENCY': params['concurrency'],
+        # Measure the bot, not Slack's rate limits
+        'OUTBOUND_RATE': 1000000,
+        'OUTBOUND_BURST': 1000000,
+        'OUTBOUND_CHANNEL_RATE': 1000000,
+        'OUTBOUND_CHANNEL_BURST': 1000000,
+        'OUTBOUND_CONCURRENCY': params['concurrency'],
+    })
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Handlers that never match the traffic, to measure dispatch cost
+    for i in range(params['handlers'] - 1):
+        bot.match_text(r'cmd%d (?P<arg>\w+)' % i)(lambda msg, arg: None)
+
+    @bot.match_text(r'ping (?P<n>\d+)')
+    def ping(msg, n):
+        return msg.reply('pong %s' % n)
+
+    events = make_events(params['events'], slack)
+    pings = sum(1 for kind, _ in events if kind == 'ping')
+    sent_at = {}
+    latencies = []
+
+    def on_post(args):
+        n = args['text'].split()[-1]
+        latencies.append(time.time() - sent_at[n])
+
+    slack.on_post = on_post
+
+    @gen.coroutine
+    def main():
+        IOLoop.current().spawn_callback(bot.start)
+        while not slack.connections:
+            yield gen.sleep(0.01)
+
+        interval = 1.0 / params['rate'] if params['rate'] else 0
+        start = time.time()
+        for i, (kind, raw) in enumerate(events):
+            if kind == 'ping':
+                sent_at[raw['text'].split()[-1]] = time.time()
+            slack.push(raw)
+            if interval:
+                delay = start + (i + 1) * interval - time.time()
+                if delay > 0:
+                    yield gen.sleep(delay)
+            elif i % 100 == 99:
+                # Let the bot run in between
+                yield gen.moment
+
+        # `hello` is counted as well
+        deadline = time.time() + params['timeout']
+        while (metrics.EVENTS_RECEIVED.total() < len(events) + 1 or len(latencies) < pings):
+            if time.time() > deadline:
+                break
+            yield gen.sleep(0.005)
+        elapsed = time.time() - start
+
+        raise gen.Return(dict(
+            params,
+            received=metrics.EVENTS_RECEIVED.total() - 1,
+            replies=len(latencies),
+            events_per_sec=len(events) / elapsed,
+            p50=percentile(latencies, 50),
+            p99=percentile(latencies, 99),
+            # Kilobytes on Linux
+            max_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        ))
+
+    return IOLoop.current().run_sync(main)
+
+
+def parse_ints(value):
+    return [int(i) for i in value.split(',')]
+
+
+def parse_directory(value):
+    return [tuple(int(j) for j in i.split(':')) for i in value.split(',')]
+
+
+@click.command(context_settings={
+    'help_option_names': ['-h', '--help']
+})
+@click.option('--events', default=5000, help='Number of events per scenario')
+@click.option('--handlers', default='1,100', help='Comma separated handler counts')
+@click.option('--directory', default='100:20,10000:2000', help='Comma separated USERS:CHANNELS sizes')
+@click.option('--rate', default=0, help='Events per second to push, 0 for as fast as possible')
+@click.option('--concurrency', default=8, help='HANDLER_CONCURRENCY of the bot')
+@click.option('--timeout', default=60, help='Seconds to wait for a scenario to finish')
+def cli(events, handlers, directory, rate, concurrency, timeout):
+    """Run benchmark scenarios and print a result table"""
+    columns = ['handlers', 'users', 'channels', 'received', 'replies',
+               'events_per_sec', 'p50', 'p99', 'max_rss_mb']
+    print(' '.join('%14s' % c for c in columns))
+
+    for n_handlers, (n_users, n_channels) in itertools.product(
+            parse_ints(handlers), parse_directory(directory)):
+        params = dict(
+            events=events, handlers=n_handlers, users=n_users, channels=n_channels,
+            rate=rate, concurrency=concurrency, timeout=timeout)
+        # A fresh process for each scenario, so memory and metrics don't add up
+        pool = multiprocessing.Pool(1)
+        try:
+            rv = pool.apply(run_scenario, (params,))
+        finally:
+            pool.terminate()
+
+        row = []
+        for c in columns:
+            v = rv[c]
+            if c in ('p50', 'p99'):
+                row.append('%12.2fms' % (v * 1000))
+            elif isinstance(v, float):
+                row.append('%14.1f' % v)
+            else:
+                row.append('%14s' % v)
+        print(' '.join(row))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import time
+from tornado import web, websocket
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+
+class FakeSlack(object):
+    """A local server posing as Slack RTM and Web API
+
+    ``rtm.start`` returns a directory of ``n_users`` users and ``n_channels``
+    channels, ``chat.postMessage`` calls and messages sent over websocket
+    are recorded in ``posts`` with the time they are received. Events are
+    pushed to all websocket connections by ``push``.
+    """
+
+    def __init__(self, n_users=100, n_channels=20):
+        self.users = [
+            {'id': 'U%06d' % i, 'name': 'user%d' % i, 'profile': {'real_name': 'User %d' % i}}
+            for i in range(n_users)]
+        self.channels = [
+            {'id': 'C%06d' % i, 'name': 'channel%d' % i, 'is_member': True, 'is_archived': False,
+             'topic': {'value': ''}, 'purpose': {'value': ''}}
+            for i in range(n_channels)]
+        self.connections = []
+        self.posts = []
+        self.api_calls = {}
+        self.on_post = None
+        self.port = None
+
+    def listen(self, port=0):
+        app = web.Application([
+            (r'/api/(.*)', _APIHandler, {'slack': self}),
+            (r'/ws', _WSHandler, {'slack': self}),
+        ])
+        sockets = bind_sockets(port, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+        HTTPServer(app).add_sockets(sockets)
+
+    @property
+    def api_url(self):
+        return 'http://127.0.0.1:%d/api/' % self.port
+
+    @property
+    def ws_url(self):
+        return 'ws://127.0.0.1:%d/ws' % self.port
+
+    def push(self, raw):
+        frame = json.dumps(raw)
+        for conn in self.connections:
+            conn.write_message(frame)
+
+    def api_response(self, method, args):
+        self.api_calls[method] = self.api_calls.get(method, 0) + 1
+        rv = {'ok': True}
+        if method in ('rtm.start', 'rtm.connect'):
+            rv.update(
+                url=self.ws_url,
+                self={'id': 'UBOT', 'name': 'bot'},
+                team={'id': 'T000001', 'name': 'bench', 'domain': 'bench'},
+            )
+            if method == 'rtm.start':
+                rv.update(users=self.users, channels=self.channels, groups=[])
+        elif method == 'chat.postMessage':
+            rv['ts'] = self.post(args)
+        return rv
+
+    def post(self, args):
+        self.posts.append((time.time(), args))
+        if self.on_post:
+            self.on_post(args)
+        return '%.6f' % time.time()
+
+    def rtm_response(self, raw):
+        """Acknowledge a message sent over websocket"""
+        if raw.get('type') != 'message':
+            return None
+        ts = self.post(raw)
+        return {'ok': True, 'reply_to': raw.get('id'), 'ts': ts, 'text': raw.get('text')}
+
+
+class _APIHandler(web.RequestHandler):
+    def initialize(self, slack):
+        self.slack = slack
+
+    def post(self, method):
+        args = {k: self.get_argument(k) for k in self.request.arguments}
+        self.write(self.slack.api_response(method, args))
+
+
+class _WSHandler(websocket.WebSocketHandler):
+    def initialize(self, slack):
+        self.slack = slack
+
+    def open(self):
+        self.slack.connections.append(self)
+        self.write_message(json.dumps({'type': 'hello'}))
+
+    def on_message(self, message):
+        rv = self.slack.rtm_response(json.loads(message))
+        if rv is not None:
+            self.write_message(json.dumps(rv))
+
+    def on_close(self):
+        if self in self.slack.connections:
+            self.slack.connections.remove(self)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Replay a recording made with ``RECORD_PATH`` through a bot, as a repeatable
+load test. Outbound API calls are captured instead of sent.
+
+    python benchmark/replay.py mybot:bot /var/log/mybot/frames.gz --speed 10
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import logging
+import importlib
+import click
+from tornado.ioloop import IOLoop
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from jin.record import Replayer, read_recording  # noqa
+
+
+def load_bot(spec):
+    module_name, _, attr = spec.partition(':')
+    sys.path.insert(0, os.getcwd())
+    module = importlib.import_module(module_name)
+    return getattr(module, attr or 'bot')
+
+
+@click.command(context_settings={
+    'help_option_names': ['-h', '--help']
+})
+@click.argument('bot')
+@click.argument('path')
+@click.option('--speed', default=1.0, help='Multiplier of recorded pace, 0 for max speed')
+@click.option('--self-id', default=None, help='User id of the bot in the recording')
+@click.option('--snapshot', default=None, help='Directory snapshot to load users and channels from')
+def cli(bot, path, speed, self_id, snapshot):
+    """Replay recording PATH through BOT (module:attr)"""
+    from jin.directory import Directory
+
+    bot = load_bot(bot)
+    logging.getLogger().setLevel(logging.WARNING)
+    if snapshot:
+        bot.directory = Directory.load(snapshot, **bot.directory_fields)
+
+    replayer = Replayer(bot, speed=speed, self_id=self_id)
+    rv = IOLoop.current().run_sync(lambda: replayer.replay(read_recording(path)))
+    for k in ('frames', 'elapsed', 'frames_per_sec', 'api_calls'):
+        print('%s: %s' % (k, rv[k]))
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+from __future__ import print_function
+
 import click
 
 
@@ -14,14 +16,14 @@ def cli():
 
 def _get_bot():
     from mybot import bot
-    bot.prepare()
+    bot.prepare_sync()
     return bot
 
 
 @cli.command()
 def show_channels():
     bot = _get_bot()
-    print ', '.join('{name} ({id})'.format(**i) for i in bot.channels)
+    print(', '.join('{name} ({id})'.format(**i) for i in bot.channels))
 
 
 @cli.command()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+from tornado import gen
 from jin import SlackBot
 from jin.web import SlackHandler
 import mybot_config
@@ -14,21 +15,27 @@ def hello(msg):
     return msg.reply("I'm online!", channel='slack-test')
 
 
-@bot.on_event(('message', None))
+# Only respond in #slack-test
+@bot.on_event(('message', None), channels=['slack-test'])
 def repeat(msg):
-    # Only respond in #slack-test
-    if msg.channel == 'slack-test':
-        return msg.reply('You just said: %s' % msg.raw['text'])
+    return msg.reply('You just said: %s' % msg.raw['text'])
+
+
+# Saved to SCHEDULE_PATH if it's set, the same job_id replaces the saved one
+bot.schedule_message('Standup time!', channels=['slack-test'], cron='0 10 * * 1-5',
+                     job_id='standup')
 
 
 @bot.route('/send')
 class SendHandler(SlackHandler):
+    @gen.coroutine
     def get(self):
         text = self.get_argument('text')
-        channel = self.get_argument('channel')
-        channel_id = bot.channels.get(name=channel)['id']
+        # Could be given more than once
+        channels = self.get_arguments('channel')
 
-        bot.client.send_message(channel_id, text)
+        results = yield bot.broadcast(text, channels=channels)
+        self.write({'results': results})
 
 
 if __name__ == '__main__':
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+from __future__ import print_function
+
+import time
 import json
 import inspect
 import logging
@@ -8,12 +11,31 @@ import traceback
 from tornado import gen
 from tornado.websocket import websocket_connect
 from tornado.log import enable_pretty_logging
-from tornado.ioloop import PeriodicCallback
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.locks import Event, Semaphore
+from tornado.process import task_id
 
-from .core import APIClient
-from .web import make_application
+from .compat import string_types, is_awaitable, is_coroutine_function
+from .core import APIClient, AsyncAPIClient, SLACK_API_URL
+from .web import make_application, BroadcastHandler, EventsHandler
 from .server import run_server
-from .utils import ObjectDict, SearchList, decorator_factory
+from .utils import (
+    ObjectDict, Backoff, decorator_factory, format_path, json_loads, sniff_type)
+from .connection import (
+    ConnectionReader, ConnectionWatchdog, RTMSender, RecentSet, event_key, can_send_over_rtm)
+from .executor import HandlerExecutor
+from . import metrics
+from .record import Recorder
+from .runtime import Runtime
+from .dispatch import HandlerIndex, InboundDispatcher
+from .outbound import OutboundScheduler
+from .patterns import PatternSet
+from .directory import Directory, DirectoryLoader
+from .filters import HandlerFilter
+from .schedule import Scheduler, make_trigger
+from .const import (
+    DIRECTORY_EVENTS, EVENTS_DEDUP_SIZE, DEFAULT_USER_FIELDS, DEFAULT_CHANNEL_FIELDS,
+    DEFAULT_INBOUND_PRIORITIES, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
 from .message import Message, Reply
 from . import errors
 
@@ -23,26 +45,260 @@ class SlackBot(object):
         'PORT': 9000,
         'DEBUG': True,
         'SLACK_TOKEN': NotImplemented,
+        'SLACK_API_URL': SLACK_API_URL,
+        # Max number of concurrent connections to Slack Web API
+        'API_MAX_CLIENTS': 10,
+        # Outbound replies, rates are messages per second
+        'OUTBOUND_RATE': 10,
+        'OUTBOUND_BURST': 20,
+        'OUTBOUND_CHANNEL_RATE': 1,
+        'OUTBOUND_CHANNEL_BURST': 3,
+        'OUTBOUND_CONCURRENCY': 4,
+        'OUTBOUND_COALESCE': False,
+        'OUTBOUND_MAX_RETRIES': 3,
+        # Send plain-text replies over RTM websocket, falling back to
+        # chat.postMessage when not acknowledged in RTM_REPLY_TIMEOUT seconds
+        'RTM_REPLY': True,
+        'RTM_REPLY_TIMEOUT': 5,
+        # Frames read from websocket ahead of handling, acknowledgements of
+        # replies sent over RTM are taken out of them right away
+        'READ_AHEAD': 100,
+        # Max number of broadcast messages waiting in outbound at the same time
+        'BROADCAST_CONCURRENCY': 10,
+        # Path of the broadcast route, None to disable
+        'BROADCAST_PATH': None,
+        # Required by the broadcast route, in ``Authorization: Bearer <token>``
+        # header or ``token`` argument
+        'BROADCAST_TOKEN': None,
+        # Max number of messages handled at the same time
+        'HANDLER_CONCURRENCY': 8,
+        # Max number of messages read but not handled yet
+        'INBOUND_QUEUE_SIZE': 1000,
+        # Event type -> priority, see `get_priority`
+        'INBOUND_PRIORITIES': DEFAULT_INBOUND_PRIORITIES,
+        # What to do when inbound queue is full, one of `block`, `drop`
+        # and `coalesce` (which also lets a waiting event be replaced by a
+        # newer one of the same type, channel and user), only events of
+        # INBOUND_SHED_PRIORITY or lower priority are ever dropped or coalesced
+        'INBOUND_OVERFLOW': 'coalesce',
+        'INBOUND_SHED_PRIORITY': PRIORITY_LOW,
+        # Snapshot file of users, channels and groups, None to disable
+        'DIRECTORY_CACHE_PATH': None,
+        # Seconds between saving snapshot (if changed)
+        'DIRECTORY_CACHE_INTERVAL': 300,
+        # Fetch the full directory by rtm.start again if it's older than this
+        'DIRECTORY_CACHE_MAX_AGE': 86400,
+        # Connect by rtm.connect and load the directory page by page in
+        # background, instead of all at once by rtm.start
+        'DIRECTORY_LAZY': False,
+        'DIRECTORY_PAGE_SIZE': 200,
+        # Fields of users and channels (and groups) kept in directory,
+        # None to keep everything Slack returns
+        'DIRECTORY_USER_FIELDS': DEFAULT_USER_FIELDS,
+        'DIRECTORY_CHANNEL_FIELDS': DEFAULT_CHANNEL_FIELDS,
+        # Reconnect delay grows from BASE to MAX seconds, and is reset
+        # after a connection lives longer than RESET seconds
+        'RECONNECT_BACKOFF_BASE': 1,
+        'RECONNECT_BACKOFF_MAX': 120,
+        'RECONNECT_BACKOFF_RESET': 300,
+        # Ping the primary connection every PING_INTERVAL seconds, it's
+        # recycled after PING_MAX_MISSED pings get no pong in PING_TIMEOUT
+        # seconds, or when nothing is read for READ_SILENCE_TIMEOUT seconds
+        'PING_INTERVAL': 10,
+        'PING_TIMEOUT': 5,
+        'PING_MAX_MISSED': 2,
+        'READ_SILENCE_TIMEOUT': 30,
+        # Keep a second connection to take over when the primary one drops
+        'STANDBY_CONNECTION': False,
+        # Number of frames the standby connection keeps for failover
+        'STANDBY_BUFFER_SIZE': 1000,
+        # Pools for handlers registered with `executor`,
+        # None for process pool means the number of CPUs
+        'THREAD_POOL_SIZE': 10,
+        'PROCESS_POOL_SIZE': None,
+        # Default timeout in seconds for handlers run in executor
+        'HANDLER_TIMEOUT': None,
+        # Path of the metrics route, None to disable
+        'METRICS_PATH': '/metrics',
+        # Seconds between IOLoop lag checks
+        'LOOP_LAG_INTERVAL': 0.5,
+        # Record received frames to this gzip file, None to disable
+        'RECORD_PATH': None,
+        'RECORD_MAX_BYTES': 64 * 1024 * 1024,
+        'RECORD_BACKUP_COUNT': 10,
+        # Run in many workspaces, a dict of workspace name (team id) to token,
+        # workspaces are sharded across NUM_PROCESSES processes by name,
+        # 0 for the number of CPUs
+        'WORKSPACES': None,
+        'NUM_PROCESSES': 1,
+        # Event loop to run on, `tornado`, `asyncio` or `uvloop`, the
+        # latter two require Python 3
+        'ENGINE': 'tornado',
+        # Receive events by Events API callbacks on EVENTS_PATH instead of
+        # RTM websocket, the web server runs in NUM_PROCESSES processes,
+        # requests are verified by SLACK_SIGNING_SECRET and refused if
+        # older than EVENTS_MAX_AGE seconds
+        'EVENTS_API': False,
+        'EVENTS_PATH': '/slack/events',
+        'SLACK_SIGNING_SECRET': None,
+        'EVENTS_MAX_AGE': 300,
+        # Save jobs added by `schedule_message` to this file, None to
+        # keep them in memory only
+        'SCHEDULE_PATH': None,
+        'SCHEDULE_SAVE_INTERVAL': 10,
+        # Max number of scheduled jobs running at the same time
+        'SCHEDULE_CONCURRENCY': 10,
     }
     required_config_keys = ['SLACK_TOKEN']
 
-    def __init__(self, config_object):
-        """Initalize bot with config"""
+    def __init__(self, config_object, parent=None, workspace=None):
+        """Initalize bot with config
+
+        A bot made by `for_workspace` has ``parent``, it shares handlers,
+        web routes and executor pools with the parent bot.
+        """
         self.apply_config_object(config_object)
+        self.workspace = workspace
 
         self.configure_logging()
 
+        # Blocking client, for use outside of IOLoop (e.g. the CLI)
         self.client = APIClient(self.config.SLACK_TOKEN)
+        self.async_client = AsyncAPIClient(
+            self.config.SLACK_TOKEN,
+            api_url=self.config.SLACK_API_URL,
+            max_clients=self.config.API_MAX_CLIENTS)
+        self.outbound = OutboundScheduler(
+            self._send_reply,
+            rate=self.config.OUTBOUND_RATE,
+            burst=self.config.OUTBOUND_BURST,
+            channel_rate=self.config.OUTBOUND_CHANNEL_RATE,
+            channel_burst=self.config.OUTBOUND_CHANNEL_BURST,
+            concurrency=self.config.OUTBOUND_CONCURRENCY,
+            coalesce=self.config.OUTBOUND_COALESCE,
+            max_retries=self.config.OUTBOUND_MAX_RETRIES)
 
-        self.conn_pool = [None]
-        self._web_handlers = []
-        self._message_handlers = []
+        self.rtm_sender = RTMSender(self.config.RTM_REPLY_TIMEOUT)
+        self.watchdog = ConnectionWatchdog(
+            self.rtm_sender,
+            lambda: (self.conn_pool[0], self._reader),
+            self._on_stale_conn,
+            interval=self.config.PING_INTERVAL,
+            timeout=self.config.PING_TIMEOUT,
+            max_missed=self.config.PING_MAX_MISSED,
+            silence=self.config.READ_SILENCE_TIMEOUT)
+
+        self.scheduler = Scheduler(self._run_job, self.config.SCHEDULE_CONCURRENCY)
+
+        metrics.OUTBOUND_QUEUE_DEPTH.set_function(
+            self.outbound.queue_depth, (workspace or 'default',))
+        metrics.SCHEDULED_JOBS.set_function(
+            self.scheduler.__len__, (workspace or 'default',))
+
+        if parent is None:
+            self.executor = HandlerExecutor(
+                thread_workers=self.config.THREAD_POOL_SIZE,
+                process_workers=self.config.PROCESS_POOL_SIZE)
+        else:
+            self.executor = parent.executor
+
+        self.dispatcher = InboundDispatcher(
+            self.handle_message,
+            concurrency=self.config.HANDLER_CONCURRENCY,
+            queue_size=self.config.INBOUND_QUEUE_SIZE,
+            priority_func=self.get_priority,
+            levels=PRIORITY_LOW + 1,
+            shed_priority=self.config.INBOUND_SHED_PRIORITY,
+            overflow=self.config.INBOUND_OVERFLOW,
+            on_shed=self._on_shed)
+
+        # [primary, standby]
+        self.conn_pool = [None, None]
+        self._reader = None
+        self._standby_reader = None
+        self._standby_lost = Event()
+        self._standby_started = False
+        # Keys of handled events, to drop the ones received again after failover
+        self._recent_events = None
+        if self.config.STANDBY_CONNECTION:
+            self._recent_events = RecentSet(self.config.STANDBY_BUFFER_SIZE * 2)
+        elif self.config.EVENTS_API:
+            # Slack retries callbacks not acknowledged in time, only the
+            # ones received by this process are known here
+            self._recent_events = RecentSet(EVENTS_DEDUP_SIZE)
+        if parent is None:
+            self._web_handlers = []
+            self._message_handlers = []
+            self._handler_index = HandlerIndex()
+            # match_key -> PatternSet
+            self._pattern_sets = {}
+            # (trigger, func) registered by `every`, `at` and `cron`
+            self._job_specs = []
+        else:
+            self._web_handlers = parent._web_handlers
+            self._message_handlers = parent._message_handlers
+            self._handler_index = parent._handler_index
+            self._pattern_sets = parent._pattern_sets
+            self._job_specs = parent._job_specs
+        # Workspace name -> bot made by `for_workspace`, for web routes to
+        # find the bot of a workspace
+        self.workspace_bots = {}
 
         # For `prepare`
         self.ws_url = None
+        self.directory = None
+        # Set in lazy directory mode
+        self.directory_loader = None
+        self._directory_loading = False
+
+        self.recorder = None
+        if self.config.RECORD_PATH:
+            self.recorder = Recorder(
+                self.config.RECORD_PATH,
+                max_bytes=self.config.RECORD_MAX_BYTES,
+                backup_count=self.config.RECORD_BACKUP_COUNT)
 
-        self.register_default_events()
-        self.register_periodic_callback()
+        if parent is None:
+            self.register_default_events()
+            if self.config.BROADCAST_PATH:
+                self._web_handlers.append(
+                    (self.config.BROADCAST_PATH, BroadcastHandler, {'bot': self}))
+            if self.config.EVENTS_API:
+                self._web_handlers.append(
+                    (self.config.EVENTS_PATH, EventsHandler, {'bot': self}))
+        # user id -> direct message channel id
+        self._im_channels = {}
+        # Started in `start`, so that creating a bot doesn't touch IOLoop
+        self._periodic_callbacks_started = False
+        # Set when Events API callbacks could be handled
+        self._events_ready = Event()
+        # Only one of the processes forked in Events API mode writes the
+        # directory snapshot and runs scheduled jobs
+        self._primary_process = True
+        # HandlerFilter -> what `HandlerFilter.resolve` returned, per bot
+        # since ids differ between workspaces
+        self._resolved_filters = {}
+
+    def for_workspace(self, workspace, token, **config):
+        """Make a bot for another workspace, sharing handlers with this bot.
+
+        File paths in config get the workspace name, either by formatting
+        ``{workspace}`` in it, or as a suffix before the extension. Message
+        jobs scheduled on this bot so far are copied to the new bot, it's
+        added to `workspace_bots`.
+        """
+        config = dict(self.config, SLACK_TOKEN=token, WORKSPACES=None, **config)
+        for k in ('DIRECTORY_CACHE_PATH', 'RECORD_PATH', 'SCHEDULE_PATH'):
+            path = config.get(k)
+            if path:
+                config[k] = format_path(path, workspace=workspace)
+        bot = self.__class__(config, parent=self, workspace=workspace)
+        for job in self.scheduler.jobs():
+            if job.persistent:
+                bot.scheduler.add(job.trigger, text=job.text, channels=job.channels,
+                                  users=job.users, job_id=job.id)
+        self.workspace_bots[workspace] = bot
+        return bot
 
     def apply_config_object(self, config_object):
         config = ObjectDict(self.default_config)
@@ -64,7 +320,7 @@ class SlackBot(object):
 
         for k in self.default_config:
             if has_k(k):
-                print 'Apply config %s' % k
+                print('Apply config %s' % k)
                 config[k] = get_v(k)
 
         for k in self.required_config_keys:
@@ -90,56 +346,229 @@ class SlackBot(object):
 
         return decorator_factory(before_wrapper=before_wrapper)
 
-    def on_event(self, event_type, match_key=None, match_pattern=None, break_loop=False):
+    def on_event(self, event_type, match_key=None, match_pattern=None, break_loop=False,
+                 executor=None, timeout=None, channels=None, users=None, direct_only=False,
+                 mentions_bot=False):
         """
         ``event_type`` could be a string or tuple
+
+        If ``match_pattern`` is given, the handler is only called when the
+        value of ``match_key`` (default ``text``) in the message matches it
+        (from the start), named groups are passed as keyword arguments.
+
+        ``channels`` and ``users`` (names or ids), ``direct_only`` and
+        ``mentions_bot`` filter messages before the handler is called,
+        see `HandlerFilter`.
+
+        ``executor`` could be ``'thread'`` or ``'process'`` to run a blocking
+        or CPU heavy handler out of IOLoop, ``timeout`` (seconds) only
+        applies to such handlers.
         """
+        if executor is not None:
+            HandlerExecutor.check_kind(executor)
+
         def before_wrapper(func):
+            if executor is not None and is_coroutine_function(func):
+                raise ValueError('Coroutine handler %s could not run in executor' % func.__name__)
             options = dict(
                 match_key=match_key,
                 match_pattern=match_pattern,
                 break_loop=break_loop,
+                executor=executor,
+                timeout=timeout or self.config.HANDLER_TIMEOUT,
+                filter=HandlerFilter.make(
+                    channels=channels, users=users, direct_only=direct_only,
+                    mentions_bot=mentions_bot),
+                # Label in metrics
+                name='%s.%s' % (func.__module__, func.__name__),
             )
+            if match_pattern is not None:
+                key = options['match_key'] = match_key or 'text'
+                pattern_set = self._pattern_sets.setdefault(key, PatternSet())
+                options['pattern_id'] = pattern_set.add(match_pattern)
             spec = (event_type, func, options)
             self._message_handlers.append(spec)
+            self._handler_index.rebuild(self._message_handlers)
+
+        return decorator_factory(before_wrapper=before_wrapper)
+
+    def match_text(self, text_regex, break_loop=False, **kwargs):
+        """Decorator to register a message handler when text matchs the regex,
+        other keyword arguments are passed to `on_event`
+        """
+        return self.on_event(
+            ('message', None), match_key='text', match_pattern=text_regex, break_loop=break_loop,
+            **kwargs)
+
+    def every(self, seconds):
+        """Decorator to call ``func(bot)`` every ``seconds``, its output is
+        handled like outputs of event handlers, e.g. a `Reply`
+        """
+        return self._schedule_decorator(every=seconds)
+
+    def at(self, when):
+        """Decorator to call ``func(bot)`` once at ``when``, a timestamp or a
+        naive local datetime
+        """
+        return self._schedule_decorator(at=when)
+
+    def cron(self, expr):
+        """Decorator to call ``func(bot)`` by a cron expression in local time,
+        e.g. ``0 9 * * 1-5``, see `CronTrigger`
+        """
+        return self._schedule_decorator(cron=expr)
+
+    def _schedule_decorator(self, **kwargs):
+        trigger = make_trigger(**kwargs)
+
+        def before_wrapper(func):
+            spec = (trigger, func)
+            self._job_specs.append(spec)
+            # Bots that are started already get it right away
+            if self.scheduler.started:
+                self.scheduler.add(trigger, func=func)
 
         return decorator_factory(before_wrapper=before_wrapper)
 
-    def match_text(self, text_regex, break_loop=False):
-        """Decorator to register a message handler when text matchs the regex"""
-        #compiled = re.compile(text_regex)
-        pass
+    def schedule_message(self, text, channels=(), users=(), every=None, at=None, cron=None,
+                         job_id=None):
+        """Send ``text`` to ``channels`` and direct message to ``users`` (ids or
+        names, like `broadcast`) on schedule, by exactly one of ``every``
+        (seconds), ``at`` (a timestamp or datetime) and ``cron``. Return the
+        job, its ``id`` is for `cancel_job`.
+
+        These jobs are saved to ``SCHEDULE_PATH`` and survive restarts.
+        Without ``job_id``, one is made of the arguments, so scheduling the
+        same message again (e.g. on every start) replaces the saved job
+        instead of adding another.
+        """
+        trigger = make_trigger(every, at, cron)
+        return self.scheduler.add(
+            trigger, text=text, channels=channels, users=users, job_id=job_id)
+
+    def cancel_job(self, job_id):
+        """Cancel a scheduled job, return None if there is no such job"""
+        return self.scheduler.cancel(job_id)
+
+    def start_scheduler(self):
+        """Add jobs registered in code and saved ones, start running them,
+        once directory is ready since message jobs look up channels in it
+        """
+        if self.scheduler.started or not self._primary_process:
+            return
+        for trigger, func in self._job_specs:
+            self.scheduler.add(trigger, func=func)
+        path = self.config.SCHEDULE_PATH
+        if path:
+            self.scheduler.load(path)
+            PeriodicCallback(
+                self.save_schedule, self.config.SCHEDULE_SAVE_INTERVAL * 1000).start()
+        self.scheduler.start()
+
+    def save_schedule(self):
+        if self.scheduler.dirty:
+            try:
+                self.scheduler.save(self.config.SCHEDULE_PATH)
+            except (IOError, OSError) as e:
+                logging.error('Save jobs failed: %s', e)
+
+    @gen.coroutine
+    def _run_job(self, job):
+        if job.func is None:
+            results = yield self.broadcast(job.text, channels=job.channels, users=job.users)
+            failed = [r for r in results if not r['ok']]
+            if failed:
+                raise errors.ReplyFailed('Send to %s failed: %s' % (
+                    ', '.join(r['target'] for r in failed), failed[0]['error']))
+            return
+
+        output = job.func(self)
+        if is_awaitable(output):
+            output = yield gen.convert_yielded(output)
+        if output is not None:
+            yield self.handle_output(output, None)
 
     def register_default_events(self):
         """Register some default event handlers to grant the bot basic
         functionality & intelligence, e.g. update channels upon
         channel_created & other events.
         """
-        # TODO add some default events to:
-        # 1. Keep channels, groups, users up to date
-        # 2. Default reply for direct message if not implement
+        # TODO default reply for direct message if not implement
 
-    def register_periodic_callback(self, second=60):
-        PeriodicCallback(
-            self._check_connection, second * 1000).start()
+        # Keep channels, groups, users up to date, use `msg.bot` since
+        # bots of other workspaces share this handler
+        def update_directory(msg):
+            if msg.bot.directory is not None and msg.bot.directory.apply_event(msg.raw):
+                # Names in filters may point to other ids now
+                msg.bot.resolve_filters()
 
-    def _check_connection(self):
-        conn = self.conn_pool[0]
-        if conn:
-            if conn.protocol:
-                conn.protocol.write_ping(b'a')
-                logging.debug('Ping: a')
+        for event_type in DIRECTORY_EVENTS:
+            self.on_event(event_type)(update_directory)
+
+    def register_periodic_callback(self):
+        if not self.config.EVENTS_API:
+            self.watchdog.start()
+
+        if self.config.DIRECTORY_CACHE_PATH:
+            PeriodicCallback(
+                self.save_directory, self.config.DIRECTORY_CACHE_INTERVAL * 1000).start()
+
+        if self.recorder is not None:
+            PeriodicCallback(self.recorder.flush, 1000).start()
+
+    def resolve_filters(self):
+        """Resolve names in handler filters to ids by directory, it's done
+        when directory is ready and after it changes
+        """
+        self._resolved_filters.clear()
+        for _, _, options in self._message_handlers:
+            if options['filter'] is not None:
+                self._resolve_filter(options['filter'])
+
+    def _resolve_filter(self, handler_filter):
+        resolved = handler_filter.resolve(self.directory)
+        # Names not found (e.g. directory is loading) are looked for again next time
+        if resolved[2]:
+            self._resolved_filters[handler_filter] = resolved
+        return resolved
+
+    def save_directory(self):
+        # A partial directory would pass for a fresh one on next start
+        if not self._primary_process:
             return
+        if self.directory is not None and self.directory.dirty and self.directory.complete:
+            try:
+                self.directory.save(self.config.DIRECTORY_CACHE_PATH)
+            except (IOError, OSError) as e:
+                logging.error('Save directory snapshot failed: %s', e)
 
-            logging.debug(
-                'Connection: .protocol.*_terminated %s %s; .stream.close() %s; .tcp_client.resolver.executor %s',
-                conn.protocol.client_terminated,
-                conn.protocol.server_terminated,
-                conn.stream.closed(),
-                conn.tcp_client.resolver.executor,
-            )
-        else:
-            logging.warn('No connection in conn_pool')
+    @property
+    def directory_fields(self):
+        return dict(
+            user_fields=self.config.DIRECTORY_USER_FIELDS,
+            channel_fields=self.config.DIRECTORY_CHANNEL_FIELDS)
+
+    @property
+    def users(self):
+        return self.directory.users
+
+    @property
+    def channels(self):
+        return self.directory.channels
+
+    @property
+    def groups(self):
+        return self.directory.groups
+
+    def _on_stale_conn(self, conn, reason):
+        if conn is not self.conn_pool[0]:
+            return
+        self.recycle_conn()
+        # Closing handshake can't finish on a dead connection, drop the
+        # socket so that the reader sees it closed right away
+        stream = getattr(conn.protocol, 'stream', None)
+        if stream is not None:
+            stream.close()
 
     @gen.coroutine
     def get_conn(self):
@@ -147,9 +576,10 @@ class SlackBot(object):
             # Assume this operation always success
             conn = yield websocket_connect(self.ws_url)
             self.conn_pool[0] = conn
-
-            print 'conn', conn, dir(conn)
-            print conn.__dict__
+            self._reader = ConnectionReader(
+                conn, read_ahead=self.config.READ_AHEAD, on_reply=self._on_rtm_reply,
+                pending_replies=self.rtm_sender.__len__)
+            logging.debug('Connected to RTM: %r', conn)
 
         raise gen.Return(self.conn_pool[0])
 
@@ -160,49 +590,258 @@ class SlackBot(object):
         conn = self.conn_pool[0]
         if conn is not None:
             conn.close()
+            self.rtm_sender.fail_conn(conn)
 
         self.conn_pool[0] = None
+        self._reader = None
+
+    def _on_rtm_reply(self, frame):
+        try:
+            raw = json_loads(frame)
+        except ValueError:
+            return False
+        return 'reply_to' in raw and self.rtm_sender.ack(raw)
 
+    def promote_standby(self):
+        """Make standby connection the primary one, return False if there's
+        no standby connection available
+        """
+        conn = self.conn_pool[1]
+        reader = self._standby_reader
+        if conn is None or reader is None or reader.closed:
+            return False
+
+        logging.info('Promote standby connection %s', conn)
+        reader.read_ahead = self.config.READ_AHEAD
+        reader.on_reply = self._on_rtm_reply
+        reader.pending_replies = self.rtm_sender.__len__
+        reader.promote(self._recent_events)
+        self.conn_pool[0] = conn
+        self._reader = reader
+        self.conn_pool[1] = None
+        self._standby_reader = None
+        self._standby_lost.set()
+        return True
+
+    @gen.coroutine
+    def _keep_standby(self):
+        """Dial a standby connection, and dial again when it's closed or promoted"""
+        backoff = Backoff(self.config.RECONNECT_BACKOFF_BASE, self.config.RECONNECT_BACKOFF_MAX)
+        while True:
+            try:
+                rv = yield self.async_client.api_call('rtm.connect')
+                conn = yield websocket_connect(rv['url'])
+            except Exception as e:
+                delay = backoff.next()
+                logging.warn('Dial standby connection failed: %s, retry in %.1fs', e, delay)
+                yield gen.sleep(delay)
+                continue
+            backoff.reset()
+
+            self._standby_lost.clear()
+            self.conn_pool[1] = conn
+            self._standby_reader = ConnectionReader(
+                conn, primary=False, buffer_size=self.config.STANDBY_BUFFER_SIZE,
+                on_close=self._on_standby_close)
+            logging.info('Standby connection ready %s', conn)
+            yield self._standby_lost.wait()
+
+    def _on_standby_close(self, reader):
+        if reader is self._standby_reader:
+            logging.warn('Standby connection was closed')
+            self.conn_pool[1] = None
+            self._standby_reader = None
+            self._standby_lost.set()
+
+    @gen.coroutine
     def prepare(self):
+        cache_path = self.config.DIRECTORY_CACHE_PATH
+        if self.directory is None and cache_path:
+            self.directory = Directory.load(cache_path, **self.directory_fields)
+
+        directory = self.directory
+        if (directory is not None and directory.complete and
+                directory.is_fresh(self.config.DIRECTORY_CACHE_MAX_AGE)):
+            # Directory is kept up to date by events, only a websocket url is needed
+            # https://api.slack.com/methods/rtm.connect
+            rv = yield self.async_client.api_call('rtm.connect')
+            self.apply_rtm_connect(rv)
+            return
+
+        if self.config.DIRECTORY_LAZY:
+            rv = yield self.async_client.api_call('rtm.connect')
+            self.apply_rtm_connect(rv)
+            if not self._directory_loading:
+                self.start_directory_loading()
+            return
+
         # https://api.slack.com/methods/rtm.start
+        rv = yield self.async_client.api_call('rtm.start', simple_latest=1, no_unreads=1)
+        self.apply_rtm_start(rv)
+        if cache_path:
+            self.save_directory()
+
+    def start_directory_loading(self):
+        """Load directory in background, into a stale snapshot if there is one"""
+        if self.directory is None:
+            self.directory = Directory(complete=False, **self.directory_fields)
+        else:
+            self.directory.complete = False
+        self.directory_loader = DirectoryLoader(
+            self.async_client, self.directory, self.config.DIRECTORY_PAGE_SIZE)
+        self._directory_loading = True
+        IOLoop.current().spawn_callback(self._load_directory)
+
+    @gen.coroutine
+    def _load_directory(self):
+        try:
+            yield self.directory_loader.load_all()
+        except Exception as e:
+            # Tried again on the next reconnect
+            logging.error('Load directory failed: %s\n%s', e, traceback.format_exc())
+            return
+        finally:
+            self._directory_loading = False
+
+        self.resolve_filters()
+        if self.config.DIRECTORY_CACHE_PATH:
+            self.save_directory()
+
+    @gen.coroutine
+    def lookup_message(self, msg):
+        """Fetch channel and user of the message if they are not loaded yet"""
+        channel_id = msg.channel_id
+        # Direct messages are not in the directory
+        if isinstance(channel_id, string_types) and not channel_id.startswith('D'):
+            yield self.directory_loader.lookup_channel(channel_id)
+        if isinstance(msg.user, string_types):
+            yield self.directory_loader.lookup_user(msg.user)
+
+    @gen.coroutine
+    def prepare_events(self):
+        """Get ready to handle Events API callbacks, in each of the processes.
+        There's no RTM session, selfinfo comes from auth.test, and the
+        directory is loaded page by page if the snapshot is not fresh.
+        """
+        index = task_id()
+        if index is not None:
+            # Processes share the snapshot and jobs, but each records its own events
+            self._primary_process = index == 0
+            if self.recorder is not None:
+                self.recorder.path = format_path(self.recorder.path, process=index)
+
+        cache_path = self.config.DIRECTORY_CACHE_PATH
+        if self.directory is None and cache_path:
+            self.directory = Directory.load(cache_path, **self.directory_fields)
+
+        # https://api.slack.com/methods/auth.test
+        rv = yield self.async_client.api_call('auth.test')
+        self.selfinfo = ObjectDict(id=rv['user_id'], name=rv.get('user'))
+        self.team = ObjectDict(id=rv.get('team_id'), name=rv.get('team'))
+        logging.info('Got selfinfo: %s', self.selfinfo)
+
+        directory = self.directory
+        if not (directory is not None and directory.complete and
+                directory.is_fresh(self.config.DIRECTORY_CACHE_MAX_AGE)):
+            self.start_directory_loading()
+        self.resolve_filters()
+
+    def prepare_sync(self):
+        """Blocking version of `prepare`, for use outside of IOLoop"""
         rv = self.client.api_call('rtm.start?simple_latest=1&no_unreads=1')
+        self.apply_rtm_start(rv)
 
-        # TODO store users, channels here
+    def apply_rtm_connect(self, rv):
         self.ws_url = rv['url']
         logging.info('Got ws url: %s', self.ws_url)
 
         self.selfinfo = ObjectDict(rv['self'])
         logging.info('Got selfinfo: %s', str(self.selfinfo)[:20])
-        self.users = SearchList(rv['users'], ['id', 'name'])
+        self.team = ObjectDict(rv.get('team') or {})
+
+    def apply_rtm_start(self, rv):
+        self.apply_rtm_connect(rv)
+
+        self.directory = Directory.from_rtm_start(rv, **self.directory_fields)
+        # Mark as changed so that the new data will be saved
+        self.directory.dirty = True
         logging.info('Got users: %s', str(self.users)[:20])
-        self.channels = SearchList(rv['channels'], ['id', 'name'])
         logging.info('Got channels: %s', str(self.channels)[:20])
-        self.groups = SearchList(rv['groups'], ['id', 'name'])
         logging.info('Got groups: %s', str(self.groups)[:20])
 
     @gen.coroutine
     def start(self):
-        """Start the bot service, keep underlying `_start` in a while True loop
+        """Start the bot service, keep underlying `_start` in a while True loop.
+        In Events API mode, only get ready for `handle_event`.
         """
+        if not self._periodic_callbacks_started:
+            self._periodic_callbacks_started = True
+            self.register_periodic_callback()
+
+        if self.config.METRICS_PATH:
+            metrics.monitor_loop_lag(self.config.LOOP_LAG_INTERVAL)
+
+        if self.config.EVENTS_API:
+            yield self._start_events()
+            return
+
+        backoff = Backoff(self.config.RECONNECT_BACKOFF_BASE, self.config.RECONNECT_BACKOFF_MAX)
         while True:
+            started_at = time.time()
             try:
                 yield self._start()
             except errors.WSConnectionClosed as e:
                 logging.warn('Connection was closed: %s', e)
-                self.recycle_conn()
+            except Exception as e:
+                logging.error('Connection failed: %s\n%s', e, traceback.format_exc())
+            self.recycle_conn()
+
+            if self.promote_standby():
+                continue
+
+            if time.time() - started_at > self.config.RECONNECT_BACKOFF_RESET:
+                backoff.reset()
+            delay = backoff.next()
+            logging.info('Reconnect in %.1fs', delay)
+            yield gen.sleep(delay)
+
+    @gen.coroutine
+    def _start_events(self):
+        backoff = Backoff(self.config.RECONNECT_BACKOFF_BASE, self.config.RECONNECT_BACKOFF_MAX)
+        while True:
+            try:
+                yield self.prepare_events()
+                break
+            except Exception as e:
+                delay = backoff.next()
+                logging.error('Prepare for events failed, retry in %.1fs: %s\n%s',
+                              delay, e, traceback.format_exc())
+                yield gen.sleep(delay)
+        self.start_scheduler()
+        # Events received so far were waiting for selfinfo
+        self._events_ready.set()
 
     @gen.coroutine
     def _start(self):
         """Establish websocket connection and start receiving and handling messages
         """
-        self.prepare()
-        conn = yield self.get_conn()
+        # A promoted standby connection is ready to use
+        if self.conn_pool[0] is None:
+            yield self.prepare()
+            self.resolve_filters()
+            self.start_scheduler()
+        yield self.get_conn()
+        reader = self._reader
+
+        if self.config.STANDBY_CONNECTION and not self._standby_started:
+            self._standby_started = True
+            IOLoop.current().spawn_callback(self._keep_standby)
 
         logging.info('Start recv from ws connection')
         while True:
             logging.debug('!Read message')
 
-            msg_str = yield conn.read_message()
+            msg_str = yield reader.read()
 
             logging.debug('!Got msg str, %s', msg_str)
 
@@ -213,49 +852,167 @@ class SlackBot(object):
                 raise errors.WSConnectionClosed(
                     'Got None from read_message, means connection is closed')
 
-            try:
-                msg = Message(json.loads(msg_str), self)
-            except Exception as e:
-                logging.error('Parse message failed: %s; msg: %s', e, msg_str)
-                continue
-            else:
-                try:
-                    yield self.handle_message(msg)
-                except Exception as e:
-                    logging.error('Handle message failed, %s\n%s', e, traceback.format_exc())
+            if self.recorder is not None:
+                self.recorder.write(msg_str)
+
+            yield self.handle_frame(msg_str)
+
+    @gen.coroutine
+    def handle_frame(self, msg_str):
+        """Parse a frame read from websocket and put it into dispatcher"""
+        # Skip events that no handler is interested in before parsing
+        msg_type = sniff_type(msg_str)
+        if msg_type is not None:
+            metrics.EVENTS_RECEIVED.inc((msg_type,))
+            if msg_type not in self._handler_index:
+                return
+
+        try:
+            raw = json_loads(msg_str)
+        except Exception as e:
+            logging.error('Parse message failed: %s; msg: %s', e, msg_str)
+            return
+
+        if msg_type is None:
+            # Acknowledgement of a reply sent over RTM
+            if 'reply_to' in raw and self.rtm_sender.ack(raw):
+                return
+            metrics.EVENTS_RECEIVED.inc((raw.get('type'),))
+
+        if self._recent_events is not None:
+            key = event_key(raw)
+            if key is not None:
+                if key in self._recent_events:
+                    logging.debug('Drop duplicated event %s', key)
+                    return
+                self._recent_events.add(key)
+
+        # Waits only when the inbound queue is full,
+        # errors of handling are logged by dispatcher
+        yield self.dispatcher.put(Message(raw, self))
+
+    @gen.coroutine
+    def handle_event(self, payload):
+        """Put the event of an Events API callback into dispatcher, like
+        `handle_frame` does for RTM frames
+        """
+        raw = payload.get('event')
+        if not isinstance(raw, dict):
+            return
+        msg_type = raw.get('type')
+        metrics.EVENTS_RECEIVED.inc((msg_type,))
+        if msg_type not in self._handler_index:
+            return
+
+        event_id = payload.get('event_id')
+        if event_id is not None:
+            if event_id in self._recent_events:
+                logging.debug('Drop retried event %s', event_id)
+                return
+            self._recent_events.add(event_id)
+
+        if self.recorder is not None:
+            self.recorder.write(json.dumps(raw))
+
+        # Handling needs selfinfo from auth.test
+        if not self._events_ready.is_set():
+            yield self._events_ready.wait()
+        yield self.dispatcher.put(Message(raw, self))
+
+    def get_priority(self, msg):
+        """Priority of an inbound message, direct messages and mentions of
+        the bot come first, events like ``user_typing`` come last
+        """
+        priority = self.config.INBOUND_PRIORITIES.get(msg.type)
+        if priority is not None:
+            return priority
+        if msg.type == 'message':
+            channel_id = msg.channel_id
+            if isinstance(channel_id, string_types) and channel_id.startswith('D'):
+                return PRIORITY_HIGH
+            selfinfo = getattr(self, 'selfinfo', None)
+            text = msg.raw.get('text')
+            if selfinfo and text and '<@%s' % selfinfo['id'] in text:
+                return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+
+    def _on_shed(self, msg, action):
+        logging.debug('Inbound queue is full, %s %s', action, msg)
+        metrics.INBOUND_SHED.inc((msg.type, action))
 
     @gen.coroutine
     def handle_message(self, msg):
         logging.info('Got msg: %s', msg)
         #logging.debug('msg handlers %s', self._message_handlers)
 
+        self_id = self.selfinfo['id']
         # Ignore bot itself
-        if msg.user and msg.user == self.selfinfo['id']:
+        if msg.user and msg.user == self_id:
             logging.debug('Got message from bot itself, ignore: %s', msg)
             return
 
-        for event_type, handler_func, options in self._message_handlers:
-            msg_type = msg.type
-            msg_subtype = msg.subtype
-            #logging.debug('msg type %s %s', msg_type, event_type)
-
-            if match_event_type((msg_type, msg_subtype), event_type):
-                logging.info('Match event_type %s, call handler %s', event_type, handler_func)
-                # TODO more options
-                #match_key=match_key,
-                #match_pattern=match_pattern,
-                #break_loop=break_loop,
-
-                output = handler_func(msg)
-                if output is None:
-                    logging.debug('output is None, skip')
+        # Directory is still loading, fetch what this message refers to
+        if self.directory_loader is not None and not self.directory.complete:
+            yield self.lookup_message(msg)
+
+        # Results of pattern sets, evaluated once per message on demand
+        matches = {}
+
+        # Only handlers registered for this (type, subtype) are visited,
+        # already in registration order
+        for event_type, handler_func, options in self._handler_index.get(msg.type, msg.subtype):
+            # Set lookups, cheaper than matching patterns
+            handler_filter = options['filter']
+            if handler_filter is not None:
+                resolved = (self._resolved_filters.get(handler_filter) or
+                            self._resolve_filter(handler_filter))
+                rejected = handler_filter.check(msg, resolved, self_id)
+                if rejected is not None:
+                    metrics.FILTER_REJECTIONS.inc((options['name'], rejected))
+                    continue
+
+            kwargs = {}
+            if 'pattern_id' in options:
+                key = options['match_key']
+                if key not in matches:
+                    matches[key] = self.match_patterns(key, msg.raw.get(key))
+                kwargs = matches[key].get(options['pattern_id'])
+                if kwargs is None:
+                    continue
+
+            logging.info('Match event_type %s, call handler %s', event_type, handler_func)
+            labels = (options['name'],)
+            metrics.HANDLER_CALLS.inc(labels)
+            start = time.time()
+            try:
+                if options['executor']:
+                    output = yield self.executor.run(
+                        options['executor'], handler_func, msg, kwargs, options['timeout'])
                 else:
-                    self.handle_output(output, msg)
+                    output = handler_func(msg, **kwargs)
+                    # `async def` handlers and coroutines
+                    if is_awaitable(output):
+                        output = yield gen.convert_yielded(output)
+            except Exception:
+                metrics.HANDLER_ERRORS.inc(labels)
+                raise
+            finally:
+                metrics.HANDLER_LATENCY.observe(time.time() - start, labels)
+            if output is None:
+                logging.debug('output is None, skip')
+            else:
+                yield self.handle_output(output, msg)
 
-                if options.get('break_loop'):
-                    logging.info('Break message handling loop')
-                    break
+            if options.get('break_loop'):
+                logging.info('Break message handling loop')
+                break
 
+    def match_patterns(self, key, value):
+        if not isinstance(value, string_types):
+            return {}
+        return self._pattern_sets[key].match(value)
+
+    @gen.coroutine
     def handle_output(self, output, msg):
         # text:
         # {u'text': u'a', u'ts': u'1440669389.000032', u'user': u'U03URT0PU', u'team': u'T02Q87WRQ', u'type': u'message', u'channel': u'C09J98JLV'}
@@ -264,34 +1021,181 @@ class SlackBot(object):
         if isinstance(output, Reply):
             pass
         # TODO the simple way
-        # elif isinstance(output, basestring)
+        # elif isinstance(output, string_types)
         else:
             raise errors.ReplyFailed(
                 'Could not handle output: %s, %s' % (type(output), output))
 
         # Ensure output is a Reply object
-        self.send_reply(output)
+        yield self.send_reply(output)
 
+    @gen.coroutine
     def send_reply(self, reply):
+        """Queue the reply in outbound scheduler, resolve when it's sent"""
         logging.info('Send reply: %s', reply)
-        return self.client.send_message(reply.channel_id, reply.text, **reply.extra_args)
+        rv = yield self.outbound.put(reply)
+        raise gen.Return(rv)
+
+    @gen.coroutine
+    def _send_reply(self, reply):
+        conn = self.conn_pool[0]
+        if self.config.RTM_REPLY and conn is not None and can_send_over_rtm(reply):
+            try:
+                future = self.rtm_sender.send(conn, reply.channel_id, reply.text)
+                # Make sure the reader goes on to find the acknowledgement
+                if self._reader is not None:
+                    self._reader.wake()
+                rv = yield future
+            except errors.ReplyFailed as e:
+                logging.warn('Send reply over RTM failed, fall back to HTTP: %s', e)
+                metrics.RTM_REPLY_FALLBACKS.inc()
+            else:
+                metrics.REPLIES_SENT.inc(('rtm',))
+                rv['channel'] = reply.channel_id
+                raise gen.Return(rv)
+
+        rv = yield self.async_client.send_message(reply.channel_id, reply.text, **reply.extra_args)
+        metrics.REPLIES_SENT.inc(('http',))
+        raise gen.Return(rv)
+
+    def send_message(self, text, channel=None, channel_id=None, **kwargs):
+        """Send a message by the blocking client, for use outside of IOLoop
+        (e.g. the CLI), ``channel`` is a channel name
+        """
+        if not channel_id:
+            item = self.channels.get(name=channel) or self.groups.get(name=channel)
+            if not item:
+                raise errors.ReplyFailed('Channel %s not found' % channel)
+            channel_id = item['id']
+        return self.client.send_message(channel_id, text, **kwargs)
+
+    @gen.coroutine
+    def broadcast(self, text, channels=(), users=(), where=None, concurrency=None,
+                  on_result=None, **kwargs):
+        """Send ``text`` to many channels and users, return a list of results.
 
-    def send_message(self, *args, **kwargs):
-        """Simple """
+        ``channels`` are ids or names, ``users`` are ids or names of users to
+        send direct messages to, ``where`` is a dict of fields to select
+        channels and groups from directory, e.g. ``{'is_member': True}``.
+
+        Messages go through the outbound scheduler, so rate limits apply,
+        at most ``concurrency`` of them are queued there at the same time.
+        Each result is a dict of ``target``, ``channel_id``, ``ok`` and
+        ``ts`` or ``error``, and is passed to ``on_result`` once it's known.
+        """
+        semaphore = Semaphore(concurrency or self.config.BROADCAST_CONCURRENCY)
+        targets = yield self.resolve_targets(channels, users, where, semaphore)
+        results = []
+
+        @gen.coroutine
+        def send(target, channel_id):
+            result = dict(target=target, channel_id=channel_id)
+            if channel_id is None:
+                result.update(ok=False, error='not found')
+            else:
+                with (yield semaphore.acquire()):
+                    try:
+                        rv = yield self.outbound.put(Reply(channel_id, text, **kwargs))
+                    except Exception as e:
+                        result.update(ok=False, error=str(e))
+                    else:
+                        result.update(ok=True, ts=rv.get('ts'))
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+        logging.info('Broadcast to %s targets', len(targets))
+        yield [send(target, channel_id) for target, channel_id in targets]
+        raise gen.Return(results)
+
+    @gen.coroutine
+    def resolve_targets(self, channels=(), users=(), where=None, semaphore=None):
+        """Return a list of ``(target, channel_id)``, channel_id is None if
+        the target is not found. Each channel appears once.
+
+        Direct message channels not known yet are opened concurrently,
+        at most ``BROADCAST_CONCURRENCY`` at a time unless ``semaphore``
+        is given.
+        """
+        targets = []
+        for name in channels:
+            name = name.lstrip('#')
+            item = (self.channels.get(id=name) or self.channels.get(name=name) or
+                    self.groups.get(id=name) or self.groups.get(name=name))
+            targets.append((name, item['id'] if item else None))
+
+        if where:
+            for item in self.channels.filter(**where) + self.groups.filter(**where):
+                targets.append((item['name'], item['id']))
+
+        if semaphore is None:
+            semaphore = Semaphore(self.config.BROADCAST_CONCURRENCY)
+
+        @gen.coroutine
+        def open_im(user):
+            if user is None:
+                raise gen.Return(None)
+            channel_id = self._im_channels.get(user['id'])
+            if channel_id is None:
+                with (yield semaphore.acquire()):
+                    channel_id = yield self.get_im_channel(user['id'])
+            raise gen.Return(channel_id)
+
+        names = [name.lstrip('@') for name in users]
+        channel_ids = yield [
+            open_im(self.users.get(id=name) or self.users.get(name=name)) for name in names]
+        targets.extend(zip(names, channel_ids))
+
+        seen = set()
+        rv = []
+        for target, channel_id in targets:
+            if channel_id is not None:
+                if channel_id in seen:
+                    continue
+                seen.add(channel_id)
+            rv.append((target, channel_id))
+        raise gen.Return(rv)
+
+    @gen.coroutine
+    def get_im_channel(self, user_id):
+        """Id of the direct message channel with a user, None if it can't be opened"""
+        channel_id = self._im_channels.get(user_id)
+        if channel_id is None:
+            try:
+                channel_id = yield self.async_client.open_im(user_id)
+            except errors.APICallFailed as e:
+                logging.warn('Open direct message with %s failed: %s', user_id, e)
+                raise gen.Return(None)
+            self._im_channels[user_id] = channel_id
+        raise gen.Return(channel_id)
 
     def run(self):
         """Run bot as a http server
         """
-        application = make_application(self._web_handlers, {
-            # If True, will make the server restart when file changes
-            'debug': self.config.DEBUG,
-        })
+        if self.config.BROADCAST_PATH and not self.config.BROADCAST_TOKEN:
+            raise ValueError('BROADCAST_TOKEN is required by BROADCAST_PATH')
 
-        run_server(self.start, application, self.config.PORT)
+        if self.config.WORKSPACES:
+            if self.config.EVENTS_API:
+                raise ValueError('EVENTS_API does not work with WORKSPACES')
+            if self.config.BROADCAST_PATH and self.config.NUM_PROCESSES != 1:
+                # A request could land in a process not running the workspace
+                raise ValueError('BROADCAST_PATH does not work with WORKSPACES in many processes')
+            Runtime(self, self.config.WORKSPACES, self.config.NUM_PROCESSES).run()
+            return
 
+        num_processes = 1
+        if self.config.EVENTS_API:
+            if not self.config.SLACK_SIGNING_SECRET:
+                raise ValueError('SLACK_SIGNING_SECRET is required by EVENTS_API')
+            # Processes share the listening socket, each handles the
+            # callbacks it accepts
+            num_processes = self.config.NUM_PROCESSES
+
+        application = make_application(self._web_handlers, {
+            # If True, will make the server restart when file changes,
+            # which doesn't work with multiple processes
+            'debug': self.config.DEBUG and num_processes == 1,
+        }, metrics_path=self.config.METRICS_PATH)
 
-def match_event_type(types, event_type):
-    if isinstance(event_type, basestring):
-        return types[0] == event_type
-    else:  # tuple
-        return types == event_type
+        run_server(self.start, application, self.config.PORT, num_processes, self.config.ENGINE)
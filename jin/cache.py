@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import threading
+import collections
+from functools import wraps
+from tornado import gen
+
+from .compat import iteritems, is_awaitable
+from .message import Reply
+from . import metrics
+
+
+CACHE_KEY_FIELDS = ('text', 'channel', 'user')
+
+# name -> ResponseCache, for invalidating from web routes
+CACHES = {}
+
+
+class ResponseCache(object):
+    """LRU cache with expiration, for outputs of handlers
+
+    Entries older than ``ttl`` seconds are dropped when read, the least
+    recently used entry is evicted when there are more than ``max_size``.
+    Handlers in thread executor share it, so it's guarded by a lock.
+    """
+
+    def __init__(self, name, ttl=60, max_size=1000):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> (expires_at, value), the most recently used at the end
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._labels = (name,)
+
+    def get(self, key):
+        """Return the value of ``key``, or None if it's missing or expired"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                metrics.CACHE_MISSES.inc(self._labels)
+                return None
+            # Move to the end
+            self._data[key] = entry
+        metrics.CACHE_HITS.inc(self._labels)
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + ttl, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                metrics.CACHE_EVICTIONS.inc(self._labels)
+
+    def invalidate(self, **fields):
+        """Drop entries whose key has all the ``fields``, e.g.
+        ``invalidate(service='db')``, or all entries without ``fields``.
+        Return the number of dropped entries.
+        """
+        with self._lock:
+            if not fields:
+                count = len(self._data)
+                self._data.clear()
+                return count
+
+            items = fields.items()
+            keys = [k for k in self._data if all(i in k for i in items)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def __len__(self):
+        return len(self._data)
+
+
+def make_cache_key(msg, kwargs, key_fields=CACHE_KEY_FIELDS):
+    """A hashable view of the message: ``key_fields`` of it and the keyword
+    arguments from pattern matching. Text is stripped and lowercased, so
+    ``Status db`` and ``status db `` share an entry.
+    """
+    key = []
+    for field in key_fields:
+        if field == 'text':
+            value = msg.raw.get('text') or ''
+            value = ' '.join(value.lower().split())
+        elif field == 'channel':
+            value = msg.channel_id
+        elif field == 'user':
+            value = msg.user
+        else:
+            value = msg.raw.get(field)
+        key.append((field, value))
+    # Bots of different workspaces share handlers and so their caches
+    workspace = getattr(msg.bot, 'workspace', None)
+    if workspace is not None:
+        key.append(('workspace', workspace))
+    # Pair of (name, value) so that `invalidate` could look for it
+    key.extend(sorted(iteritems(kwargs)))
+    return frozenset(key)
+
+
+def cached(ttl=60, max_size=1000, key=CACHE_KEY_FIELDS, name=None):
+    """Decorator to cache outputs of a handler, put it under `SlackBot.on_event`::
+
+        @bot.match_text(r'status (?P<service>\w+)')
+        @cached(ttl=30, key=('text',))
+        def status(msg, service):
+            ...
+
+    ``key`` is the message fields to tell requests apart, besides the
+    keyword arguments from pattern matching. A cached `Reply` goes to the
+    channel of the new message, if it was a reply to the message's channel.
+    Outputs of coroutine handlers are cached once they are resolved,
+    requests coming in meanwhile wait for the same call instead of making
+    their own. ``None`` outputs and failures are not cached.
+
+    The cache is registered in `CACHES` by ``name`` (default the qualified
+    function name), and is available as ``cache`` of the decorated function.
+    """
+    key_fields = tuple(key)
+
+    def decorator(func):
+        cache_name = name or '%s.%s' % (func.__module__, func.__name__)
+        cache = ResponseCache(cache_name, ttl, max_size)
+        CACHES[cache_name] = cache
+        # key -> (future, msg) of the calls not resolved yet
+        in_flight = {}
+
+        @wraps(func)
+        def wrapper(msg, **kwargs):
+            cache_key = make_cache_key(msg, kwargs, key_fields)
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return _from_entry(entry, msg)
+            if cache_key in in_flight:
+                future, first_msg = in_flight[cache_key]
+                return _follow(future, first_msg, msg)
+
+            output = func(msg, **kwargs)
+            if output is None:
+                return None
+            if not is_awaitable(output):
+                cache.set(cache_key, _to_entry(output, msg))
+                return output
+
+            future = gen.convert_yielded(output)
+            in_flight[cache_key] = (future, msg)
+
+            def on_done(future):
+                if in_flight.get(cache_key, (None,))[0] is future:
+                    del in_flight[cache_key]
+                if future.cancelled() or future.exception() is not None:
+                    return
+                output = future.result()
+                if output is not None:
+                    cache.set(cache_key, _to_entry(output, msg))
+
+            future.add_done_callback(on_done)
+            return future
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def _to_entry(output, msg):
+    if isinstance(output, Reply):
+        # Keep the payload, channel is filled when replaying
+        to_msg_channel = output.channel_id == msg.channel_id
+        return (Reply, output.text, dict(output.extra_args),
+                None if to_msg_channel else output.channel_id)
+    return (None, output)
+
+
+@gen.coroutine
+def _follow(future, first_msg, msg):
+    """Output of a call made for ``first_msg``, as if it's for ``msg``"""
+    output = yield future
+    if output is not None:
+        output = _from_entry(_to_entry(output, first_msg), msg)
+    raise gen.Return(output)
+
+
+def _from_entry(entry, msg):
+    if entry[0] is Reply:
+        _, text, extra_args, channel_id = entry
+        return Reply(channel_id or msg.channel_id, text, **extra_args)
+    return entry[1]
+
+
+def invalidate(name, **fields):
+    """Invalidate cache ``name`` in `CACHES`, see `ResponseCache.invalidate`"""
+    cache = CACHES.get(name)
+    if cache is None:
+        raise KeyError('No cache named %s' % name)
+    return cache.invalidate(**fields)
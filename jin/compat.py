@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Python 2 and 3 compatibility, only what jin uses
+
+import sys
+import inspect
+
+PY2 = sys.version_info[0] == 2
+
+if PY2:
+    string_types = (basestring,)  # noqa
+    text_type = unicode  # noqa
+    from urllib import urlencode  # noqa
+
+    def iteritems(d):
+        return d.iteritems()
+
+    def itervalues(d):
+        return d.itervalues()
+else:
+    string_types = (str,)
+    text_type = str
+    from urllib.parse import urlencode  # noqa
+
+    def iteritems(d):
+        return iter(d.items())
+
+    def itervalues(d):
+        return iter(d.values())
+
+
+def is_coroutine_function(func):
+    """Whether ``func`` is ``async def`` or decorated by `gen.coroutine`"""
+    if getattr(func, '__tornado_coroutine__', False):
+        return True
+    iscoroutinefunction = getattr(inspect, 'iscoroutinefunction', None)
+    return bool(iscoroutinefunction and iscoroutinefunction(func))
+
+
+def is_awaitable(obj):
+    """Whether ``obj`` is a Future or a native coroutine (``async def``),
+    which could be yielded in `gen.coroutine`
+    """
+    from tornado.concurrent import is_future
+    return is_future(obj) or hasattr(obj, '__await__')
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import time
+import logging
+import itertools
+from collections import deque
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.locks import Condition
+
+from .utils import json_loads
+from .const import RTM_MAX_TEXT_LENGTH
+from . import errors
+from . import metrics
+
+
+class ConnectionReader(object):
+    """Read frames from a websocket connection in background
+
+    As primary, it reads at most ``read_ahead`` frames ahead of the
+    consumer, so the consumer still controls how fast frames are read. As
+    standby, it reads all the time and only keeps the latest
+    ``buffer_size`` frames, so that frames received during a failover could
+    be handled after promotion.
+
+    Frames that look like acknowledgements of messages sent over RTM are
+    passed to ``on_reply`` as soon as they are read, instead of waiting in
+    line behind events, if it returns True the frame is consumed. While
+    ``pending_replies()`` is not zero, it keeps reading beyond
+    ``read_ahead`` to find the acknowledgements, since handlers waiting
+    for them may be what holds the consumer back, but never beyond
+    ``buffer_size`` frames, past that the acknowledgements wait like
+    everything else and the messages may time out. Call ``wake`` after
+    sending a message.
+    """
+
+    def __init__(self, conn, primary=True, buffer_size=1000, on_close=None,
+                 read_ahead=1, on_reply=None, pending_replies=None):
+        self.conn = conn
+        self.primary = primary
+        self.buffer_size = buffer_size
+        self.on_close = on_close
+        self.read_ahead = read_ahead
+        self.on_reply = on_reply
+        self.pending_replies = pending_replies
+        self.closed = False
+        self.frames = deque()
+        # Time of the last frame read, for telling a silent connection
+        self.last_read_at = time.time()
+        self._changed = Condition()
+        IOLoop.current().spawn_callback(self._run)
+
+    @gen.coroutine
+    def _run(self):
+        while True:
+            while self.primary and self._full():
+                yield self._changed.wait()
+
+            frame = yield self.conn.read_message()
+            self.last_read_at = time.time()
+            if frame is None:
+                self.closed = True
+                self._changed.notify_all()
+                if self.on_close:
+                    self.on_close(self)
+                return
+
+            if self.on_reply is not None and '"reply_to"' in frame and self.on_reply(frame):
+                continue
+
+            self.frames.append(frame)
+            if not self.primary and len(self.frames) > self.buffer_size:
+                self.frames.popleft()
+            self._changed.notify_all()
+
+    def _full(self):
+        size = len(self.frames)
+        if size < self.read_ahead:
+            return False
+        if size >= self.buffer_size:
+            return True
+        return not (self.pending_replies and self.pending_replies())
+
+    def wake(self):
+        self._changed.notify_all()
+
+    @property
+    def backpressured(self):
+        """True when a primary reader stops reading until the consumer
+        catches up, so pongs may be waiting unread on the socket
+        """
+        return self.primary and len(self.frames) >= self.buffer_size
+
+    @gen.coroutine
+    def read(self):
+        """Return the next frame, None when connection is closed"""
+        while not self.frames:
+            if self.closed:
+                raise gen.Return(None)
+            yield self._changed.wait()
+        frame = self.frames.popleft()
+        self._changed.notify_all()
+        raise gen.Return(frame)
+
+    def promote(self, recent_events):
+        """Turn a standby reader into primary. Frames buffered before are
+        kept only if they are events not seen in ``recent_events``.
+        """
+        backlog = self.frames
+        self.frames = deque()
+        for frame in backlog:
+            try:
+                key = event_key(json_loads(frame))
+            except ValueError:
+                continue
+            if key is not None and key not in recent_events:
+                self.frames.append(frame)
+        self.primary = True
+        self._changed.notify_all()
+
+
+class RTMSender(object):
+    """Send messages over RTM websocket and wait for acknowledgements
+
+    Each frame gets an ``id``, Slack answers with a frame having the same
+    ``reply_to``, which is passed to `ack` by the reader of frames.
+    """
+
+    def __init__(self, timeout=5):
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        # id -> (conn, future, timeout handle)
+        self._pending = {}
+
+    def send(self, conn, channel_id, text):
+        """Return a Future resolved with the ack frame, or failed with
+        `ReplyFailed` on error or timeout
+        """
+        return self.send_frame(conn, {'type': 'message', 'channel': channel_id, 'text': text})
+
+    def send_frame(self, conn, raw, timeout=None):
+        """Send any frame that Slack replies to, e.g. ``ping``"""
+        msg_id = next(self._ids)
+        future = Future()
+        frame = json.dumps(dict(raw, id=msg_id))
+        try:
+            conn.write_message(frame)
+        except Exception as e:
+            future.set_exception(errors.ReplyFailed('Write to websocket failed: %s' % e))
+            return future
+
+        handle = IOLoop.current().call_later(timeout or self.timeout, self._fail, msg_id, 'timed out')
+        self._pending[msg_id] = (conn, future, handle)
+        return future
+
+    def ack(self, raw):
+        """Resolve the message ``raw['reply_to']``, return False if it's
+        not sent by this sender
+        """
+        entry = self._pending.pop(raw.get('reply_to'), None)
+        if entry is None:
+            return False
+        _, future, handle = entry
+        IOLoop.current().remove_timeout(handle)
+        # Pongs have no `ok`
+        if raw.get('ok', True):
+            future.set_result(raw)
+        else:
+            future.set_exception(errors.ReplyFailed('RTM message failed: %s' % raw.get('error')))
+        return True
+
+    def fail_conn(self, conn):
+        """Fail messages waiting for acks on a closed connection"""
+        for msg_id, entry in list(self._pending.items()):
+            if entry[0] is conn:
+                IOLoop.current().remove_timeout(entry[2])
+                self._fail(msg_id, 'connection closed')
+
+    def _fail(self, msg_id, reason):
+        entry = self._pending.pop(msg_id, None)
+        if entry is not None:
+            entry[1].set_exception(errors.ReplyFailed('RTM message %s %s' % (msg_id, reason)))
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class ConnectionWatchdog(object):
+    """Ping the primary connection every ``interval`` seconds and measure
+    the round-trip time by the pong.
+
+    The connection is stale after ``max_missed`` pings in a row get no pong
+    in ``timeout`` seconds, or after nothing is read from it for
+    ``silence`` seconds, then ``on_stale(conn, reason)`` is called.
+    Neither counts while the reader is backpressured.
+    ``get_conn`` returns the current ``(conn, reader)``, both could be None.
+    """
+
+    def __init__(self, sender, get_conn, on_stale, interval=10, timeout=5, max_missed=2,
+                 silence=30):
+        self.sender = sender
+        self.get_conn = get_conn
+        self.on_stale = on_stale
+        self.interval = interval
+        self.timeout = timeout
+        self.max_missed = max_missed
+        self.silence = silence
+        # Round-trip time of the last ping
+        self.rtt = None
+        self.missed = 0
+        self._conn = None
+        self._pinging = False
+
+    def start(self):
+        PeriodicCallback(self.check, self.interval * 1000).start()
+
+    @gen.coroutine
+    def check(self):
+        conn, reader = self.get_conn()
+        if conn is None:
+            return
+        if conn is not self._conn:
+            self._conn = conn
+            self.missed = 0
+        if self._pinging:
+            return
+
+        if (self.silence and not reader.backpressured and
+                time.time() - reader.last_read_at > self.silence):
+            self._stale(conn, 'silence')
+            return
+
+        self._pinging = True
+        start = time.time()
+        try:
+            future = self.sender.send_frame(conn, {'type': 'ping'}, self.timeout)
+            reader.wake()
+            yield future
+        except errors.ReplyFailed as e:
+            if conn is not self._conn:
+                return
+            if reader.backpressured:
+                # Slow consumer, not a dead connection
+                logging.info('Ping failed while reader is backpressured: %s', e)
+                return
+            self.missed += 1
+            logging.warn('Ping failed (%s in a row): %s', self.missed, e)
+            if self.missed >= self.max_missed:
+                self._stale(conn, 'missed_pongs')
+        else:
+            self.rtt = time.time() - start
+            self.missed = 0
+            metrics.PING_RTT.observe(self.rtt)
+            logging.debug('Pong in %.3fs', self.rtt)
+        finally:
+            self._pinging = False
+
+    def _stale(self, conn, reason):
+        logging.warn('Connection %s is stale: %s', conn, reason)
+        metrics.STALE_CONNECTIONS.inc((reason,))
+        self._conn = None
+        self.on_stale(conn, reason)
+
+
+def can_send_over_rtm(reply):
+    """RTM only takes plain text, anything else goes through chat.postMessage"""
+    return not reply.extra_args and reply.text and len(reply.text) <= RTM_MAX_TEXT_LENGTH
+
+
+class RecentSet(object):
+    """A set that only remembers the last ``maxlen`` items added"""
+
+    def __init__(self, maxlen):
+        self._order = deque()
+        self._items = set()
+        self.maxlen = maxlen
+
+    def add(self, item):
+        if item in self._items:
+            return
+        self._order.append(item)
+        self._items.add(item)
+        if len(self._order) > self.maxlen:
+            self._items.discard(self._order.popleft())
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+def event_key(raw):
+    """Identify an event received on different connections, None if the
+    event has no timestamp (e.g. presence_change, user_typing)
+    """
+    ts = raw.get('ts') or raw.get('event_ts')
+    if ts is None:
+        return None
+
+    channel = raw.get('channel')
+    if isinstance(channel, dict):
+        channel = channel.get('id')
+    user = raw.get('user')
+    if isinstance(user, dict):
+        user = user.get('id')
+    return (raw.get('type'), raw.get('subtype'), channel, user, ts)
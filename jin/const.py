@@ -1,4 +1,54 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-# TODO define some event collections for default event handlers
+
+# Events that change users, channels and groups, applied to `Directory`
+DIRECTORY_EVENTS = (
+    'channel_created',
+    'channel_rename',
+    'channel_joined',
+    'channel_left',
+    'channel_archive',
+    'channel_unarchive',
+    'channel_deleted',
+    'group_joined',
+    'group_rename',
+    'group_archive',
+    'group_unarchive',
+    'group_left',
+    'team_join',
+    'user_change',
+)
+
+
+# Longer messages can't be sent over RTM
+RTM_MAX_TEXT_LENGTH = 4000
+
+
+# Number of recent Events API event ids remembered to drop retried callbacks
+EVENTS_DEDUP_SIZE = 10000
+
+
+# Fields kept in directory by default, see `Directory`
+DEFAULT_USER_FIELDS = (
+    'id', 'name', 'real_name', 'is_bot', 'deleted', 'is_admin', 'tz',
+)
+DEFAULT_CHANNEL_FIELDS = (
+    'id', 'name', 'is_member', 'is_archived', 'is_private', 'is_general',
+)
+
+
+# Priorities of inbound messages, smaller is more important
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Priority of events by type, messages to the bot (direct messages and
+# mentions) are of high priority, others are normal
+DEFAULT_INBOUND_PRIORITIES = {
+    'user_typing': PRIORITY_LOW,
+    'presence_change': PRIORITY_LOW,
+    'manual_presence_change': PRIORITY_LOW,
+    'dnd_updated_user': PRIORITY_LOW,
+    'reconnect_url': PRIORITY_LOW,
+}
@@ -4,14 +4,24 @@
 # TODO remove slackclient, just use the original HTTP API
 
 import json
+import time
 import logging
 import traceback
+from tornado import gen
+from tornado.httpclient import HTTPRequest, HTTPError
 from slackclient import SlackClient
-from .errors import APICallFailed
+from .compat import iteritems, text_type, urlencode
+from .errors import APICallFailed, APIRateLimited
 from .utils import utf8
+from .metrics import API_CALL_LATENCY, API_CALL_ERRORS
+
+
+SLACK_API_URL = 'https://slack.com/api/'
 
 
 class APIClient(object):
+    """Blocking client, keep it for the CLI and other code outside of IOLoop"""
+
     def __init__(self, token):
         self.token = token
         self.client = SlackClient(token)
@@ -25,33 +35,163 @@ class APIClient(object):
             raise APICallFailed(str(e))
 
     def get_channels(self):
-        channels = {}
-        channel_names = []
-        keep_keys = ['id', 'name', 'is_archived', 'is_member']
         logging.info('call api channels.list')
         rv = self.api_call('channels.list')
-        for i in rv['channels']:
-            c = {k: v for k, v in i.iteritems() if k in keep_keys}
-            channels[c['id']] = c
-            channel_names.append(c['name'])
-        logging.debug('Got channels: %s', ','.join(channel_names))
-        return channels
+        return parse_channels(rv)
 
     def send_message(self, channel_id, text, as_user=True, **kwargs):
         """
         Reference: https://api.slack.com/methods/chat.postMessage
         """
-
-        api_args = dict(
-            channel=channel_id,
-            # Ensure text is utf8
-            text=utf8(text)
-        )
-        if as_user:
-            api_args['as_user'] = 'true'
-        api_args.update(kwargs)
+        api_args = make_message_args(channel_id, text, as_user, kwargs)
         logging.info('call api chat.postMessage: %s', api_args)
 
         rv = self.api_call('chat.postMessage', **api_args)
         logging.debug('postMessage finished: %s', rv)
         return rv
+
+
+class AsyncAPIClient(object):
+    """Non-blocking client which calls Slack Web API directly,
+    all methods are coroutines.
+
+    Requests share one ``AsyncHTTPClient`` instance, ``max_clients`` limits
+    the number of concurrent connections. When pycurl is installed the curl
+    client is used, which keeps connections alive and reuses them.
+    """
+
+    def __init__(self, token, api_url=SLACK_API_URL, max_clients=10, request_timeout=30):
+        self.token = token
+        self.api_url = api_url
+        self.max_clients = max_clients
+        self.request_timeout = request_timeout
+        self._http_client = None
+
+    @property
+    def http_client(self):
+        # Created lazily to bind with the IOLoop that is actually running
+        if self._http_client is None:
+            self._http_client = make_http_client(self.max_clients)
+        return self._http_client
+
+    @gen.coroutine
+    def api_call(self, method, **kwargs):
+        params = {'token': self.token}
+        for k, v in iteritems(kwargs):
+            if v is None:
+                continue
+            if isinstance(v, (dict, list)):
+                v = json.dumps(v)
+            params[k] = utf8(v) if isinstance(v, text_type) else v
+
+        request = HTTPRequest(
+            self.api_url + method,
+            method='POST',
+            body=urlencode(params),
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
+            request_timeout=self.request_timeout,
+        )
+        labels = (method,)
+        start = time.time()
+        try:
+            resp = yield self.http_client.fetch(request)
+            rv = json.loads(resp.body)
+        except HTTPError as e:
+            API_CALL_ERRORS.inc(labels)
+            if e.code == 429:
+                raise APIRateLimited('%s: %s' % (method, e), get_retry_after(e.response))
+            raise APICallFailed('%s: %s' % (method, e))
+        except ValueError as e:
+            API_CALL_ERRORS.inc(labels)
+            raise APICallFailed('%s: invalid response, %s' % (method, e))
+        except Exception as e:
+            # Connection failures, e.g. socket.error and StreamClosedError,
+            # are not always turned into HTTPError by the client
+            API_CALL_ERRORS.inc(labels)
+            raise APICallFailed('%s: %s: %s' % (method, e.__class__.__name__, e))
+        finally:
+            API_CALL_LATENCY.observe(time.time() - start, labels)
+
+        if not rv.get('ok'):
+            API_CALL_ERRORS.inc(labels)
+            raise APICallFailed('%s: %s' % (method, rv.get('error')))
+        raise gen.Return(rv)
+
+    @gen.coroutine
+    def get_channels(self):
+        logging.info('call api channels.list')
+        rv = yield self.api_call('channels.list')
+        raise gen.Return(parse_channels(rv))
+
+    @gen.coroutine
+    def get_user_info(self, user_id):
+        """Full info of a user, including fields not kept in directory"""
+        rv = yield self.api_call('users.info', user=user_id)
+        raise gen.Return(rv['user'])
+
+    @gen.coroutine
+    def get_channel_info(self, channel_id):
+        """Full info of a channel or group, including fields not kept in directory"""
+        rv = yield self.api_call('conversations.info', channel=channel_id)
+        raise gen.Return(rv['channel'])
+
+    @gen.coroutine
+    def open_im(self, user_id):
+        """Return id of the direct message channel with a user"""
+        rv = yield self.api_call('conversations.open', users=user_id)
+        raise gen.Return(rv['channel']['id'])
+
+    @gen.coroutine
+    def send_message(self, channel_id, text, as_user=True, **kwargs):
+        """
+        Reference: https://api.slack.com/methods/chat.postMessage
+        """
+        api_args = make_message_args(channel_id, text, as_user, kwargs)
+        logging.info('call api chat.postMessage: %s', api_args)
+
+        rv = yield self.api_call('chat.postMessage', **api_args)
+        logging.debug('postMessage finished: %s', rv)
+        raise gen.Return(rv)
+
+
+def make_http_client(max_clients):
+    try:
+        from tornado.curl_httpclient import CurlAsyncHTTPClient as client_class
+    except ImportError:
+        # pycurl is not installed
+        from tornado.simple_httpclient import SimpleAsyncHTTPClient as client_class
+
+    return client_class(force_instance=True, max_clients=max_clients)
+
+
+def get_retry_after(response, default=1):
+    if response is None:
+        return default
+    try:
+        return int(response.headers.get('Retry-After', default))
+    except ValueError:
+        return default
+
+
+def make_message_args(channel_id, text, as_user, kwargs):
+    api_args = dict(
+        channel=channel_id,
+        # Ensure text is utf8
+        text=utf8(text)
+    )
+    if as_user:
+        api_args['as_user'] = 'true'
+    api_args.update(kwargs)
+    return api_args
+
+
+def parse_channels(rv):
+    channels = {}
+    channel_names = []
+    keep_keys = ['id', 'name', 'is_archived', 'is_member']
+    for i in rv['channels']:
+        c = {k: v for k, v in iteritems(i) if k in keep_keys}
+        channels[c['id']] = c
+        channel_names.append(c['name'])
+    logging.debug('Got channels: %s', ','.join(channel_names))
+    return channels
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import gzip
+import json
+import time
+import logging
+from tornado import gen
+
+from .utils import SearchList, json_loads, make_record_class, utf8
+from . import errors
+
+
+SNAPSHOT_VERSION = 2
+
+
+class Directory(object):
+    """Users, channels and groups of a workspace, kept up to date by
+    applying RTM events on them.
+
+    When ``user_fields`` or ``channel_fields`` (also used by groups) is
+    given, only these fields are kept, in compact records instead of the
+    raw dicts. Get the rest with `AsyncAPIClient.get_user_info` and
+    `AsyncAPIClient.get_channel_info` when needed.
+    """
+
+    def __init__(self, users=(), channels=(), groups=(), updated_at=None, complete=True,
+                 user_fields=None, channel_fields=None):
+        self.user_fields = user_fields
+        self.channel_fields = channel_fields
+        self._user_class = self._channel_class = None
+        if user_fields:
+            self._user_class = make_record_class('User', user_fields)
+        if channel_fields:
+            self._channel_class = make_record_class('Channel', channel_fields)
+
+        self.replace(users, channels, groups)
+        # When the data was fetched from Slack in full
+        self.updated_at = updated_at or time.time()
+        # False while `DirectoryLoader` is still fetching
+        self.complete = complete
+        # Whether there are changes not saved to snapshot yet
+        self.dirty = False
+        # Events applied while `DirectoryLoader` fetches the lists, to apply
+        # again on the fresh ones
+        self._pending = None
+
+    def replace(self, users, channels, groups):
+        """Replace all users, channels and groups, each list is indexed once"""
+        # A new table of interned strings, the old one goes with the old lists
+        strings = {}
+        self.users = SearchList(users, ['id', 'name'], self._user_class, strings)
+        self.channels = SearchList(channels, ['id', 'name'], self._channel_class, strings)
+        self.groups = SearchList(groups, ['id', 'name'], self._channel_class, strings)
+
+    @classmethod
+    def from_rtm_start(cls, rv, **kwargs):
+        return cls(rv['users'], rv['channels'], rv['groups'], **kwargs)
+
+    def is_fresh(self, max_age):
+        return time.time() - self.updated_at < max_age
+
+    def apply_event(self, raw):
+        """Apply an event to directory, return True if anything changed"""
+        handler = _EVENT_HANDLERS.get(raw.get('type'))
+        if handler is None:
+            return False
+        if self._pending is not None:
+            self._pending.append(raw)
+        changed = handler(self, raw)
+        if changed:
+            self.dirty = True
+        return changed
+
+    def save(self, path):
+        data = dict(
+            version=SNAPSHOT_VERSION,
+            updated_at=self.updated_at,
+            user_fields=_fields_list(self.user_fields),
+            channel_fields=_fields_list(self.channel_fields),
+            users=[dict(i) for i in self.users],
+            channels=[dict(i) for i in self.channels],
+            groups=[dict(i) for i in self.groups],
+        )
+        # Write to a temp file then rename, so a crash won't leave a broken snapshot
+        tmp_path = path + '.tmp'
+        f = gzip.open(tmp_path, 'wb')
+        try:
+            f.write(utf8(json.dumps(data)))
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+        self.dirty = False
+        logging.info('Saved directory snapshot to %s', path)
+
+    @classmethod
+    def load(cls, path, user_fields=None, channel_fields=None):
+        """Load a snapshot, return None if it doesn't exist or is invalid,
+        or if it was saved with different fields
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            f = gzip.open(path, 'rb')
+            try:
+                data = json_loads(f.read())
+            finally:
+                f.close()
+        except (IOError, ValueError) as e:
+            logging.warn('Could not load directory snapshot %s: %s', path, e)
+            return None
+
+        if data.get('version') != SNAPSHOT_VERSION:
+            return None
+        fields = (_fields_list(user_fields), _fields_list(channel_fields))
+        if (data.get('user_fields'), data.get('channel_fields')) != fields:
+            logging.info('Fields of directory snapshot %s changed, ignore it', path)
+            return None
+        logging.info('Loaded directory snapshot from %s', path)
+        return cls(data['users'], data['channels'], data['groups'], data['updated_at'],
+                   user_fields=user_fields, channel_fields=channel_fields)
+
+
+def _is_private(channel):
+    # Private channels are what groups used to be
+    return channel.get('is_private') or channel.get('is_group')
+
+
+def _fields_list(fields):
+    return list(fields) if fields else None
+
+
+class DirectoryLoader(object):
+    """Fill an empty `Directory` by paginated ``users.list`` and
+    ``conversations.list`` calls in background, instead of getting it all
+    from ``rtm.start``. Users and channels not loaded yet can be fetched one
+    by one with `lookup_user` and `lookup_channel`.
+    """
+
+    def __init__(self, client, directory, page_size=200):
+        self.client = client
+        self.directory = directory
+        self.page_size = page_size
+        # id -> Future of a single lookup in progress
+        self._lookups = {}
+
+    @gen.coroutine
+    def load_all(self):
+        directory = self.directory
+        started_at = time.time()
+        # Pages fetched earlier may miss what changed after, so events and
+        # lookups from now on are applied again after the swap
+        directory._pending = pending = []
+        try:
+            users = yield self._pages('users.list', 'members')
+            channels = yield self._pages(
+                'conversations.list', 'channels',
+                types='public_channel,private_channel', exclude_archived='true')
+        finally:
+            directory._pending = None
+        groups = [i for i in channels if _is_private(i)]
+        channels = [i for i in channels if not _is_private(i)]
+        # Swap in new lists at once, rather than upserting a stale snapshot
+        # item by item, which would block IOLoop for a big workspace
+        directory.replace(users, channels, groups)
+        for raw in pending:
+            directory.apply_event(raw)
+
+        directory.updated_at = started_at
+        directory.complete = True
+        directory.dirty = True
+        logging.info('Directory loaded: %s users, %s channels, %s groups',
+                     len(directory.users), len(directory.channels), len(directory.groups))
+
+    @gen.coroutine
+    def _pages(self, method, key, **kwargs):
+        items = []
+        cursor = None
+        while True:
+            if cursor:
+                kwargs['cursor'] = cursor
+            try:
+                rv = yield self.client.api_call(method, limit=self.page_size, **kwargs)
+            except errors.APIRateLimited as e:
+                logging.warn('%s is rate limited, retry in %ss', method, e.retry_after)
+                yield gen.sleep(e.retry_after)
+                continue
+            items.extend(rv.get(key) or [])
+            cursor = (rv.get('response_metadata') or {}).get('next_cursor')
+            if not cursor:
+                raise gen.Return(items)
+
+    def _add_user(self, user):
+        # As an event, so it is applied again if `load_all` is running
+        self.directory.apply_event({'type': 'user_change', 'user': user})
+
+    def _add_channel(self, channel):
+        event_type = 'group_joined' if _is_private(channel) else 'channel_created'
+        self.directory.apply_event({'type': event_type, 'channel': channel})
+
+    @gen.coroutine
+    def lookup_user(self, user_id):
+        """Return the user of ``user_id``, fetch it if it's not loaded yet"""
+        user = self.directory.users.get(id=user_id)
+        if user is None:
+            rv = yield self._lookup(user_id, 'users.info', user=user_id)
+            if rv is not None:
+                user = rv['user']
+                self._add_user(user)
+        raise gen.Return(user)
+
+    @gen.coroutine
+    def lookup_channel(self, channel_id):
+        """Return the channel or group of ``channel_id``, fetch it if it's not loaded yet"""
+        channel = self.directory.channels.get(id=channel_id) or self.directory.groups.get(id=channel_id)
+        if channel is None:
+            rv = yield self._lookup(channel_id, 'conversations.info', channel=channel_id)
+            if rv is not None:
+                channel = rv['channel']
+                self._add_channel(channel)
+        raise gen.Return(channel)
+
+    @gen.coroutine
+    def _lookup(self, item_id, method, **kwargs):
+        # Concurrent lookups of the same id share one call
+        future = self._lookups.get(item_id)
+        if future is None:
+            future = self._lookups[item_id] = self.client.api_call(method, **kwargs)
+        try:
+            rv = yield future
+        except errors.APICallFailed as e:
+            logging.warn('Lookup %s failed: %s', item_id, e)
+            rv = None
+        finally:
+            self._lookups.pop(item_id, None)
+        raise gen.Return(rv)
+
+
+# Events that change the directory, see https://api.slack.com/rtm#events
+
+def _upsert_channel(directory, raw, **fields):
+    channel = dict(raw['channel'], **fields)
+    directory.channels.upsert(channel)
+    return True
+
+
+def _update_channel(directory, raw, **fields):
+    channel = directory.channels.get(id=raw['channel'])
+    if channel is None:
+        return False
+    directory.channels.update_item(channel, **fields)
+    return True
+
+
+def _remove_channel(directory, raw):
+    return directory.channels.pop_by(id=raw['channel']) is not None
+
+
+def _upsert_group(directory, raw, **fields):
+    group = dict(raw['channel'], **fields)
+    directory.groups.upsert(group)
+    return True
+
+
+def _update_group(directory, raw, **fields):
+    group = directory.groups.get(id=raw['channel'])
+    if group is None:
+        return False
+    directory.groups.update_item(group, **fields)
+    return True
+
+
+def _remove_group(directory, raw):
+    return directory.groups.pop_by(id=raw['channel']) is not None
+
+
+def _upsert_user(directory, raw):
+    directory.users.upsert(raw['user'])
+    return True
+
+
+_EVENT_HANDLERS = {
+    'channel_created': _upsert_channel,
+    'channel_rename': _upsert_channel,
+    'channel_joined': lambda d, raw: _upsert_channel(d, raw, is_member=True),
+    'channel_left': lambda d, raw: _update_channel(d, raw, is_member=False),
+    'channel_archive': lambda d, raw: _update_channel(d, raw, is_archived=True),
+    'channel_unarchive': lambda d, raw: _update_channel(d, raw, is_archived=False),
+    'channel_deleted': _remove_channel,
+    'group_joined': _upsert_group,
+    'group_rename': _upsert_group,
+    'group_archive': lambda d, raw: _update_group(d, raw, is_archived=True),
+    'group_unarchive': lambda d, raw: _update_group(d, raw, is_archived=False),
+    'group_left': _remove_group,
+    'team_join': _upsert_user,
+    'user_change': _upsert_user,
+}
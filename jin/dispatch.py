@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import heapq
+import logging
+import traceback
+from collections import deque
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition, Event
+
+
+OVERFLOW_POLICIES = ('block', 'drop', 'coalesce')
+
+
+class HandlerIndex(object):
+    """Index of message handler specs keyed by event type
+
+    A spec registered with a string ``event_type`` goes into the type-only
+    bucket and matches every subtype, a spec registered with a
+    ``(type, subtype)`` tuple goes into the exact bucket. Lookup merges
+    both buckets back into registration order, the merged result is
+    cached per ``(type, subtype)`` until the index is rebuilt.
+    """
+
+    def __init__(self, specs=None):
+        self.rebuild(specs or [])
+
+    def rebuild(self, specs):
+        by_type = {}
+        by_pair = {}
+        for seq, spec in enumerate(specs):
+            event_type = spec[0]
+            if isinstance(event_type, tuple):
+                by_pair.setdefault(event_type, []).append((seq, spec))
+            else:
+                by_type.setdefault(event_type, []).append((seq, spec))
+
+        self._by_type = by_type
+        self._by_pair = by_pair
+        self._types = set(by_type).union(t for t, _ in by_pair)
+        self._cache = {}
+
+    def __contains__(self, msg_type):
+        """Whether any handler is registered for ``msg_type``"""
+        return msg_type in self._types
+
+    def get(self, msg_type, msg_subtype=None):
+        """Return specs matching the event, in registration order"""
+        key = (msg_type, msg_subtype)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        type_bucket = self._by_type.get(msg_type, [])
+        pair_bucket = self._by_pair.get(key, [])
+        if not pair_bucket:
+            specs = [spec for _, spec in type_bucket]
+        elif not type_bucket:
+            specs = [spec for _, spec in pair_bucket]
+        else:
+            specs = [spec for _, spec in heapq.merge(type_bucket, pair_bucket)]
+
+        self._cache[key] = specs
+        return specs
+
+
+class _Entry(object):
+    """A waiting message, ``done`` once it's taken or shed, so that the
+    references left in other queues are skipped
+    """
+
+    __slots__ = ('msg', 'key', 'priority', 'done')
+
+    def __init__(self, msg, key, priority):
+        self.msg = msg
+        self.key = key
+        self.priority = priority
+        self.done = False
+
+
+class InboundDispatcher(object):
+    """Handle messages concurrently, while keeping the order of messages
+    that have the same key (channel, or user for events without channel)
+
+    At most ``concurrency`` messages are handled at a time. ``put`` blocks
+    when ``queue_size`` messages are waiting, which stops the websocket
+    reader from reading more frames than handlers could catch up with.
+
+    Waiting messages are taken by priority, ``priority_func`` returns
+    ``0`` (the highest) to ``levels - 1`` for a message. Priority only
+    decides which key goes next, never the order within a key: taking a
+    message of a key that has older ones waiting takes the oldest instead,
+    so a channel's waiting messages get the highest priority among them.
+    Messages of ``shed_priority`` or lower priority may be shed when the
+    queue is full, depending on ``overflow``:
+
+    - ``block``: never shed, wait for room
+    - ``drop``: drop the oldest waiting message of the lowest priority, as
+      long as it's not more important than the new one, otherwise drop the
+      new one
+    - ``coalesce``: besides dropping, a new sheddable message replaces a
+      waiting one that has the same ``coalesce_key_func`` key
+    """
+
+    def __init__(self, handle, concurrency=8, queue_size=1000, key_func=None,
+                 priority_func=None, levels=3, shed_priority=None, overflow='block',
+                 coalesce_key_func=None, on_shed=None):
+        # A coroutine function that takes a `Message`
+        self.handle = handle
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.key_func = key_func or get_order_key
+        self.priority_func = priority_func
+        self.levels = levels
+        self.shed_priority = levels - 1 if shed_priority is None else shed_priority
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('overflow should be one of %s, got %r' % (OVERFLOW_POLICIES, overflow))
+        self.overflow = overflow
+        self.coalesce_key_func = coalesce_key_func or get_coalesce_key
+        # Called with the message and ``'dropped'`` or ``'coalesced'``
+        self.on_shed = on_shed
+
+        # A deque of entries for each priority, done entries are skipped
+        self._queues = [deque() for _ in range(levels)]
+        # Numbers of waiting (not done) entries of each priority
+        self._counts = [0] * levels
+        self._size = 0
+        # key -> waiting entries of the key in the order they were put
+        self._waiting = {}
+        # coalesce key -> entry waiting in queue
+        self._coalescing = {}
+        # key -> messages waiting for the message of the same key in handling
+        self._parked = {}
+        self._parked_count = 0
+        # Messages put but not handled yet
+        self._unfinished = 0
+        self._finished = Event()
+        self._finished.set()
+        # Created in `start`, a Condition binds to current IOLoop
+        self._not_empty = None
+        self._not_full = None
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._not_empty = Condition()
+        self._not_full = Condition()
+        io_loop = IOLoop.current()
+        for _ in range(self.concurrency):
+            io_loop.spawn_callback(self._worker)
+
+    @gen.coroutine
+    def put(self, msg):
+        self.start()
+        priority = 0
+        if self.priority_func is not None:
+            priority = min(max(self.priority_func(msg), 0), self.levels - 1)
+        sheddable = priority >= self.shed_priority
+
+        if self.overflow == 'coalesce' and sheddable:
+            key = self.coalesce_key_func(msg)
+            entry = self._coalescing.get(key) if key is not None else None
+            if entry is not None:
+                self._shed(entry.msg, 'coalesced')
+                entry.msg = msg
+                return
+
+        # Parked messages count against the queue size as well
+        while self._size + self._parked_count >= self.queue_size:
+            if self.overflow != 'block':
+                if self._evict(priority):
+                    continue
+                if sheddable:
+                    self._shed(msg, 'dropped')
+                    return
+            yield self._not_full.wait()
+
+        entry = _Entry(msg, self.key_func(msg), priority)
+        self._queues[priority].append(entry)
+        self._counts[priority] += 1
+        self._size += 1
+        if entry.key is not None:
+            self._waiting.setdefault(entry.key, deque()).append(entry)
+        if self.overflow == 'coalesce' and sheddable:
+            key = self.coalesce_key_func(msg)
+            if key is not None:
+                self._coalescing[key] = entry
+        self._unfinished += 1
+        self._finished.clear()
+        self._not_empty.notify()
+
+    def _evict(self, priority):
+        """Drop the oldest waiting message that is sheddable and not more
+        important than ``priority``, return False if there's none
+        """
+        for level in range(self.levels - 1, max(self.shed_priority, priority) - 1, -1):
+            queue = self._queues[level]
+            while queue:
+                entry = queue.popleft()
+                if entry.done:
+                    continue
+                msg = self._pop_entry(entry)
+                self._shed(msg, 'dropped')
+                self._task_done()
+                return True
+        return False
+
+    def _shed(self, msg, action):
+        if self.on_shed is not None:
+            self.on_shed(msg, action)
+
+    def _take(self):
+        """Take the next message to handle, there must be one waiting"""
+        for queue in self._queues:
+            while queue:
+                entry = queue.popleft()
+                if entry.done:
+                    continue
+                if entry.key is not None:
+                    oldest = self._waiting[entry.key][0]
+                    if oldest is not entry:
+                        # Run the oldest of the key in place of this one,
+                        # which stays first in its priority
+                        queue.appendleft(entry)
+                        entry = oldest
+                return self._pop_entry(entry)
+
+    def _pop_entry(self, entry):
+        entry.done = True
+        self._counts[entry.priority] -= 1
+        self._size -= 1
+        msg = entry.msg
+        if entry.key is not None:
+            waiting = self._waiting[entry.key]
+            while waiting and waiting[0].done:
+                waiting.popleft()
+            if not waiting:
+                del self._waiting[entry.key]
+        if self._coalescing:
+            key = self.coalesce_key_func(msg)
+            if self._coalescing.get(key) is entry:
+                del self._coalescing[key]
+        return msg
+
+    def join(self, timeout=None):
+        """Return a future resolved when all messages put are handled"""
+        return self._finished.wait(timeout)
+
+    def qsize(self):
+        return self._size + self._parked_count
+
+    def qsizes(self):
+        """Numbers of waiting messages of each priority"""
+        return list(self._counts)
+
+    @gen.coroutine
+    def _worker(self):
+        while True:
+            while not self._size:
+                yield self._not_empty.wait()
+            msg = self._take()
+            self._not_full.notify_all()
+
+            key = self.key_func(msg)
+            if key is not None:
+                if key in self._parked:
+                    self._parked[key].append(msg)
+                    self._parked_count += 1
+                    continue
+                self._parked[key] = deque()
+
+            yield self._run(msg)
+            if key is None:
+                continue
+
+            parked = self._parked[key]
+            while parked:
+                msg = parked.popleft()
+                self._parked_count -= 1
+                self._not_full.notify_all()
+                yield self._run(msg)
+            del self._parked[key]
+
+    @gen.coroutine
+    def _run(self, msg):
+        try:
+            yield self.handle(msg)
+        except Exception as e:
+            logging.error('Handle message failed, %s\n%s', e, traceback.format_exc())
+        finally:
+            self._task_done()
+
+    def _task_done(self):
+        self._unfinished -= 1
+        if not self._unfinished:
+            self._finished.set()
+
+
+def get_order_key(msg):
+    channel = msg.channel_id
+    # Events like channel_created have the whole channel object
+    if isinstance(channel, dict):
+        channel = channel.get('id')
+    if channel:
+        return channel
+
+    user = msg.user
+    # Same for user in team_join and user_change
+    if isinstance(user, dict):
+        user = user.get('id')
+    if user:
+        return ('user', user)
+    return None
+
+
+def get_coalesce_key(msg):
+    """Messages of the same type from the same user in the same place
+    could replace each other, e.g. ``user_typing`` and ``presence_change``
+    """
+    user = msg.user
+    if isinstance(user, dict):
+        user = user.get('id')
+    return (msg.type, msg.subtype, get_order_key(msg), user)
@@ -16,3 +16,15 @@ class ReplyFailed(JinBaseError):
 
 class WSConnectionClosed(JinBaseError):
     """Websocket connection closed"""
+
+
+class APIRateLimited(APICallFailed):
+    """Slack API responded with HTTP 429"""
+
+    def __init__(self, message, retry_after=1):
+        super(APIRateLimited, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class HandlerTimeout(JinBaseError):
+    """Handler didn't finish in time"""
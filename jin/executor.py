@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import logging
+import importlib
+from datetime import timedelta
+from tornado import gen
+
+from .compat import iteritems, itervalues
+from .message import Message
+from . import errors
+from . import metrics
+
+# On Python 2 this requires the `futures` backport
+try:
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = ProcessPoolExecutor = None
+
+
+EXECUTOR_KINDS = ('thread', 'process')
+
+
+class PoolStats(object):
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    @property
+    def queued(self):
+        """Handlers waiting for a free worker"""
+        return max(0, self.in_flight - self.max_workers)
+
+    def as_dict(self):
+        return dict(
+            max_workers=self.max_workers,
+            in_flight=self.in_flight,
+            queued=self.queued,
+            completed=self.completed,
+            failed=self.failed,
+            timeouts=self.timeouts,
+        )
+
+
+class HandlerExecutor(object):
+    """Run handlers in shared thread or process pools, pools are created
+    on first use.
+
+    A handler run in process pool gets a `Message` without ``bot``, so
+    it can only reply with ``channel_id`` or to the channel of the message.
+    It also has to be a module level function, since it's looked up by
+    name in the worker process.
+    """
+
+    def __init__(self, thread_workers=10, process_workers=None):
+        self.max_workers = {
+            'thread': thread_workers,
+            'process': process_workers,
+        }
+        self._pools = {}
+        self._stats = {}
+
+    @staticmethod
+    def check_kind(kind):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError('executor should be one of %s, got %r' % (EXECUTOR_KINDS, kind))
+        if ThreadPoolExecutor is None:
+            raise ImportError('executor requires concurrent.futures, install `futures` on Python 2')
+
+    def get_pool(self, kind):
+        pool = self._pools.get(kind)
+        if pool is None:
+            self.check_kind(kind)
+            max_workers = self.max_workers[kind]
+            if kind == 'thread':
+                pool = ThreadPoolExecutor(max_workers)
+            else:
+                pool = ProcessPoolExecutor(max_workers)
+                # ProcessPoolExecutor defaults to the number of CPUs
+                max_workers = pool._max_workers
+            self._pools[kind] = pool
+            stats = self._stats[kind] = PoolStats(max_workers)
+            labels = (kind,)
+            metrics.EXECUTOR_WORKERS.set(max_workers, labels)
+            metrics.EXECUTOR_IN_FLIGHT.set_function(lambda: stats.in_flight, labels)
+            metrics.EXECUTOR_QUEUED.set_function(lambda: stats.queued, labels)
+        return pool
+
+    @gen.coroutine
+    def run(self, kind, func, msg, kwargs, timeout=None):
+        """Run ``func(msg, **kwargs)`` in the pool of ``kind``, return its output"""
+        pool = self.get_pool(kind)
+        stats = self._stats[kind]
+
+        if kind == 'thread':
+            future = pool.submit(func, msg, **kwargs)
+        else:
+            future = pool.submit(_call_in_process, func.__module__, func.__name__, msg.raw, kwargs)
+
+        stats.in_flight += 1
+        try:
+            if timeout:
+                output = yield gen.with_timeout(timedelta(seconds=timeout), future)
+            else:
+                output = yield future
+        except gen.TimeoutError:
+            stats.timeouts += 1
+            metrics.EXECUTOR_RUNS.inc((kind, 'timeout'))
+            # The worker can't be interrupted, its result will be dropped
+            future.cancel()
+            raise errors.HandlerTimeout(
+                'Handler %s timed out after %ss' % (func.__name__, timeout))
+        except Exception:
+            stats.failed += 1
+            metrics.EXECUTOR_RUNS.inc((kind, 'error'))
+            raise
+        finally:
+            stats.in_flight -= 1
+
+        stats.completed += 1
+        metrics.EXECUTOR_RUNS.inc((kind, 'ok'))
+        raise gen.Return(output)
+
+    def get_stats(self):
+        return {kind: stats.as_dict() for kind, stats in iteritems(self._stats)}
+
+    def shutdown(self, wait=True):
+        for pool in itervalues(self._pools):
+            pool.shutdown(wait)
+        self._pools = {}
+        logging.info('Handler executors shut down')
+
+
+def _call_in_process(module_name, func_name, raw, kwargs):
+    module = importlib.import_module(module_name)
+    func = getattr(module, func_name)
+    return func(Message(raw, None), **kwargs)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import re
+import logging
+
+from .compat import string_types
+
+
+# Ids of channels, groups, direct messages and users
+_CHANNEL_ID = re.compile(r'^[CGD][A-Z0-9]+$')
+_USER_ID = re.compile(r'^[UW][A-Z0-9]+$')
+
+
+class HandlerFilter(object):
+    """Conditions checked on a message before its handler is called, see
+    `SlackBot.on_event`
+
+    ``channels`` and ``users`` are names (``#`` and ``@`` prefixes are
+    allowed) or ids, they are resolved to sets of ids by `resolve`, so that
+    checking a message is only set lookups.
+    """
+
+    # In the order they are checked, also the labels of rejection metrics
+    names = ('channels', 'users', 'direct_only', 'mentions_bot')
+
+    def __init__(self, channels=None, users=None, direct_only=False, mentions_bot=False):
+        self.channels = _as_tuple(channels)
+        self.users = _as_tuple(users)
+        self.direct_only = direct_only
+        self.mentions_bot = mentions_bot
+
+    @classmethod
+    def make(cls, **kwargs):
+        """Return a filter, or None if no condition is given"""
+        if not any(kwargs.values()):
+            return None
+        return cls(**kwargs)
+
+    def resolve(self, directory):
+        """Return ``(channel_ids, user_ids, complete)``, the sets are None
+        when not filtering on them, ``complete`` is False if some names are
+        not found in ``directory`` (e.g. it's still loading)
+        """
+        complete = True
+        channel_ids = user_ids = None
+
+        if self.channels:
+            channel_ids = set()
+            for value in self.channels:
+                channel_id = _resolve_channel(directory, value.lstrip('#'))
+                if channel_id is None:
+                    complete = False
+                else:
+                    channel_ids.add(channel_id)
+            channel_ids = frozenset(channel_ids)
+
+        if self.users:
+            user_ids = set()
+            for value in self.users:
+                user_id = _resolve_user(directory, value.lstrip('@'))
+                if user_id is None:
+                    complete = False
+                else:
+                    user_ids.add(user_id)
+            user_ids = frozenset(user_ids)
+
+        if not complete:
+            logging.debug('Some names in %s are not found in directory', self)
+        return channel_ids, user_ids, complete
+
+    def check(self, msg, resolved, self_id):
+        """Return the name of the first condition ``msg`` fails, or None if
+        it passes all of them, ``resolved`` is what `resolve` returned
+        """
+        channel_ids, user_ids, _ = resolved
+        if channel_ids is not None and msg.channel_id not in channel_ids:
+            return 'channels'
+        if user_ids is not None and msg.user not in user_ids:
+            return 'users'
+        if self.direct_only:
+            channel_id = msg.channel_id
+            if not (isinstance(channel_id, string_types) and channel_id.startswith('D')):
+                return 'direct_only'
+        if self.mentions_bot:
+            text = msg.raw.get('text')
+            if not (self_id and isinstance(text, string_types) and '<@%s' % self_id in text):
+                return 'mentions_bot'
+        return None
+
+    def __repr__(self):
+        conditions = ['%s=%r' % (k, getattr(self, k)) for k in self.names if getattr(self, k)]
+        return '<HandlerFilter %s>' % ' '.join(conditions)
+
+
+def _as_tuple(value):
+    if not value:
+        return ()
+    if isinstance(value, string_types):
+        return (value,)
+    return tuple(value)
+
+
+def _resolve_channel(directory, value):
+    if directory is not None:
+        for items in (directory.channels, directory.groups):
+            item = items.get(id=value) or items.get(name=value)
+            if item is not None:
+                return item['id']
+    # Direct message channels are not in directory
+    if _CHANNEL_ID.match(value):
+        return value
+    return None
+
+
+def _resolve_user(directory, value):
+    if directory is not None:
+        item = directory.users.get(id=value) or directory.users.get(name=value)
+        if item is not None:
+            return item['id']
+    if _USER_ID.match(value):
+        return value
+    return None
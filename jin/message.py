@@ -1,39 +1,41 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+from .compat import string_types
 from . import errors
 
 
+_missing = object()
+
+
 class Message(object):
     """Message is the request user send to slack, read from RTM API"""
 
+    __slots__ = ('raw', 'bot', 'type', 'subtype', 'user', 'channel_id', '_channel')
+
     def __init__(self, raw, bot):
         self.raw = raw
         self.bot = bot
 
-    @property
-    def user(self):
-        return self.raw.get('user')
-
-    @property
-    def type(self):
-        return self.raw.get('type')
-
-    @property
-    def subtype(self):
-        return self.raw.get('subtype')
-
-    @property
-    def channel_id(self):
-        return self.raw.get('channel')
+        # Fields read by dispatching are copied out once
+        get = raw.get
+        self.type = get('type')
+        self.subtype = get('subtype')
+        self.user = get('user')
+        self.channel_id = get('channel')
+        self._channel = _missing
 
     @property
     def channel(self):
-        if self.channel_id:
-            c = self.bot.channels.get(id=self.channel_id)
-            if c:
-                return c['name']
-        return None
+        if self._channel is _missing:
+            name = None
+            # Not a string in events like channel_created
+            if isinstance(self.channel_id, string_types):
+                c = self.bot.channels.get(id=self.channel_id)
+                if c:
+                    name = c['name']
+            self._channel = name
+        return self._channel
 
     def reply(self, text, channel=None, channel_id=None, **kwargs):
 
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Light-weight metrics in Prometheus text format, exposed by `web.MetricsHandler`
+
+import time
+import bisect
+import logging
+from tornado.ioloop import IOLoop
+
+from .compat import iteritems, itervalues, string_types
+
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for suffix, labels, value in metric.samples():
+                lines.append('%s%s%s %s' % (metric.name, suffix, format_labels(labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric(object):
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # label values tuple -> value
+        self._values = {}
+        registry.register(self)
+
+    def _labels(self, labelvalues):
+        return list(zip(self.labelnames, labelvalues))
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def total(self):
+        return sum(itervalues(self._values))
+
+    def samples(self):
+        for labelvalues, value in sorted(iteritems(self._values), key=_sort_key):
+            yield '', self._labels(labelvalues), value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super(Gauge, self).__init__(*args, **kwargs)
+        self._functions = {}
+
+    def set(self, value, labels=()):
+        self._values[labels] = value
+
+    def set_function(self, func, labels=()):
+        """Get the value by calling ``func`` when rendering"""
+        self._functions[labels] = func
+
+    def samples(self):
+        values = dict(self._values)
+        for labelvalues, func in iteritems(self._functions):
+            try:
+                values[labelvalues] = func()
+            except Exception as e:
+                logging.warn('Get value of gauge %s failed: %s', self.name, e)
+        for labelvalues, value in sorted(iteritems(values), key=_sort_key):
+            yield '', self._labels(labelvalues), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, **kwargs):
+        super(Histogram, self).__init__(name, documentation, labelnames, **kwargs)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        data = self._values.get(labels)
+        if data is None:
+            # Counts of each bucket (not cumulative, the last one is +Inf), sum
+            data = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+    def samples(self):
+        for labelvalues, (counts, total) in sorted(iteritems(self._values), key=_sort_key):
+            labels = self._labels(labelvalues)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', labels + [('le', format_value(bound))], cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+def _sort_key(item):
+    # Label values could be None, which doesn't compare with strings on Python 3
+    return tuple('' if v is None else v for v in item[0])
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, escape_label(v)) for k, v in labels)
+
+
+def escape_label(value):
+    if not isinstance(value, string_types):
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+EVENTS_RECEIVED = Counter(
+    'jin_events_received_total', 'RTM events received', ['type'])
+HANDLER_CALLS = Counter(
+    'jin_handler_calls_total', 'Handler invocations', ['handler'])
+HANDLER_ERRORS = Counter(
+    'jin_handler_errors_total', 'Handler invocations that raised', ['handler'])
+FILTER_REJECTIONS = Counter(
+    'jin_filter_rejections_total', 'Messages not passed to handler by its filters',
+    ['handler', 'filter'])
+HANDLER_LATENCY = Histogram(
+    'jin_handler_latency_seconds', 'Time spent in handler', ['handler'])
+API_CALL_LATENCY = Histogram(
+    'jin_api_call_latency_seconds', 'Latency of Slack Web API calls', ['method'])
+API_CALL_ERRORS = Counter(
+    'jin_api_call_errors_total', 'Failed Slack Web API calls', ['method'])
+OUTBOUND_QUEUE_DEPTH = Gauge(
+    'jin_outbound_queue_depth', 'Replies waiting in outbound queues', ['workspace'])
+PING_RTT = Histogram(
+    'jin_ping_rtt_seconds', 'Round-trip time of RTM pings')
+STALE_CONNECTIONS = Counter(
+    'jin_stale_connections_total', 'Connections recycled by watchdog', ['reason'])
+INBOUND_SHED = Counter(
+    'jin_inbound_shed_total', 'Inbound events dropped or coalesced when queue is full',
+    ['type', 'action'])
+REPLIES_SENT = Counter(
+    'jin_replies_sent_total', 'Replies sent, by RTM websocket or HTTP', ['transport'])
+RTM_REPLY_FALLBACKS = Counter(
+    'jin_rtm_reply_fallbacks_total', 'Replies sent by HTTP after RTM failed')
+CACHE_HITS = Counter(
+    'jin_cache_hits_total', 'Handler outputs served from cache', ['cache'])
+CACHE_MISSES = Counter(
+    'jin_cache_misses_total', 'Handler cache lookups that missed', ['cache'])
+CACHE_EVICTIONS = Counter(
+    'jin_cache_evictions_total', 'Handler cache entries evicted by size', ['cache'])
+SCHEDULED_JOBS = Gauge(
+    'jin_scheduled_jobs', 'Jobs waiting in scheduler', ['workspace'])
+JOB_RUNS = Counter(
+    'jin_job_runs_total', 'Scheduled job runs, by result', ['job', 'result'])
+JOB_LAG = Histogram(
+    'jin_job_lag_seconds', 'Delay of job runs beyond their schedule')
+EXECUTOR_WORKERS = Gauge(
+    'jin_executor_workers', 'Workers of handler executor pools', ['pool'])
+EXECUTOR_IN_FLIGHT = Gauge(
+    'jin_executor_in_flight', 'Handlers submitted to executor pools and not done', ['pool'])
+EXECUTOR_QUEUED = Gauge(
+    'jin_executor_queued', 'Handlers waiting for a free worker of executor pools', ['pool'])
+EXECUTOR_RUNS = Counter(
+    'jin_executor_runs_total', 'Handler runs in executor pools, by result', ['pool', 'result'])
+LOOP_LAG = Histogram(
+    'jin_ioloop_lag_seconds', 'Delay of IOLoop callbacks beyond their schedule')
+
+
+class LoopLagMonitor(object):
+    """Schedule a callback every ``interval`` seconds and record how late it runs"""
+
+    def __init__(self, interval=0.5, histogram=LOOP_LAG):
+        self.interval = interval
+        self.histogram = histogram
+        self._expected = None
+
+    def start(self):
+        self._schedule()
+
+    def _schedule(self):
+        self._expected = time.time() + self.interval
+        IOLoop.current().call_later(self.interval, self._tick)
+
+    def _tick(self):
+        self.histogram.observe(max(0, time.time() - self._expected))
+        self._schedule()
+
+
+_loop_lag_monitor = None
+
+
+def monitor_loop_lag(interval=0.5):
+    """Start the loop lag monitor, once per process"""
+    global _loop_lag_monitor
+    if _loop_lag_monitor is None:
+        _loop_lag_monitor = LoopLagMonitor(interval)
+        _loop_lag_monitor.start()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import logging
+from collections import deque
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition
+
+from .compat import itervalues
+from .message import Reply
+from .errors import APIRateLimited
+
+
+class TokenBucket(object):
+    """Allow ``rate`` operations per second, with bursts up to ``burst``"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def delay(self, now=None):
+        """Seconds to wait before a token is available, 0 if there's one"""
+        self._refill(now or time.time())
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now=None):
+        self._refill(now or time.time())
+        self.tokens -= 1
+
+
+class OutboundStats(object):
+    def __init__(self, window=1000):
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.dropped = 0
+        # Seconds replies spent in queue, for the last ``window`` sends
+        self.wait_times = deque(maxlen=window)
+
+    def record_wait(self, seconds):
+        self.wait_times.append(seconds)
+
+    def as_dict(self):
+        waits = self.wait_times
+        return dict(
+            sent=self.sent,
+            coalesced=self.coalesced,
+            rate_limited=self.rate_limited,
+            failed=self.failed,
+            dropped=self.dropped,
+            wait_avg=sum(waits) / len(waits) if waits else 0,
+            wait_max=max(waits) if waits else 0,
+        )
+
+
+class _Item(object):
+    __slots__ = ('reply', 'future', 'enqueued_at', 'retries')
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.future = Future()
+        self.enqueued_at = time.time()
+        self.retries = 0
+
+
+class OutboundScheduler(object):
+    """Queue replies per channel and send them under rate limits
+
+    Replies of one channel are sent in FIFO order, channels take turns
+    round-robin. Each send takes a token from the global bucket and from the
+    bucket of its channel. On HTTP 429 all sending pauses for ``Retry-After``
+    seconds and the replies are put back to the head of their queue.
+
+    With ``coalesce`` enabled, consecutive plain-text replies (no extra
+    args) queued for the same channel are joined into one message.
+    """
+
+    def __init__(self, send, rate=10, burst=20, channel_rate=1, channel_burst=3,
+                 concurrency=4, coalesce=False, coalesce_max_length=4000, max_retries=3):
+        # A coroutine function that takes a `Reply` and sends it
+        self.send = send
+        self.bucket = TokenBucket(rate, burst)
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.concurrency = concurrency
+        self.coalesce = coalesce
+        self.coalesce_max_length = coalesce_max_length
+        self.max_retries = max_retries
+
+        self.stats = OutboundStats()
+
+        self._queues = {}
+        self._channel_buckets = {}
+        # Channels that have replies queued and are not being sent
+        self._ready = deque()
+        # Created in `start`, a Condition binds to current IOLoop
+        self._ready_cond = None
+        self._paused_until = 0
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._ready_cond = Condition()
+        io_loop = IOLoop.current()
+        for _ in range(self.concurrency):
+            io_loop.spawn_callback(self._worker)
+
+    def put(self, reply):
+        """Queue a reply, return a future resolved with the API response"""
+        self.start()
+
+        item = _Item(reply)
+        channel_id = reply.channel_id
+        queue = self._queues.get(channel_id)
+        if queue is None:
+            queue = self._queues[channel_id] = deque()
+            self._set_ready(channel_id)
+        queue.append(item)
+        return item.future
+
+    def queue_depth(self, channel_id=None):
+        if channel_id is not None:
+            return len(self._queues.get(channel_id, ()))
+        return sum(len(q) for q in itervalues(self._queues))
+
+    def get_stats(self):
+        rv = self.stats.as_dict()
+        depths = [len(q) for q in itervalues(self._queues) if q]
+        rv.update(
+            queued=sum(depths),
+            channels_queued=len(depths),
+            max_channel_depth=max(depths) if depths else 0,
+            paused=max(0, self._paused_until - time.time()),
+        )
+        return rv
+
+    def _set_ready(self, channel_id):
+        self._ready.append(channel_id)
+        self._ready_cond.notify()
+
+    def _get_channel_bucket(self, channel_id):
+        bucket = self._channel_buckets.get(channel_id)
+        if bucket is None:
+            bucket = TokenBucket(self.channel_rate, self.channel_burst)
+            self._channel_buckets[channel_id] = bucket
+        return bucket
+
+    @gen.coroutine
+    def _worker(self):
+        while True:
+            while not self._ready:
+                yield self._ready_cond.wait()
+            channel_id = self._ready.popleft()
+
+            # Wait for a global token, a paused state applies to all channels
+            while True:
+                now = time.time()
+                delay = max(self._paused_until - now, self.bucket.delay(now))
+                if delay <= 0:
+                    break
+                yield gen.sleep(delay)
+
+            # Don't hold the worker while this channel is throttled
+            delay = self._get_channel_bucket(channel_id).delay()
+            if delay > 0:
+                IOLoop.current().call_later(delay, self._set_ready, channel_id)
+                continue
+
+            self.bucket.consume()
+            self._get_channel_bucket(channel_id).consume()
+            try:
+                yield self._send_items(channel_id, self._take(channel_id))
+            except Exception as e:
+                logging.error('Outbound worker error: %s', e)
+
+            if self._queues.get(channel_id):
+                self._set_ready(channel_id)
+            else:
+                self._queues.pop(channel_id, None)
+
+    def _take(self, channel_id):
+        queue = self._queues[channel_id]
+        items = [queue.popleft()]
+        if not self.coalesce or items[0].reply.extra_args:
+            return items
+
+        length = len(items[0].reply.text)
+        while queue and not queue[0].reply.extra_args:
+            length += len(queue[0].reply.text) + 1
+            if length > self.coalesce_max_length:
+                break
+            items.append(queue.popleft())
+        return items
+
+    @gen.coroutine
+    def _send_items(self, channel_id, items):
+        if len(items) == 1:
+            reply = items[0].reply
+        else:
+            reply = Reply(channel_id, '\n'.join(i.reply.text for i in items))
+            self.stats.coalesced += len(items) - 1
+
+        try:
+            rv = yield self.send(reply)
+        except APIRateLimited as e:
+            self.stats.rate_limited += 1
+            self._paused_until = time.time() + e.retry_after
+            logging.warn('Rate limited, pause sending for %ss', e.retry_after)
+
+            queue = self._queues[channel_id]
+            for item in reversed(items):
+                item.retries += 1
+                if item.retries > self.max_retries:
+                    self.stats.dropped += 1
+                    item.future.set_exception(e)
+                else:
+                    queue.appendleft(item)
+            return
+        except Exception as e:
+            self.stats.failed += len(items)
+            for item in items:
+                item.future.set_exception(e)
+            return
+
+        now = time.time()
+        self.stats.sent += 1
+        for item in items:
+            self.stats.record_wait(now - item.enqueued_at)
+            item.future.set_result(rv)
@@ -1,14 +1,176 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import re
 
-PATTERNS = []
+from .compat import string_types
 
 
-def register_pattern(func):
-    pass
+# Python 2 `re` supports at most 100 groups in one pattern
+MAX_GROUPS = 90
 
+_META_CHARS = set('.^$*+?{}[]\\|()')
+_NAMED_GROUP = re.compile(r'\(\?P([<=])(\w+)')
+# Numbered backrefs, conditional groups and inline flags change meaning
+# in an alternation
+_NOT_MERGEABLE = re.compile(r'\\[1-9]|\(\?\(|\(\?[aiLmsux]')
 
-@register_pattern
-def match_text():
-    pass
+
+class PatternSet(object):
+    """A set of patterns matched against text at once
+
+    Patterns use ``re.match`` semantic, they are anchored at the start of
+    text. Literal patterns are put into a prefix trie, all the others are
+    merged into alternations of named groups, so that one pass over the
+    text finds the patterns that match.
+
+    ``match`` returns a dict of pattern id to named groups of the pattern.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._patterns = []
+        # Ids of string patterns that run on their own
+        self._unmergeable = set()
+        self._compiled = False
+
+    def add(self, pattern):
+        """Add a pattern (string or compiled regex), return its id.
+        Raise ValueError if it's not a valid regex.
+        """
+        if isinstance(pattern, string_types):
+            key = pattern
+            # Fail on registration, not on every message
+            try:
+                compiled = re.compile(pattern)
+            except re.error as e:
+                raise ValueError('Invalid pattern %r: %s' % (pattern, e))
+        else:
+            key = (pattern.pattern, pattern.flags)
+        if key in self._ids:
+            return self._ids[key]
+
+        pid = len(self._patterns)
+        if isinstance(pattern, string_types):
+            if _NOT_MERGEABLE.search(pattern) or compiled.groups + 1 > MAX_GROUPS:
+                self._unmergeable.add(pid)
+            else:
+                # The rewritten pattern could still break, keep it out of
+                # alternations then, instead of failing them on every match
+                try:
+                    re.compile(_merged_part(pid, pattern))
+                except re.error:
+                    self._unmergeable.add(pid)
+        self._patterns.append(pattern)
+        self._ids[key] = pid
+        self._compiled = False
+        return pid
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def compile(self):
+        trie = {}
+        singles = []
+        chunks = []
+        chunk = []
+        chunk_groups = 0
+
+        for pid, pattern in enumerate(self._patterns):
+            if not isinstance(pattern, string_types):
+                singles.append((pid, pattern))
+                continue
+
+            if not _META_CHARS.intersection(pattern):
+                node = trie
+                for char in pattern:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append(pid)
+                continue
+
+            compiled = re.compile(pattern)
+            if pid in self._unmergeable:
+                singles.append((pid, compiled))
+                continue
+
+            if chunk and chunk_groups + compiled.groups + 1 > MAX_GROUPS:
+                chunks.append(_Alternation(chunk))
+                chunk = []
+                chunk_groups = 0
+            chunk.append((pid, pattern, compiled))
+            chunk_groups += compiled.groups + 1
+
+        if chunk:
+            chunks.append(_Alternation(chunk))
+
+        self._trie = trie
+        self._singles = singles
+        self._chunks = chunks
+        self._compiled = True
+
+    def match(self, text):
+        if not self._compiled:
+            self.compile()
+
+        matches = {}
+
+        node = self._trie
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            for pid in node.get(None, ()):
+                matches[pid] = {}
+
+        for chunk in self._chunks:
+            chunk.match(text, matches)
+
+        for pid, compiled in self._singles:
+            m = compiled.match(text)
+            if m:
+                matches[pid] = m.groupdict()
+
+        return matches
+
+
+class _Alternation(object):
+    """Patterns merged as ``(?P<_p0>...)|(?P<_p1>...)``, group names inside
+    are prefixed with the pattern id to avoid conflicts.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self._positions = {pid: i for i, (pid, _, _) in enumerate(items)}
+        self._parts = [_merged_part(pid, pattern) for pid, pattern, _ in items]
+        self._regexes = {}
+        # Compile the whole of it now, so that it fails in `compile`
+        self._get_regex(0)
+
+    def _get_regex(self, start):
+        # Alternation of the patterns from ``start``, so that patterns after
+        # the matched one could be tried as well
+        regex = self._regexes.get(start)
+        if regex is None:
+            regex = self._regexes[start] = re.compile('|'.join(self._parts[start:]))
+        return regex
+
+    def match(self, text, matches):
+        positions = self._positions
+        start = 0
+        while start < len(self.items):
+            m = self._get_regex(start).match(text)
+            if not m:
+                return
+            # The outer group closes last
+            pid = int(m.lastgroup[2:])
+            compiled = self.items[positions[pid]][2]
+            matches[pid] = {
+                name: m.group('_g%d_%s' % (pid, name)) for name in compiled.groupindex}
+            start = positions[pid] + 1
+
+
+def _merged_part(pid, pattern):
+    """``pattern`` as the named group of ``pid`` in an alternation"""
+    pattern = _NAMED_GROUP.sub(
+        lambda m: '(?P%s_g%d_%s' % (m.group(1), pid, m.group(2)), pattern)
+    return '(?P<_p%d>%s)' % (pid, pattern)
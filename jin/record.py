@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import gzip
+import time
+import logging
+from tornado import gen
+
+from .core import AsyncAPIClient
+from .utils import utf8, ObjectDict
+from .directory import Directory
+
+
+class Recorder(object):
+    """Append received frames to gzip files, one ``<timestamp>\t<frame>``
+    per line. Frames are buffered in memory and written on ``flush``, or
+    when ``buffer_size`` frames are buffered.
+
+    Each flush appends a complete gzip member, so the file is always
+    readable, and a crash loses no more than the buffer. The file is
+    rotated like ``logging.handlers.RotatingFileHandler`` when it grows
+    over ``max_bytes``, ``path.1`` is the newest backup.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backup_count=10, buffer_size=1000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self._buffer = []
+
+    def write(self, frame):
+        self._buffer.append(utf8('%.6f\t%s\n' % (time.time(), frame)))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+
+        with open(self.path, 'ab') as f:
+            gz = gzip.GzipFile(fileobj=f, mode='wb')
+            gz.write(data)
+            gz.close()
+            size = f.tell()
+
+        if size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            src = '%s.%d' % (self.path, i)
+            if os.path.exists(src):
+                os.rename(src, '%s.%d' % (self.path, i + 1))
+        if self.backup_count > 0:
+            os.rename(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        logging.info('Rotated recording %s', self.path)
+
+    def close(self):
+        self.flush()
+
+
+def recording_files(path):
+    """Files of a recording from the oldest to the newest"""
+    backups = []
+    i = 1
+    while os.path.exists('%s.%d' % (path, i)):
+        backups.append('%s.%d' % (path, i))
+        i += 1
+    files = list(reversed(backups))
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_recording(path):
+    """Yield ``(timestamp, frame)`` of a recording, including rotated files"""
+    for filename in recording_files(path):
+        f = gzip.open(filename, 'rb')
+        try:
+            for line in f:
+                ts, _, frame = line.decode('utf-8').rstrip('\n').partition('\t')
+                yield float(ts), frame
+        finally:
+            f.close()
+
+
+class CapturingAPIClient(AsyncAPIClient):
+    """API client that records calls instead of sending them"""
+
+    def __init__(self, token='replay'):
+        super(CapturingAPIClient, self).__init__(token)
+        self.calls = []
+
+    @gen.coroutine
+    def api_call(self, method, **kwargs):
+        self.calls.append((time.time(), method, kwargs))
+        raise gen.Return({'ok': True, 'ts': '%.6f' % time.time()})
+
+
+class UnlimitedOutbound(object):
+    """Stands in for `OutboundScheduler`, sends replies right away, with
+    no rate limits, queueing or coalescing
+    """
+
+    def __init__(self, send):
+        self.send = send
+
+    def put(self, reply):
+        return gen.convert_yielded(self.send(reply))
+
+    def queue_depth(self, channel_id=None):
+        return 0
+
+
+class Replayer(object):
+    """Feed a recording through `SlackBot.handle_frame`
+
+    ``speed`` is a multiplier of the recorded pace, 0 replays as fast as
+    the bot could take. API calls made by handlers are captured in
+    ``client.calls`` instead of being sent, replies skip outbound rate
+    limits, which would otherwise be what the replay measures.
+    """
+
+    def __init__(self, bot, speed=1, self_id=None):
+        self.bot = bot
+        self.speed = speed
+        self.client = CapturingAPIClient()
+
+        bot.async_client = self.client
+        bot.outbound = UnlimitedOutbound(bot._send_reply)
+        if bot.directory is None:
+            bot.directory = Directory(**bot.directory_fields)
+        if not hasattr(bot, 'selfinfo'):
+            bot.selfinfo = ObjectDict(id=self_id)
+
+    @gen.coroutine
+    def replay(self, frames):
+        """Replay ``(timestamp, frame)`` pairs, return stats when all are handled"""
+        count = 0
+        first_ts = None
+        start = time.time()
+        for ts, frame in frames:
+            if first_ts is None:
+                first_ts = ts
+            if self.speed:
+                delay = (ts - first_ts) / float(self.speed) - (time.time() - start)
+                if delay > 0:
+                    yield gen.sleep(delay)
+            yield self.bot.handle_frame(frame)
+            count += 1
+
+        yield self.bot.dispatcher.join()
+        elapsed = time.time() - start
+        raise gen.Return(dict(
+            frames=count,
+            elapsed=elapsed,
+            frames_per_sec=count / elapsed if elapsed else 0,
+            api_calls=len(self.client.calls),
+        ))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import zlib
+import logging
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.process import task_id, cpu_count
+
+from .web import make_application
+from .server import run_server
+
+
+class Runtime(object):
+    """Run a bot in many workspaces in one IOLoop
+
+    Handlers and web routes are registered once on ``bot``, each workspace
+    gets its own bot by `SlackBot.for_workspace`, with its own client,
+    directory and connections. ``workspaces`` is a dict of workspace name
+    (team id) to token.
+
+    With ``num_processes`` other than 1, workspaces are sharded across
+    forked processes by the hash of their names.
+
+    ``bot`` itself is never started, jobs registered by `SlackBot.every`
+    and friends run on every workspace bot, and so do message jobs
+    scheduled on ``bot`` before start. Web routes get ``bot``, they should
+    find the bot of a workspace in ``bot.workspace_bots``.
+    """
+
+    def __init__(self, bot, workspaces, num_processes=1):
+        self.bot = bot
+        self.workspaces = workspaces
+        self.num_processes = num_processes
+        # Workspace name -> bot, of the current process
+        self.bots = {}
+
+    def shard(self, index, total):
+        """Workspace names handled by the ``index``-th of ``total`` processes"""
+        return sorted(
+            name for name in self.workspaces
+            if zlib.crc32(name.encode('utf-8')) % total == index)
+
+    @gen.coroutine
+    def start(self):
+        index = task_id()
+        if index is None:
+            names = sorted(self.workspaces)
+        else:
+            # fork_processes(0) forks as many processes as CPUs
+            total = self.num_processes or cpu_count()
+            names = self.shard(index, total)
+        logging.info('Start workspaces in process %s: %s', index, ', '.join(names))
+
+        io_loop = IOLoop.current()
+        for name in names:
+            bot = self.bot.for_workspace(name, self.workspaces[name])
+            self.bots[name] = bot
+            io_loop.spawn_callback(bot.start)
+
+    def run(self):
+        config = self.bot.config
+        application = make_application(self.bot._web_handlers, {
+            # Autoreload doesn't work with multiple processes
+            'debug': config.DEBUG and self.num_processes == 1,
+        }, metrics_path=config.METRICS_PATH)
+
+        run_server(self.start, application, config.PORT, self.num_processes, config.ENGINE)
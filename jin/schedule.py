@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import json
+import time
+import heapq
+import hashlib
+import uuid
+import logging
+import datetime
+import traceback
+from collections import deque
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from .compat import string_types
+from . import metrics
+
+
+class IntervalTrigger(object):
+    """Every ``seconds``, the first run is ``seconds`` after the job is added"""
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError('Interval should be positive, got %r' % seconds)
+        self.seconds = seconds
+
+    def next_run(self, last, now):
+        """The first run time after ``now``, ``last`` is the scheduled time
+        of the previous run, or None for the first run
+        """
+        if last is None:
+            return now + self.seconds
+        # Runs missed (e.g. while the bot was down) are skipped
+        return last + (int((now - last) // self.seconds) + 1) * self.seconds
+
+    def to_dict(self):
+        return {'every': self.seconds}
+
+
+class DateTrigger(object):
+    """Once at ``when``, a timestamp or a naive local datetime"""
+
+    def __init__(self, when):
+        if isinstance(when, datetime.datetime):
+            when = time.mktime(when.timetuple()) + when.microsecond / 1e6
+        self.when = when
+
+    def next_run(self, last, now):
+        if last is None:
+            return self.when
+        return None
+
+    def to_dict(self):
+        return {'at': self.when}
+
+
+# Range of each field of cron expressions
+_CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 6),
+)
+
+_CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+}
+
+
+class CronTrigger(object):
+    """Standard 5 fields cron expression in local time, e.g. ``0 9 * * 1-5``.
+
+    Fields support ``*``, ``a-b``, ``*/n``, ``a-b/n`` and lists of them,
+    weekday 0 (or 7) is Sunday. As in cron, when both day and weekday are
+    restricted, matching either of them is enough.
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        fields = _CRON_ALIASES.get(expr, expr).split()
+        if len(fields) != len(_CRON_FIELDS):
+            raise ValueError('Cron expression should have 5 fields, got %r' % expr)
+        values = []
+        for field, (name, low, high) in zip(fields, _CRON_FIELDS):
+            if name == 'weekday':
+                high = 7
+            values.append(_parse_cron_field(field, low, high))
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = frozenset(i % 7 for i in weekdays)
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _match_day(self, dt):
+        in_days = dt.day in self.days
+        # Python counts weekdays from Monday, cron from Sunday
+        in_weekdays = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return in_weekdays
+        if self.any_weekday:
+            return in_days
+        return in_days or in_weekdays
+
+    def next_run(self, last, now):
+        dt = datetime.datetime.fromtimestamp(now).replace(second=0, microsecond=0)
+        dt += datetime.timedelta(minutes=1)
+        # Give up on expressions that never match, e.g. `0 0 30 2 *`
+        max_year = dt.year + 5
+        while dt.year <= max_year:
+            if dt.month not in self.months:
+                if dt.month == 12:
+                    dt = dt.replace(year=dt.year + 1, month=1, day=1, hour=0, minute=0)
+                else:
+                    dt = dt.replace(month=dt.month + 1, day=1, hour=0, minute=0)
+                continue
+            if not self._match_day(dt):
+                dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+                continue
+            if dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+            if dt.minute not in self.minutes:
+                dt += datetime.timedelta(minutes=1)
+                continue
+            return time.mktime(dt.timetuple())
+        return None
+
+    def to_dict(self):
+        return {'cron': self.expr}
+
+
+def _parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = [int(i) for i in part.split('-', 1)]
+        else:
+            start = end = int(part)
+            if step != 1:
+                end = high
+        if not (low <= start <= end <= high) or step < 1:
+            raise ValueError('Invalid cron field %r' % field)
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+def make_trigger(every=None, at=None, cron=None):
+    """Make a trigger from exactly one of the arguments"""
+    given = [i for i in (every, at, cron) if i is not None]
+    if len(given) != 1:
+        raise ValueError('Exactly one of every, at and cron should be given')
+    if every is not None:
+        return IntervalTrigger(every)
+    if at is not None:
+        return DateTrigger(at)
+    return CronTrigger(cron)
+
+
+def trigger_from_dict(data):
+    return make_trigger(data.get('every'), data.get('at'), data.get('cron'))
+
+
+def make_job_id(trigger, text, channels, users):
+    """A stable id of a message job"""
+    data = json.dumps([trigger.to_dict(), text, list(channels), list(users)], sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class Job(object):
+    """A scheduled call of ``func(bot)``, or a message of ``text`` sent
+    to ``channels`` and ``users``. Only message jobs are persisted, function
+    jobs are defined in code and registered again on start.
+    """
+
+    __slots__ = ('id', 'trigger', 'next_run', 'func', 'text', 'channels', 'users',
+                 'name', 'running', 'cancelled')
+
+    def __init__(self, job_id, trigger, func=None, text=None, channels=(), users=(),
+                 next_run=None):
+        self.id = job_id
+        self.trigger = trigger
+        self.func = func
+        self.text = text
+        self.channels = list(channels)
+        self.users = list(users)
+        self.next_run = next_run
+        # Label in metrics, not the id, there could be thousands of message jobs
+        if func is not None:
+            self.name = '%s.%s' % (func.__module__, func.__name__)
+        else:
+            self.name = 'message'
+        self.running = False
+        self.cancelled = False
+
+    @property
+    def persistent(self):
+        return self.func is None
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            trigger=self.trigger.to_dict(),
+            next_run=self.next_run,
+            text=self.text,
+            channels=self.channels,
+            users=self.users,
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['id'], trigger_from_dict(data['trigger']),
+            text=data['text'], channels=data['channels'], users=data['users'],
+            next_run=data['next_run'])
+
+    def __repr__(self):
+        return '<Job %s %s next_run=%s>' % (self.id, self.trigger.to_dict(), self.next_run)
+
+
+class Scheduler(object):
+    """Run jobs when they are due, by ``run_job(job)`` coroutine
+
+    Jobs are kept in a heap by their next run time, with one IOLoop timeout
+    for the earliest of them, so the number of jobs costs nothing while
+    waiting. Due jobs wait in a queue when ``concurrency`` jobs are already
+    running, a job is skipped if it's due again while still running.
+
+    Jobs are added and cancelled in IOLoop thread, before `start` they
+    only go into the heap.
+    """
+
+    def __init__(self, run_job, concurrency=10):
+        self.run_job = run_job
+        self.concurrency = concurrency
+        # (next_run, seq, job), cancelled jobs are dropped when they come up
+        self._heap = []
+        self._seq = 0
+        # id -> job
+        self._jobs = {}
+        self._due = deque()
+        self._running = 0
+        self._timeout = None
+        self._timeout_at = None
+        self.started = False
+        # Persistent jobs changed since last `save`
+        self.dirty = False
+
+    def add(self, trigger, func=None, text=None, channels=(), users=(), job_id=None):
+        """Add a job, one with the same ``job_id`` is replaced. Message jobs
+        without ``job_id`` get one made of their arguments, so that adding
+        the same job on every start replaces the saved one.
+        """
+        if func is None and text is None:
+            raise ValueError('Either func or text should be given')
+        if isinstance(channels, string_types):
+            channels = [channels]
+        if isinstance(users, string_types):
+            users = [users]
+        if job_id is None:
+            if func is None:
+                job_id = make_job_id(trigger, text, channels, users)
+            else:
+                job_id = uuid.uuid4().hex
+        job = Job(job_id, trigger, func, text, channels, users)
+        job.next_run = trigger.next_run(None, time.time())
+        self._add_job(job)
+        return job
+
+    def _add_job(self, job):
+        if job.id in self._jobs:
+            self.cancel(job.id)
+        if job.next_run is None:
+            logging.warn('Job %s will never run', job)
+            return
+        self._jobs[job.id] = job
+        if job.persistent:
+            self.dirty = True
+        self._push(job)
+
+    def _push(self, job):
+        self._seq += 1
+        heapq.heappush(self._heap, (job.next_run, self._seq, job))
+        if self.started:
+            self._arm()
+
+    def cancel(self, job_id):
+        """Cancel a job, return it, or None if there is no such job"""
+        job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job.cancelled = True
+            if job.persistent:
+                self.dirty = True
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Jobs by their next run time"""
+        return sorted(self._jobs.values(), key=lambda job: job.next_run)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        self._arm()
+
+    def stop(self):
+        self.started = False
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _arm(self):
+        heap = self._heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            return
+        when = heap[0][0]
+        if self._timeout is not None:
+            if self._timeout_at <= when:
+                return
+            IOLoop.current().remove_timeout(self._timeout)
+        # Not `call_at`, IOLoop.time is not wall clock time since tornado 5
+        self._timeout = IOLoop.current().call_later(max(0, when - time.time()), self._on_timeout)
+        self._timeout_at = when
+
+    def _on_timeout(self):
+        self._timeout = None
+        now = time.time()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            scheduled, _, job = heapq.heappop(heap)
+            if job.cancelled:
+                continue
+            self._due.append((scheduled, job))
+
+            job.next_run = job.trigger.next_run(scheduled, now)
+            if job.next_run is None:
+                # One-off job is done once it's taken out
+                del self._jobs[job.id]
+            else:
+                self._push(job)
+            if job.persistent:
+                self.dirty = True
+
+        self._launch()
+        if self.started:
+            self._arm()
+
+    def _launch(self):
+        while self._due and self._running < self.concurrency:
+            scheduled, job = self._due.popleft()
+            if job.cancelled:
+                continue
+            if job.running:
+                logging.warn('Job %s is still running, skip this run', job)
+                metrics.JOB_RUNS.inc((job.name, 'skipped'))
+                continue
+            metrics.JOB_LAG.observe(max(0, time.time() - scheduled))
+            job.running = True
+            self._running += 1
+            IOLoop.current().spawn_callback(self._run, job)
+
+    @gen.coroutine
+    def _run(self, job):
+        try:
+            yield self.run_job(job)
+        except Exception as e:
+            metrics.JOB_RUNS.inc((job.name, 'error'))
+            logging.error('Run job %s failed: %s\n%s', job, e, traceback.format_exc())
+        else:
+            metrics.JOB_RUNS.inc((job.name, 'ok'))
+        finally:
+            job.running = False
+            self._running -= 1
+            self._launch()
+
+    def save(self, path):
+        """Write persistent jobs to ``path`` as JSON"""
+        data = dict(jobs=[job.to_dict() for job in self.jobs() if job.persistent])
+        # Write to a temp file then rename, so a crash won't leave a broken file
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, path)
+        self.dirty = False
+        logging.info('Saved %s jobs to %s', len(data['jobs']), path)
+
+    def load(self, path):
+        """Add jobs saved by `save`, return the number of them. Jobs that
+        were due while the bot was down run right away, once.
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            jobs = [Job.from_dict(i) for i in data['jobs']]
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            logging.warn('Load jobs from %s failed: %s', path, e)
+            return 0
+
+        # Jobs added before loading may not be saved yet
+        dirty = self.dirty
+        for job in jobs:
+            self._add_job(job)
+        self.dirty = dirty
+        logging.info('Loaded %s jobs from %s', len(jobs), path)
+        return len(jobs)
@@ -1,12 +1,61 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+from __future__ import print_function
+
+import tornado
 from tornado.ioloop import IOLoop
 from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes
+
+
+ENGINES = ('tornado', 'asyncio', 'uvloop')
+
+
+def install_engine(engine):
+    """Make IOLoop run on top of an asyncio event loop, or on uvloop.
+    Must be called before IOLoop is created.
+
+    Since tornado 5 IOLoop always wraps asyncio on Python 3, then
+    ``asyncio`` changes nothing, and ``uvloop`` only sets the loop policy.
+    """
+    if engine not in ENGINES:
+        raise ValueError('engine should be one of %s, got %r' % (ENGINES, engine))
+    if engine == 'tornado':
+        return
+
+    try:
+        import asyncio
+    except ImportError:
+        raise RuntimeError('%s engine requires Python 3' % engine)
+    if engine == 'uvloop':
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    if tornado.version_info < (5,):
+        from tornado.platform.asyncio import AsyncIOMainLoop
+        # uvloop's policy doesn't create the loop on `get_event_loop`
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        AsyncIOMainLoop().install()
 
 
-def run_server(start_ws, application, port):
+def run_server(start_ws, application, port, num_processes=1, engine='tornado'):
+    """Run ``start_ws`` and the web application in one IOLoop. With
+    ``num_processes`` other than 1, fork that many processes first (0 for
+    the number of CPUs), they share the listening socket and ``start_ws``
+    runs in each of them, `tornado.process.task_id` tells them apart.
+    ``engine`` is one of `ENGINES`, see `install_engine`.
+    """
+    if num_processes != 1:
+        # IOLoop must not be created before forking
+        sockets = bind_sockets(port)
+        fork_processes(num_processes)
+    else:
+        sockets = None
 
+    # Each process gets its own event loop
+    install_engine(engine)
     io_loop = IOLoop.instance()
 
     # Websocket interface
@@ -14,7 +63,10 @@ def run_server(start_ws, application, port):
 
     # Web interface
     http_server = HTTPServer(application)
-    http_server.listen(port)
+    if sockets is None:
+        http_server.listen(port)
+    else:
+        http_server.add_sockets(sockets)
 
-    print 'Starting ioloop ..'
+    print('Starting ioloop ..')
     io_loop.start()
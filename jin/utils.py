@@ -1,8 +1,22 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
+import re
+import random
 from functools import wraps
 
+from .compat import iteritems, string_types, text_type
+
+# Use a faster JSON decoder when installed
+try:
+    from ujson import loads as json_loads
+except ImportError:
+    try:
+        from simplejson import loads as json_loads
+    except ImportError:
+        from json import loads as json_loads
+
 
 class ObjectDict(dict):
     """
@@ -27,28 +41,318 @@ class ObjectDict(dict):
         return '<ObjectDict %s >' % dict(self)
 
 
+_missing = object()
+
+
+class Record(object):
+    """Base of compact dict-like records, made by `make_record_class`.
+
+    Only ``fields`` are kept, in slots, other keys given to it are dropped.
+    It supports the read side of dict (``get``, ``[]``, ``in``, ``keys``,
+    ``**record``) and ``update``, which is what `SearchList` needs.
+    """
+
+    __slots__ = ()
+    fields = ()
+    # Fields whose string values are interned by `SearchList`
+    interned_fields = frozenset(['id', 'name'])
+
+    def __init__(self, raw=(), **fields):
+        self.update(raw, **fields)
+
+    def update(self, other=(), **fields):
+        for source in (other, fields):
+            if not source:
+                continue
+            for k in self.fields:
+                v = source.get(k, _missing)
+                if v is _missing:
+                    continue
+                setattr(self, k, v)
+
+    def get(self, key, default=None):
+        if key not in self._field_set:
+            return default
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        v = self.get(key, _missing)
+        if v is _missing:
+            raise KeyError(key)
+        return v
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def keys(self):
+        return [k for k in self.fields if hasattr(self, k)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.to_dict())
+
+
+_record_classes = {}
+
+
+def make_record_class(name, fields):
+    """Make a `Record` subclass keeping ``fields``, classes are shared by
+    the same name and fields
+    """
+    fields = tuple(fields)
+    cls = _record_classes.get((name, fields))
+    if cls is None:
+        cls = _record_classes[(name, fields)] = type(name, (Record,), dict(
+            __slots__=fields,
+            fields=fields,
+            _field_set=frozenset(fields),
+        ))
+    return cls
+
+
 class SearchList(list):
-    def __init__(self, raw_list, indexes=None):
+    """A list of dicts that could be searched by indexed keys
+
+    ``indexes`` is a list of keys, an item of it could also be a tuple of
+    keys to make a compound index, e.g. ``['id', 'name', ('name', 'is_archived')]``.
+    Use ``append``, ``insert``, ``remove``, ``update_item`` and ``upsert``
+    to change the list so that the indexes stay consistent.
+
+    With ``record_class`` (see `make_record_class`), dicts are converted to
+    compact records when added. Their ``interned_fields`` are interned in
+    ``strings``, a dict that could be shared by lists, so equal ids and
+    names are stored once, and freed along with the lists.
+    """
+
+    def __init__(self, raw_list, indexes=None, record_class=None, strings=None):
+        self.record_class = record_class
+        self.strings = {} if strings is None else strings
+        if record_class is not None:
+            raw_list = [self._make(i) for i in raw_list]
         list.__init__(self, raw_list)
-        index_maps = {}
-        if indexes:
-            for i in indexes:
-                _map = {item[i]: item for item in self}
-                index_maps[i] = _map
+        self.indexes = indexes or []
+        self.reindex()
+
+    def _make(self, item):
+        if self.record_class is None or isinstance(item, self.record_class):
+            return item
+        return self._intern(self.record_class(item))
 
-        self.indexes = indexes
+    def _intern(self, record):
+        # A dict rather than `intern`, which only takes byte strings on Python 2
+        for k in record.interned_fields:
+            v = record.get(k)
+            if isinstance(v, string_types):
+                setattr(record, k, self.strings.setdefault(v, v))
+        return record
+
+    def reindex(self):
+        # index -> key -> items having the key, in the order they were added
+        index_maps = {}
+        for i in self.indexes:
+            _map = {}
+            for item in self:
+                key = self._index_key(item, i)
+                if key is not None:
+                    _map.setdefault(key, []).append(item)
+            index_maps[i] = _map
         self.index_maps = index_maps
 
+    @staticmethod
+    def _index_key(item, index):
+        if isinstance(index, tuple):
+            key = tuple(item.get(k) for k in index)
+            if all(v is None for v in key):
+                return None
+            return key
+        return item.get(index)
+
+    @staticmethod
+    def _add_key(_map, key, item):
+        if key is not None:
+            _map.setdefault(key, []).append(item)
+
+    @staticmethod
+    def _remove_key(_map, key, item):
+        bucket = _map.get(key)
+        if not bucket:
+            return
+        # Compare by identity, equal dicts may be different records
+        for idx, other in enumerate(bucket):
+            if other is item:
+                del bucket[idx]
+                break
+        # The next item with the same key takes the place
+        if not bucket:
+            del _map[key]
+
+    def _add_to_indexes(self, item):
+        for i, _map in iteritems(self.index_maps):
+            self._add_key(_map, self._index_key(item, i), item)
+
+    def _remove_from_indexes(self, item):
+        for i, _map in iteritems(self.index_maps):
+            self._remove_key(_map, self._index_key(item, i), item)
+
+    def _lookup(self, index, key):
+        bucket = self.index_maps[index].get(key)
+        return bucket[0] if bucket else None
+
     def get(self, **kwargs):
-        k = kwargs.keys()[0]
-        v = kwargs.values()[0]
+        if not kwargs:
+            raise TypeError('get() requires at least one keyword argument')
+
+        keys = tuple(sorted(kwargs))
+        if len(keys) == 1:
+            index = keys[0]
+            if index in self.index_maps:
+                return self._lookup(index, kwargs[index])
+        elif keys in self.index_maps:
+            return self._lookup(keys, tuple(kwargs[k] for k in keys))
+        else:
+            # Narrow down by any single key index, then check the rest
+            for k in keys:
+                if k in self.index_maps:
+                    for item in self.index_maps[k].get(kwargs[k], ()):
+                        if self._match(item, kwargs):
+                            return item
+                    return None
 
         for i in self:
-            if i[k] == v:
+            if self._match(i, kwargs):
                 return i
 
         return None
 
+    @staticmethod
+    def _match(item, kwargs):
+        for k, v in iteritems(kwargs):
+            if item.get(k) != v:
+                return False
+        return True
+
+    def append(self, item):
+        item = self._make(item)
+        list.append(self, item)
+        self._add_to_indexes(item)
+        return item
+
+    def insert(self, index, item):
+        item = self._make(item)
+        list.insert(self, index, item)
+        self._add_to_indexes(item)
+        return item
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def remove(self, item):
+        # Compare by identity, equal dicts may be different records
+        for idx, other in enumerate(self):
+            if other is item:
+                del self[idx]
+                break
+        else:
+            raise ValueError('SearchList.remove(x): x not in list')
+        self._remove_from_indexes(item)
+
+    def update_item(self, item, *args, **fields):
+        """Update fields of an item in place and reindex it,
+        takes the same arguments as ``dict.update``
+        """
+        old_keys = [(i, self._index_key(item, i)) for i in self.indexes]
+        item.update(*args, **fields)
+        if isinstance(item, Record):
+            self._intern(item)
+        # Usually the indexed fields (e.g. id) don't change, leave them alone
+        for i, old_key in old_keys:
+            new_key = self._index_key(item, i)
+            if new_key != old_key:
+                _map = self.index_maps[i]
+                self._remove_key(_map, old_key, item)
+                self._add_key(_map, new_key, item)
+        return item
+
+    def upsert(self, new_item, key='id'):
+        """Update the item which has the same ``key`` as ``new_item``,
+        or append ``new_item`` if not found. Return the item in the list.
+        """
+        item = self.get(**{key: new_item[key]})
+        if item is None:
+            return self.append(new_item)
+        return self.update_item(item, new_item)
+
+    def filter(self, **kwargs):
+        """Return all items having the given values"""
+        return [i for i in self if self._match(i, kwargs)]
+
+    def pop_by(self, **kwargs):
+        """Remove and return the item found by ``get``, None if not found"""
+        item = self.get(**kwargs)
+        if item is not None:
+            self.remove(item)
+        return item
+
+
+_TYPE_FIELD = re.compile(r'"type"\s*:\s*"([^"\\]*)"')
+
+
+def sniff_type(frame):
+    """Get the value of ``type`` from a JSON object string without parsing it.
+
+    Return None when it could not be told for sure, e.g. the string has more
+    than one ``"type"`` in it (nested objects could have their own).
+    """
+    if frame.count('"type"') != 1:
+        return None
+    m = _TYPE_FIELD.search(frame)
+    if m:
+        return m.group(1)
+    return None
+
+
+class Backoff(object):
+    """Exponential backoff with jitter, the n-th delay is a random value
+    between half and all of ``min(cap, base * 2 ** n)``
+    """
+
+    def __init__(self, base=1, cap=60):
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+
+    def next(self):
+        delay = min(self.cap, self.base * 2 ** self.attempts)
+        self.attempts += 1
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+    def reset(self):
+        self.attempts = 0
+
+
+def format_path(path, **kwargs):
+    """Put a name into a file path, e.g. ``format_path('a.gz', workspace='w')``,
+    either by formatting ``{workspace}`` in it, or as a suffix before the
+    extension (``a.w.gz``)
+    """
+    (key, value), = kwargs.items()
+    if '{%s}' % key in path:
+        return path.format(**kwargs)
+    root, ext = os.path.splitext(path)
+    return '%s.%s%s' % (root, value, ext)
+
 
 def decorator_factory(before_wrapper=None, before_func=None):
     """Return a decorator which triggers callback in each phase"""
@@ -77,7 +381,7 @@ def utf8(value):
     """
     if isinstance(value, _UTF8_TYPES):
         return value
-    if not isinstance(value, unicode):
+    if not isinstance(value, text_type):
         raise TypeError(
             "Expected bytes, unicode, or None; got %r" % type(value)
         )
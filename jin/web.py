@@ -1,22 +1,196 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-from tornado.web import Application, RequestHandler
+from __future__ import print_function
 
+import time
+import json
+import hmac
+import hashlib
+import numbers
+import logging
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.web import Application, RequestHandler, HTTPError
 
-def make_application(handlers, options):
-    """Make a simple tornado application"""
+from .compat import iteritems, string_types
+from .metrics import REGISTRY
+from .utils import utf8, json_loads
+from . import cache
+
+
+def make_application(handlers, options, metrics_path='/metrics'):
+    """Make a simple tornado application, with metrics exposed on
+    ``metrics_path`` unless it's None
+    """
+    handlers = list(handlers)
+    if metrics_path:
+        handlers.append((metrics_path, MetricsHandler))
 
     application = Application(handlers, **options)
-    for host, rules in application.handlers:
-        for i in rules:
-            print i.regex.pattern
+    # `Application.handlers` is gone since tornado 4.5, print the specs instead
+    for spec in handlers:
+        print(spec[0])
 
     return application
 
 
+def verify_signature(secret, timestamp, body, signature, max_age=300):
+    """Verify ``X-Slack-Signature`` of a request from Slack, requests older
+    than ``max_age`` seconds are refused against replay.
+    https://api.slack.com/authentication/verifying-requests-from-slack
+    """
+    try:
+        timestamp = int(timestamp)
+    except (TypeError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > max_age:
+        return False
+    base = b'v0:' + utf8(str(timestamp)) + b':' + body
+    expected = 'v0=' + hmac.new(utf8(secret), base, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(utf8(expected), utf8(signature or ''))
+
+
 class SlackHandler(RequestHandler):
     pass
 
 
+class EventsHandler(RequestHandler):
+    """Receive Events API callbacks, routed at ``EVENTS_PATH`` in config.
+
+    Slack waits no more than 3 seconds for the response, and retries
+    otherwise, so the event is acknowledged right away and handled after.
+    Retries are dropped by event id within a process, one that lands on
+    another of the forked processes is handled again.
+    """
+
+    def initialize(self, bot):
+        self.bot = bot
+
+    def post(self):
+        headers = self.request.headers
+        if not verify_signature(
+                self.bot.config.SLACK_SIGNING_SECRET,
+                headers.get('X-Slack-Request-Timestamp'),
+                self.request.body,
+                headers.get('X-Slack-Signature'),
+                self.bot.config.EVENTS_MAX_AGE):
+            logging.warn('Refuse request with bad signature from %s', self.request.remote_ip)
+            self.send_error(403)
+            return
+
+        try:
+            payload = json_loads(self.request.body)
+        except ValueError:
+            self.send_error(400)
+            return
+
+        kind = payload.get('type')
+        if kind == 'url_verification':
+            self.write({'challenge': payload.get('challenge')})
+            return
+        if kind == 'event_callback':
+            IOLoop.current().spawn_callback(self.bot.handle_event, payload)
+        else:
+            logging.debug('Ignore callback of type %s', kind)
+        self.finish()
+
+
+class MetricsHandler(RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(REGISTRY.render())
+
+
+class CacheHandler(RequestHandler):
+    """Inspect and invalidate handler caches, route it with a name group::
+
+        bot.route(r'/cache/([^/]*)')(CacheHandler)
+
+    ``GET /cache/`` lists caches and their sizes, ``DELETE /cache/<name>``
+    invalidates entries matching the query arguments, e.g.
+    ``?service=db``, or all entries without arguments. Caches are shared
+    by the bots of all workspaces, add ``workspace`` to the arguments to
+    invalidate only the entries of one.
+    """
+
+    def get(self, name):
+        self.write({k: len(v) for k, v in iteritems(cache.CACHES)})
+
+    def delete(self, name):
+        if name not in cache.CACHES:
+            self.send_error(404)
+            return
+        fields = {k: self.get_argument(k) for k in self.request.query_arguments}
+        self.write({'invalidated': cache.invalidate(name, **fields)})
+
+
+class BroadcastHandler(RequestHandler):
+    """Broadcast a message by `SlackBot.broadcast`, routed at
+    ``BROADCAST_PATH`` in config.
+
+    ``POST`` with ``text`` and any number of ``channel`` and ``user``
+    arguments, ``where`` is a JSON object of field values to select
+    channels from directory. Results are streamed back as JSON lines
+    while they come.
+
+    Requests must carry ``BROADCAST_TOKEN`` in config, by
+    ``Authorization: Bearer <token>`` header or ``token`` argument. With
+    ``WORKSPACES``, the ``workspace`` argument tells where to broadcast.
+    """
+
+    def initialize(self, bot):
+        self.bot = bot
+
+    def prepare(self):
+        token = self.bot.config.BROADCAST_TOKEN
+        given = self.request.headers.get('Authorization', '')
+        if given.startswith('Bearer '):
+            given = given[len('Bearer '):]
+        else:
+            given = self.get_argument('token', '')
+        if not token or not hmac.compare_digest(utf8(token), utf8(given)):
+            logging.warn('Refuse broadcast request from %s', self.request.remote_ip)
+            raise HTTPError(403)
+
+    @gen.coroutine
+    def post(self):
+        bot = self.bot
+        if bot.workspace_bots:
+            bot = bot.workspace_bots.get(self.get_argument('workspace'))
+            if bot is None:
+                raise HTTPError(404, 'Unknown workspace')
+
+        text = self.get_argument('text')
+        where = self.get_argument('where', None)
+        if where:
+            try:
+                where = json.loads(where)
+            except ValueError:
+                where = None
+            if not _is_field_values(where):
+                raise HTTPError(400, 'where should be a JSON object of field values')
+
+        self.set_header('Content-Type', 'application/x-ndjson')
+
+        def on_result(result):
+            self.write(json.dumps(result) + '\n')
+            self.flush()
+
+        results = yield bot.broadcast(
+            text,
+            channels=self.get_arguments('channel'),
+            users=self.get_arguments('user'),
+            where=where,
+            on_result=on_result)
+        sent = sum(1 for i in results if i['ok'])
+        self.write(json.dumps({'done': True, 'sent': sent, 'failed': len(results) - sent}) + '\n')
+
+
+def _is_field_values(where):
+    return isinstance(where, dict) and where and all(
+        v is None or isinstance(v, string_types + (bool, numbers.Number))
+        for v in where.values())
+
+
 # TODO common control APIs (update info etc)
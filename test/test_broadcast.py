@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import unittest
+from tornado import gen
+from tornado.web import Application
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+
+from jin import SlackBot
+from jin.directory import Directory
+from jin.utils import ObjectDict
+from jin.web import BroadcastHandler
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    @gen.coroutine
+    def open_im(self, user_id):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        yield gen.sleep(0.01)
+        self.running -= 1
+        raise gen.Return('D' + user_id)
+
+
+class ResolveTargetsTest(AsyncTestCase):
+    @gen_test
+    def test_open_im_concurrently(self):
+        bot = SlackBot({'SLACK_TOKEN': 'x', 'DEBUG': False, 'BROADCAST_CONCURRENCY': 5})
+        bot.directory = Directory(
+            [{'id': 'U%d' % i, 'name': 'user%d' % i} for i in range(20)],
+            [{'id': 'C1', 'name': 'general', 'is_member': True},
+             {'id': 'C2', 'name': 'random', 'is_member': False}],
+            [])
+        bot.async_client = client = FakeClient()
+
+        targets = yield bot.resolve_targets(
+            ['#general', 'nope'], ['@user%d' % i for i in range(20)] + ['nobody'],
+            where={'is_member': True})
+        self.assertEqual(client.max_running, 5)
+        self.assertEqual(targets[:2], [('general', 'C1'), ('nope', None)])
+        self.assertEqual(targets[2], ('user0', 'DU0'))
+        self.assertEqual(targets[-1], ('nobody', None))
+        # C1 by `where` is already there
+        self.assertEqual(len(targets), 23)
+
+        # Known ones are not opened again
+        client.max_running = 0
+        yield bot.resolve_targets(users=['user1'])
+        self.assertEqual(client.max_running, 0)
+
+
+class FakeBot(object):
+    def __init__(self):
+        self.config = ObjectDict(BROADCAST_TOKEN='t0ken')
+        self.workspace_bots = {}
+        self.calls = []
+
+    @gen.coroutine
+    def broadcast(self, text, channels=(), users=(), where=None, on_result=None):
+        self.calls.append((text, channels, users, where))
+        result = dict(target=channels[0], channel_id='C1', ok=True, ts='1.0')
+        on_result(result)
+        raise gen.Return([result])
+
+
+class BroadcastHandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.bot = FakeBot()
+        return Application([('/broadcast', BroadcastHandler, {'bot': self.bot})])
+
+    def post(self, body, token='t0ken'):
+        headers = {'Authorization': 'Bearer ' + token} if token else {}
+        return self.fetch('/broadcast', method='POST', body=body, headers=headers)
+
+    def test_broadcast(self):
+        resp = self.post('text=hi&channel=general&where=%7B%22is_member%22%3A+true%7D')
+        self.assertEqual(resp.code, 200)
+        lines = [json.loads(i) for i in resp.body.decode('utf-8').splitlines()]
+        self.assertEqual(lines[0]['channel_id'], 'C1')
+        self.assertEqual(lines[-1], {'done': True, 'sent': 1, 'failed': 0})
+        self.assertEqual(self.bot.calls, [('hi', ['general'], [], {'is_member': True})])
+
+    def test_token_argument(self):
+        resp = self.post('text=hi&channel=general&token=t0ken', token=None)
+        self.assertEqual(resp.code, 200)
+
+    def test_bad_token(self):
+        self.assertEqual(self.post('text=hi&channel=general', token='nope').code, 403)
+        self.assertEqual(self.post('text=hi&channel=general', token=None).code, 403)
+        self.bot.config.BROADCAST_TOKEN = None
+        self.assertEqual(self.post('text=hi&channel=general', token='').code, 403)
+        self.assertEqual(self.bot.calls, [])
+
+    def test_workspace(self):
+        self.bot.workspace_bots['T1'] = t1 = FakeBot()
+        resp = self.post('text=hi&channel=general&workspace=T1')
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(len(t1.calls), 1)
+        self.assertEqual(self.post('text=hi&channel=general&workspace=T2').code, 404)
+        self.assertEqual(self.post('text=hi&channel=general').code, 400)
+        self.assertEqual(self.bot.calls, [])
+
+    def test_bad_where(self):
+        for where in ('nope', '[1]', '"x"', '{}', '{"name": {"$ne": 1}}', '{"name": [1]}'):
+            resp = self.post('text=hi&channel=general&where=' + where)
+            self.assertEqual(resp.code, 400, where)
+        self.assertEqual(self.bot.calls, [])
+
+
+class RunTest(unittest.TestCase):
+    def test_token_required(self):
+        bot = SlackBot({'SLACK_TOKEN': 'x', 'DEBUG': False, 'BROADCAST_PATH': '/broadcast'})
+        self.assertRaises(ValueError, bot.run)
+
+    def test_workspaces_in_processes(self):
+        bot = SlackBot({'SLACK_TOKEN': 'x', 'DEBUG': False, 'BROADCAST_PATH': '/broadcast',
+                        'BROADCAST_TOKEN': 't0ken', 'WORKSPACES': {'T1': 'x1'},
+                        'NUM_PROCESSES': 2})
+        self.assertRaises(ValueError, bot.run)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from jin.cache import ResponseCache, cached, invalidate, CACHES
+from jin.compat import is_awaitable
+from jin.message import Message, Reply
+
+
+def make_msg(text, channel='C1', user='U1'):
+    return Message({'type': 'message', 'text': text, 'channel': channel, 'user': user}, None)
+
+
+@gen.coroutine
+def call(handler, msg):
+    """Output of a handler, as the bot takes it"""
+    output = handler(msg)
+    if is_awaitable(output):
+        output = yield output
+    raise gen.Return(output)
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_expire(self):
+        cache = ResponseCache('test_expire', ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=-1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+
+    def test_lru(self):
+        cache = ResponseCache('test_lru', max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(len(cache), 2)
+
+
+class CachedTest(unittest.TestCase):
+    def test_cached(self):
+        calls = []
+
+        @cached(key=('text',), name='test_cached')
+        def status(msg, service):
+            calls.append(service)
+            return Reply(msg.channel_id, '%s is up' % service)
+
+        reply = status(make_msg('Status db'), service='db')
+        self.assertEqual((reply.channel_id, reply.text), ('C1', 'db is up'))
+        # Same key, goes to the channel of the new message
+        reply = status(make_msg('status  db ', channel='C2'), service='db')
+        self.assertEqual((reply.channel_id, reply.text), ('C2', 'db is up'))
+        status(make_msg('status web'), service='web')
+        self.assertEqual(calls, ['db', 'web'])
+
+        self.assertIs(CACHES['test_cached'], status.cache)
+        self.assertEqual(invalidate('test_cached', service='db'), 1)
+        status(make_msg('status db'), service='db')
+        self.assertEqual(calls, ['db', 'web', 'db'])
+
+    def test_none_not_cached(self):
+        calls = []
+
+        @cached(name='test_none_not_cached')
+        def handler(msg):
+            calls.append(1)
+
+        handler(make_msg('hi'))
+        handler(make_msg('hi'))
+        self.assertEqual(len(calls), 2)
+
+
+class CachedCoroutineTest(AsyncTestCase):
+    @gen_test
+    def test_coroutine(self):
+        calls = []
+
+        @cached(key=('text',), name='test_coroutine')
+        @gen.coroutine
+        def handler(msg):
+            calls.append(msg.channel_id)
+            yield gen.sleep(0.01)
+            raise gen.Return(Reply(msg.channel_id, 'pong'))
+
+        # Concurrent requests share the call in flight
+        replies = yield [call(handler, make_msg('ping')),
+                         call(handler, make_msg('ping', channel='C2'))]
+        self.assertEqual([r.channel_id for r in replies], ['C1', 'C2'])
+        self.assertEqual(calls, ['C1'])
+
+        # Then it's cached
+        reply = yield call(handler, make_msg('ping', channel='C3'))
+        self.assertEqual(reply.channel_id, 'C3')
+        self.assertEqual(calls, ['C1'])
+
+    @gen_test
+    def test_failure_not_cached(self):
+        calls = []
+
+        @cached(name='test_failure_not_cached')
+        @gen.coroutine
+        def handler(msg):
+            calls.append(1)
+            yield gen.moment
+            if len(calls) == 1:
+                raise ValueError('boom')
+            raise gen.Return('ok')
+
+        with self.assertRaises(ValueError):
+            yield call(handler, make_msg('hi'))
+        output = yield call(handler, make_msg('hi'))
+        self.assertEqual(output, 'ok')
+        output = yield call(handler, make_msg('hi'))
+        self.assertEqual(output, 'ok')
+        self.assertEqual(len(calls), 2)
+
+    @gen_test
+    def test_ttl(self):
+        calls = []
+
+        @cached(ttl=0.01, name='test_ttl')
+        @gen.coroutine
+        def handler(msg):
+            calls.append(1)
+            raise gen.Return('ok')
+
+        yield call(handler, make_msg('hi'))
+        yield call(handler, make_msg('hi'))
+        yield gen.sleep(0.02)
+        yield call(handler, make_msg('hi'))
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import time
+import unittest
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from jin.connection import ConnectionReader, ConnectionWatchdog, RecentSet, event_key
+from jin.errors import ReplyFailed
+
+
+class FakeConn(object):
+    """Serves ``limit`` frames then closes, counts how many were read"""
+
+    def __init__(self, limit=1000):
+        self.limit = limit
+        self.read = 0
+
+    @gen.coroutine
+    def read_message(self):
+        yield gen.moment
+        if self.read >= self.limit:
+            raise gen.Return(None)
+        self.read += 1
+        raise gen.Return(json.dumps({'type': 'message', 'text': str(self.read)}))
+
+
+class ConnectionReaderTest(AsyncTestCase):
+    @gen_test
+    def test_read_ahead(self):
+        conn = FakeConn()
+        reader = ConnectionReader(conn, read_ahead=5)
+        yield gen.sleep(0.01)
+        self.assertEqual(len(reader.frames), 5)
+
+        frame = yield reader.read()
+        self.assertEqual(json.loads(frame)['text'], '1')
+        yield gen.sleep(0.01)
+        self.assertEqual(len(reader.frames), 5)
+
+    @gen_test
+    def test_pending_replies_capped(self):
+        conn = FakeConn()
+        pending = [1]
+        reader = ConnectionReader(conn, read_ahead=5, buffer_size=50,
+                                  pending_replies=lambda: pending[0])
+        yield gen.sleep(0.05)
+        # Reads past read_ahead looking for acks, but not forever
+        self.assertEqual(len(reader.frames), 50)
+        self.assertEqual(conn.read, 50)
+
+        pending[0] = 0
+        yield reader.read()
+        yield gen.sleep(0.01)
+        self.assertEqual(len(reader.frames), 49)
+
+    @gen_test
+    def test_standby(self):
+        conn = FakeConn(limit=30)
+        reader = ConnectionReader(conn, primary=False, buffer_size=10)
+        yield gen.sleep(0.01)
+        self.assertTrue(reader.closed)
+        self.assertEqual(conn.read, 30)
+        self.assertEqual(json.loads(reader.frames[0])['text'], '21')
+
+    @gen_test
+    def test_promote(self):
+        frames = [
+            {'type': 'message', 'text': 'seen', 'ts': '1', 'channel': 'C1'},
+            {'type': 'message', 'text': 'new', 'ts': '2', 'channel': 'C1'},
+            {'type': 'user_typing', 'channel': 'C1'},
+        ]
+        conn = FakeConn(limit=0)
+        reader = ConnectionReader(conn, primary=False)
+        yield gen.sleep(0.01)
+        reader.frames.extend(json.dumps(i) for i in frames)
+        reader.frames.append('{not json')
+
+        recent = RecentSet(10)
+        recent.add(event_key(frames[0]))
+        reader.promote(recent)
+        self.assertTrue(reader.primary)
+        # Only events not seen yet, frames without ts can't be told apart
+        self.assertEqual([json.loads(i)['text'] for i in reader.frames], ['new'])
+        frame = yield reader.read()
+        self.assertEqual(json.loads(frame)['ts'], '2')
+
+
+class FakeSender(object):
+    """Answers pings after ``delay`` seconds, or fails them when ``delay`` is None"""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.sent = 0
+
+    @gen.coroutine
+    def send_frame(self, conn, raw, timeout=None):
+        self.sent += 1
+        if self.delay is None:
+            yield gen.moment
+            raise ReplyFailed('RTM message %s timed out' % self.sent)
+        yield gen.sleep(self.delay)
+        raise gen.Return({'type': 'pong', 'reply_to': self.sent})
+
+
+class FakeReader(object):
+    def __init__(self, backpressured=False):
+        self.backpressured = backpressured
+        self.last_read_at = time.time()
+
+    def wake(self):
+        pass
+
+
+class ConnectionWatchdogTest(AsyncTestCase):
+    def make_watchdog(self, sender, reader, **kwargs):
+        self.conn = object()
+        self.stale = []
+        return ConnectionWatchdog(sender, lambda: (self.conn, reader),
+                                  lambda conn, reason: self.stale.append(reason), **kwargs)
+
+    @gen_test
+    def test_pong(self):
+        watchdog = self.make_watchdog(FakeSender(0.02), FakeReader())
+        watchdog.missed = 1
+        yield watchdog.check()
+        self.assertGreaterEqual(watchdog.rtt, 0.02)
+        self.assertEqual(watchdog.missed, 0)
+        self.assertEqual(self.stale, [])
+
+    @gen_test
+    def test_missed_pongs(self):
+        watchdog = self.make_watchdog(FakeSender(None), FakeReader(), max_missed=2)
+        yield watchdog.check()
+        self.assertEqual((watchdog.missed, self.stale), (1, []))
+        yield watchdog.check()
+        self.assertEqual(self.stale, ['missed_pongs'])
+
+        # Counting starts over on a new connection
+        self.conn = object()
+        yield watchdog.check()
+        self.assertEqual(watchdog.missed, 1)
+
+    @gen_test
+    def test_silence(self):
+        reader = FakeReader()
+        sender = FakeSender()
+        watchdog = self.make_watchdog(sender, reader, silence=30)
+        reader.last_read_at -= 60
+        yield watchdog.check()
+        self.assertEqual(self.stale, ['silence'])
+        self.assertEqual(sender.sent, 0)
+
+    @gen_test
+    def test_backpressured(self):
+        # Pongs are behind frames the consumer hasn't taken yet
+        conn = FakeConn()
+        reader = ConnectionReader(conn, read_ahead=1, buffer_size=5, pending_replies=lambda: 1)
+        yield gen.sleep(0.01)
+        self.assertEqual(conn.read, 5)
+        reader.last_read_at -= 60
+        watchdog = self.make_watchdog(FakeSender(None), reader, max_missed=1, silence=30)
+        for _ in range(3):
+            yield watchdog.check()
+        self.assertEqual(self.stale, [])
+        self.assertEqual(watchdog.missed, 0)
+
+        reader.frames.clear()
+        yield watchdog.check()
+        self.assertEqual(self.stale, ['silence'])
+
+
+class RecentSetTest(unittest.TestCase):
+    def test_maxlen(self):
+        s = RecentSet(2)
+        for i in (1, 2, 2, 3):
+            s.add(i)
+        self.assertNotIn(1, s)
+        self.assertIn(2, s)
+        self.assertEqual(len(s), 2)
+
+        # Adding again doesn't make an item recent
+        s.add(2)
+        s.add(4)
+        self.assertEqual((2 in s, 3 in s, 4 in s), (False, True, True))
+
+
+class EventKeyTest(unittest.TestCase):
+    def test_event_key(self):
+        raw = {'type': 'message', 'ts': '1.0', 'channel': 'C1', 'user': 'U1'}
+        self.assertEqual(event_key(raw), event_key(dict(raw)))
+        self.assertNotEqual(event_key(raw), event_key(dict(raw, channel='C2')))
+        self.assertEqual(event_key({'type': 'channel_created', 'event_ts': '1.0',
+                                    'channel': {'id': 'C1'}}),
+                         event_key({'type': 'channel_created', 'event_ts': '1.0',
+                                    'channel': {'id': 'C1', 'name': 'general'}}))
+        self.assertIsNone(event_key({'type': 'presence_change', 'user': 'U1'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import socket
+import unittest
+from tornado import gen
+from tornado.iostream import StreamClosedError
+from tornado.web import Application, RequestHandler
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from jin.core import AsyncAPIClient
+from jin.errors import APICallFailed, APIRateLimited
+from jin.metrics import API_CALL_ERRORS
+
+
+class FakeAPIHandler(RequestHandler):
+    def post(self, method):
+        if method == 'rate.limited':
+            self.set_status(429, 'Too Many Requests')
+            self.set_header('Retry-After', '7')
+        elif method == 'bad.json':
+            self.write('nope')
+        else:
+            self.write({'ok': method == 'api.test', 'error': 'unknown_method'})
+
+
+class FailingHTTPClient(object):
+    def __init__(self, error):
+        self.error = error
+
+    @gen.coroutine
+    def fetch(self, request):
+        yield gen.moment
+        raise self.error
+
+
+class AsyncAPIClientTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([('/api/(.*)', FakeAPIHandler)])
+
+    def setUp(self):
+        super(AsyncAPIClientTest, self).setUp()
+        self.client = AsyncAPIClient('x', api_url=self.get_url('/api/'))
+
+    @gen.coroutine
+    def assert_fails(self, method, error_class=APICallFailed):
+        before = API_CALL_ERRORS.get((method,))
+        with self.assertRaises(error_class) as cm:
+            yield self.client.api_call(method)
+        self.assertEqual(API_CALL_ERRORS.get((method,)), before + 1)
+        raise gen.Return(cm.exception)
+
+    @gen_test
+    def test_ok(self):
+        rv = yield self.client.api_call('api.test', foo='bar')
+        self.assertTrue(rv['ok'])
+
+    @gen_test
+    def test_not_ok(self):
+        e = yield self.assert_fails('api.nope')
+        self.assertIn('unknown_method', str(e))
+        yield self.assert_fails('bad.json')
+
+    @gen_test
+    def test_rate_limited(self):
+        e = yield self.assert_fails('rate.limited', APIRateLimited)
+        self.assertEqual(e.retry_after, 7)
+
+    @gen_test
+    def test_connection_failed(self):
+        for error in (socket.error(111, 'Connection refused'), StreamClosedError(),
+                      RuntimeError('boom')):
+            self.client._http_client = FailingHTTPClient(error)
+            e = yield self.assert_fails('api.test')
+            self.assertIn(error.__class__.__name__, str(e))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import gzip
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from jin.directory import Directory, DirectoryLoader, SNAPSHOT_VERSION
+from jin.const import DEFAULT_USER_FIELDS, DEFAULT_CHANNEL_FIELDS
+
+
+class FakeClient(object):
+    """Serves users.list and conversations.list in pages"""
+
+    def __init__(self, users, channels, on_call=None):
+        self.data = {'users.list': ('members', users), 'conversations.list': ('channels', channels)}
+        self.calls = []
+        self.on_call = on_call
+
+    @gen.coroutine
+    def api_call(self, method, limit=100, cursor=None, **kwargs):
+        self.calls.append(method)
+        if method == 'users.info':
+            raise gen.Return({'ok': True, 'user': {'id': kwargs['user'], 'name': 'late'}})
+        if self.on_call:
+            yield self.on_call(method, cursor)
+        key, items = self.data[method]
+        start = int(cursor or 0)
+        next_cursor = start + limit if start + limit < len(items) else ''
+        raise gen.Return({
+            'ok': True,
+            key: items[start:start + limit],
+            'response_metadata': {'next_cursor': str(next_cursor)},
+        })
+
+
+def make_directory(**kwargs):
+    return Directory(
+        [{'id': 'U1', 'name': 'alice', 'real_name': 'Alice'}],
+        [{'id': 'C1', 'name': 'general', 'is_member': True}],
+        [{'id': 'G1', 'name': 'secret'}], **kwargs)
+
+
+class ApplyEventTest(unittest.TestCase):
+    def test_events(self):
+        directory = make_directory()
+        self.assertFalse(directory.dirty)
+
+        self.assertTrue(directory.apply_event(
+            {'type': 'channel_rename', 'channel': {'id': 'C1', 'name': 'main'}}))
+        self.assertTrue(directory.dirty)
+        self.assertEqual(directory.channels.get(name='main')['id'], 'C1')
+        self.assertIsNone(directory.channels.get(name='general'))
+
+        self.assertTrue(directory.apply_event({'type': 'channel_left', 'channel': 'C1'}))
+        self.assertFalse(directory.channels.get(id='C1')['is_member'])
+        self.assertTrue(directory.apply_event({'type': 'group_archive', 'channel': 'G1'}))
+        self.assertTrue(directory.groups.get(id='G1')['is_archived'])
+        self.assertTrue(directory.apply_event(
+            {'type': 'team_join', 'user': {'id': 'U2', 'name': 'bob'}}))
+        self.assertEqual(directory.users.get(name='bob')['id'], 'U2')
+        self.assertTrue(directory.apply_event({'type': 'channel_deleted', 'channel': 'C1'}))
+        self.assertIsNone(directory.channels.get(id='C1'))
+
+    def test_no_change(self):
+        directory = make_directory()
+        self.assertFalse(directory.apply_event({'type': 'message', 'text': 'hi'}))
+        self.assertFalse(directory.apply_event({'type': 'channel_archive', 'channel': 'C9'}))
+        self.assertFalse(directory.apply_event({'type': 'group_left', 'channel': 'G9'}))
+        self.assertFalse(directory.dirty)
+
+
+class ReplaceTest(unittest.TestCase):
+    def test_strings_released(self):
+        directory = make_directory(user_fields=['id', 'name'], channel_fields=['id', 'name'])
+        strings = directory.users.strings
+        self.assertIs(directory.groups.strings, strings)
+        self.assertIn('alice', strings)
+
+        directory.replace([{'id': 'U2', 'name': 'bob'}], [], [])
+        self.assertIsNot(directory.users.strings, strings)
+        self.assertNotIn('alice', directory.users.strings)
+        self.assertIn('bob', directory.users.strings)
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'directory.json.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        directory = make_directory(updated_at=1000)
+        directory.apply_event({'type': 'team_join', 'user': {'id': 'U2', 'name': 'bob'}})
+        directory.save(self.path)
+        self.assertFalse(directory.dirty)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+        loaded = Directory.load(self.path)
+        self.assertEqual(loaded.updated_at, 1000)
+        self.assertFalse(loaded.dirty)
+        self.assertEqual(loaded.users.get(name='bob')['id'], 'U2')
+        self.assertEqual(loaded.channels.get(id='C1')['name'], 'general')
+        self.assertEqual(loaded.groups.get(id='G1')['name'], 'secret')
+
+    def test_round_trip_fields(self):
+        fields = dict(user_fields=['id', 'name'], channel_fields=['id', 'name'])
+        make_directory(**fields).save(self.path)
+        loaded = Directory.load(self.path, **fields)
+        user = loaded.users.get(id='U1')
+        self.assertEqual(user['name'], 'alice')
+        self.assertNotIn('real_name', dict(user))
+
+    def test_fields_mismatch(self):
+        make_directory(user_fields=['id', 'name']).save(self.path)
+        self.assertIsNone(Directory.load(self.path))
+        self.assertIsNone(Directory.load(self.path, user_fields=['id', 'name', 'tz']))
+        self.assertIsNotNone(Directory.load(self.path, user_fields=['id', 'name']))
+
+    def test_version_mismatch(self):
+        f = gzip.open(self.path, 'wb')
+        f.write(json.dumps(dict(
+            version=SNAPSHOT_VERSION - 1, updated_at=1000,
+            users=[], channels=[], groups=[])).encode('utf-8'))
+        f.close()
+        self.assertIsNone(Directory.load(self.path))
+
+    def test_missing_or_corrupt(self):
+        self.assertIsNone(Directory.load(self.path))
+        with open(self.path, 'wb') as f:
+            f.write(b'not gzip')
+        self.assertIsNone(Directory.load(self.path))
+        f = gzip.open(self.path, 'wb')
+        f.write(b'{"version": ')
+        f.close()
+        self.assertIsNone(Directory.load(self.path))
+
+
+class DirectoryLoaderTest(AsyncTestCase):
+    @gen_test
+    def test_load_all(self):
+        users = [{'id': 'U%d' % i, 'name': 'user%d' % i} for i in range(250)]
+        channels = [
+            {'id': 'C1', 'name': 'general'},
+            {'id': 'G1', 'name': 'secret', 'is_private': True},
+        ]
+        directory = Directory(complete=False)
+        loader = DirectoryLoader(FakeClient(users, channels), directory, page_size=100)
+        yield loader.load_all()
+
+        self.assertTrue(directory.complete)
+        self.assertTrue(directory.dirty)
+        self.assertEqual(len(directory.users), 250)
+        self.assertEqual(directory.users.get(name='user249')['id'], 'U249')
+        self.assertEqual(directory.channels.get(name='general')['id'], 'C1')
+        self.assertEqual(directory.groups.get(name='secret')['id'], 'G1')
+        self.assertEqual(loader.client.calls.count('users.list'), 3)
+
+    @gen_test
+    def test_refresh_stale_snapshot(self):
+        fields = dict(user_fields=DEFAULT_USER_FIELDS, channel_fields=DEFAULT_CHANNEL_FIELDS)
+        n = 20000
+        directory = Directory(
+            [{'id': 'U%d' % i, 'name': 'old%d' % i} for i in range(n)],
+            [{'id': 'C1', 'name': 'gone'}], [], **fields)
+        directory.complete = False
+
+        users = [{'id': 'U%d' % i, 'name': 'new%d' % i} for i in range(n)]
+        loader = DirectoryLoader(FakeClient(users, []), directory, page_size=1000)
+        start = time.time()
+        yield loader.load_all()
+        self.assertLess(time.time() - start, 5)
+
+        self.assertEqual(len(directory.users), n)
+        self.assertEqual(directory.users.get(name='new7')['id'], 'U7')
+        self.assertIsNone(directory.users.get(name='old7'))
+        # Channels not in the fresh lists are gone
+        self.assertIsNone(directory.channels.get(id='C1'))
+        self.assertIsInstance(directory.users[0], type(directory.users.get(id='U1')))
+
+    @gen_test
+    def test_changes_while_loading(self):
+        users = [{'id': 'U%d' % i, 'name': 'user%d' % i} for i in range(3)]
+        channels = [{'id': 'C1', 'name': 'general'}]
+        directory = Directory(complete=False)
+
+        @gen.coroutine
+        def on_call(method, cursor):
+            # users.list is already fetched, these are not in the pages
+            if method == 'conversations.list' and not cursor:
+                directory.apply_event({'type': 'user_change', 'user': {'id': 'U1', 'name': 'renamed'}})
+                directory.apply_event({'type': 'channel_created', 'channel': {'id': 'C2', 'name': 'new'}})
+                yield loader.lookup_user('U9')
+
+        loader = DirectoryLoader(FakeClient(users, channels, on_call), directory, page_size=2)
+        yield loader.load_all()
+
+        self.assertEqual(directory.users.get(id='U1')['name'], 'renamed')
+        self.assertEqual(directory.users.get(id='U9')['name'], 'late')
+        self.assertEqual(directory.channels.get(id='C2')['name'], 'new')
+        self.assertEqual(len(directory.users), 4)
+        self.assertIsNone(directory._pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
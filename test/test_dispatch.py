@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+from tornado import gen
+from tornado.locks import Event
+from tornado.testing import AsyncTestCase, gen_test
+
+from jin.message import Message
+from jin.dispatch import InboundDispatcher, HandlerIndex
+
+
+def make_msg(text, channel='C1', type='message', priority=1, user='U1'):
+    return Message({'type': type, 'text': text, 'channel': channel, 'user': user,
+                    'priority': priority}, None)
+
+
+def get_priority(msg):
+    return msg.raw['priority']
+
+
+class InboundDispatcherTest(AsyncTestCase):
+    def make_dispatcher(self, **kwargs):
+        self.handled = []
+        self.release = Event()
+
+        @gen.coroutine
+        def handle(msg):
+            if msg.raw['text'] == 'busy':
+                yield self.release.wait()
+            self.handled.append(msg.raw['text'])
+
+        kwargs.setdefault('priority_func', get_priority)
+        return InboundDispatcher(handle, **kwargs)
+
+    @gen_test
+    def test_key_order_over_priority(self):
+        d = self.make_dispatcher(concurrency=1)
+        yield d.put(make_msg('busy', channel='C9'))
+        yield gen.moment
+        yield d.put(make_msg('1: deploy started'))
+        yield d.put(make_msg('2: <@UBOT> status?', priority=0))
+        self.release.set()
+        yield d.join()
+        self.assertEqual(self.handled, ['busy', '1: deploy started', '2: <@UBOT> status?'])
+
+    @gen_test
+    def test_priority_across_keys(self):
+        d = self.make_dispatcher(concurrency=1)
+        yield d.put(make_msg('busy', channel='C9'))
+        yield gen.moment
+        yield d.put(make_msg('low', channel='C1', priority=2))
+        yield d.put(make_msg('normal', channel='C2'))
+        yield d.put(make_msg('c3 first', channel='C3'))
+        # Pulls the older message of C3 ahead of C1 and C2
+        yield d.put(make_msg('c3 urgent', channel='C3', priority=0))
+        self.assertEqual(d.qsizes(), [1, 2, 1])
+        self.release.set()
+        yield d.join()
+        self.assertEqual(self.handled, ['busy', 'c3 first', 'c3 urgent', 'normal', 'low'])
+
+    @gen_test
+    def test_concurrent_keys(self):
+        d = self.make_dispatcher(concurrency=4)
+        yield d.put(make_msg('busy'))
+        for i in range(3):
+            yield d.put(make_msg('c1 %d' % i, priority=i % 2))
+            yield d.put(make_msg('c2 %d' % i, channel='C2'))
+        yield gen.moment
+        # C2 isn't blocked by the busy C1
+        self.assertEqual(self.handled, ['c2 0', 'c2 1', 'c2 2'])
+        self.release.set()
+        yield d.join()
+        self.assertEqual([i for i in self.handled if i.startswith('c1') or i == 'busy'],
+                         ['busy', 'c1 0', 'c1 1', 'c1 2'])
+
+    @gen_test
+    def test_drop(self):
+        shed = []
+        d = self.make_dispatcher(concurrency=1, queue_size=2, overflow='drop',
+                                 on_shed=lambda msg, action: shed.append((msg.raw['text'], action)))
+        yield d.put(make_msg('busy', channel='C9'))
+        yield gen.moment
+        yield d.put(make_msg('typing', priority=2))
+        yield d.put(make_msg('hello'))
+        # Queue is full, the oldest low priority message goes
+        yield d.put(make_msg('world'))
+        # Nothing left to drop for a low priority one
+        yield d.put(make_msg('typing 2', priority=2))
+        self.release.set()
+        yield d.join()
+        self.assertEqual(shed, [('typing', 'dropped'), ('typing 2', 'dropped')])
+        self.assertEqual(self.handled, ['busy', 'hello', 'world'])
+        self.assertEqual(d.qsizes(), [0, 0, 0])
+
+    @gen_test
+    def test_coalesce(self):
+        d = self.make_dispatcher(concurrency=1, overflow='coalesce')
+        yield d.put(make_msg('busy', channel='C9'))
+        yield gen.moment
+        yield d.put(make_msg('typing 1', type='user_typing', priority=2))
+        yield d.put(make_msg('hello'))
+        yield d.put(make_msg('typing 2', type='user_typing', priority=2))
+        self.release.set()
+        yield d.join()
+        self.assertEqual(self.handled, ['busy', 'typing 2', 'hello'])
+
+
+class HandlerIndexTest(unittest.TestCase):
+    def test_get(self):
+        specs = [('message', 1), (('message', 'bot_message'), 2), ('message', 3)]
+        index = HandlerIndex(specs)
+        self.assertIn('message', index)
+        self.assertNotIn('hello', index)
+        self.assertEqual(index.get('message'), [specs[0], specs[2]])
+        self.assertEqual(index.get('message', 'bot_message'), specs)
+
+
+if __name__ == '__main__':
+    unittest.main()
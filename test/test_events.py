@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import json
+import hmac
+import hashlib
+import unittest
+from tornado import gen
+from tornado.web import Application
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, gen_test
+
+from jin import SlackBot
+from jin.utils import ObjectDict
+from jin.web import EventsHandler, SlackHandler, verify_signature
+
+
+SECRET = 'sekrit'
+
+
+def sign(body, timestamp, secret=SECRET):
+    base = ('v0:%s:' % timestamp).encode('utf-8') + body
+    return 'v0=' + hmac.new(secret.encode('utf-8'), base, hashlib.sha256).hexdigest()
+
+
+class VerifySignatureTest(unittest.TestCase):
+    def test_valid(self):
+        ts = int(time.time())
+        self.assertTrue(verify_signature(SECRET, str(ts), b'{}', sign(b'{}', ts)))
+
+    def test_invalid(self):
+        ts = int(time.time())
+        body = b'{"a": 1}'
+        self.assertFalse(verify_signature(SECRET, str(ts), body, sign(body, ts, 'other')))
+        self.assertFalse(verify_signature(SECRET, str(ts), b'{"a": 2}', sign(body, ts)))
+        self.assertFalse(verify_signature(SECRET, str(ts), body, None))
+        self.assertFalse(verify_signature(SECRET, None, body, sign(body, ts)))
+        self.assertFalse(verify_signature(SECRET, 'abc', body, sign(body, ts)))
+
+    def test_too_old(self):
+        ts = int(time.time()) - 600
+        self.assertFalse(verify_signature(SECRET, str(ts), b'{}', sign(b'{}', ts)))
+        self.assertTrue(verify_signature(SECRET, str(ts), b'{}', sign(b'{}', ts), max_age=900))
+
+
+class FakeBot(object):
+    def __init__(self):
+        self.config = ObjectDict(SLACK_SIGNING_SECRET=SECRET, EVENTS_MAX_AGE=300)
+        self.events = []
+
+    def handle_event(self, payload):
+        self.events.append(payload)
+
+
+class EventsHandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.bot = FakeBot()
+        return Application([
+            ('/slack/events', EventsHandler, {'bot': self.bot}),
+            # The plain base class still works without arguments
+            ('/plain', SlackHandler),
+        ])
+
+    def post(self, payload, secret=SECRET, timestamp=None):
+        body = json.dumps(payload).encode('utf-8')
+        timestamp = timestamp or int(time.time())
+        return self.fetch('/slack/events', method='POST', body=body, headers={
+            'X-Slack-Request-Timestamp': str(timestamp),
+            'X-Slack-Signature': sign(body, timestamp, secret),
+        })
+
+    def test_url_verification(self):
+        resp = self.post({'type': 'url_verification', 'challenge': 'abc'})
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(json.loads(resp.body.decode('utf-8')), {'challenge': 'abc'})
+
+    def test_event_callback(self):
+        payload = {'type': 'event_callback', 'event_id': 'Ev1', 'event': {'type': 'message'}}
+        resp = self.post(payload)
+        self.assertEqual(resp.code, 200)
+        self.io_loop.run_sync(lambda: gen.sleep(0.01))
+        self.assertEqual(self.bot.events, [payload])
+
+    def test_bad_signature(self):
+        resp = self.post({'type': 'event_callback', 'event': {}}, secret='other')
+        self.assertEqual(resp.code, 403)
+        resp = self.post({'type': 'event_callback', 'event': {}}, timestamp=int(time.time()) - 600)
+        self.assertEqual(resp.code, 403)
+        self.assertEqual(self.bot.events, [])
+
+    def test_slack_handler_base(self):
+        self.assertEqual(self.fetch('/plain').code, 405)
+
+
+class HandleEventTest(AsyncTestCase):
+    @gen_test
+    def test_wait_until_ready(self):
+        bot = SlackBot({'SLACK_TOKEN': 'x', 'DEBUG': False, 'EVENTS_API': True,
+                        'SLACK_SIGNING_SECRET': SECRET, 'METRICS_PATH': None})
+        handled = []
+
+        @bot.on_event('message')
+        def on_message(msg):
+            handled.append(msg.raw['text'])
+
+        payload = {'event_id': 'Ev1', 'event': {'type': 'message', 'text': 'hi', 'user': 'U1'}}
+        future = bot.handle_event(payload)
+        yield gen.sleep(0.01)
+        self.assertFalse(future.done())
+
+        bot.selfinfo = ObjectDict(id='UBOT')
+        bot._events_ready.set()
+        yield future
+        # Retried by Slack
+        yield bot.handle_event(payload)
+        yield bot.dispatcher.join()
+        self.assertEqual(handled, ['hi'])
+
+
+if __name__ == '__main__':
+    unittest.main()
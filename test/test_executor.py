@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+import threading
+import unittest
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from jin import metrics
+from jin.errors import HandlerTimeout
+from jin.executor import HandlerExecutor, PoolStats
+from jin.message import Message
+
+
+def make_msg(text='hi'):
+    return Message({'type': 'message', 'text': text, 'channel': 'C1', 'user': 'U1'}, None)
+
+
+# Module level, so that process workers could look them up by name
+def where(msg, suffix=''):
+    return '%s %s%s' % (msg.raw['text'], os.getpid(), suffix)
+
+
+def fail(msg):
+    raise ValueError('boom')
+
+
+def slow(msg):
+    time.sleep(0.2)
+    return 'slow'
+
+
+class PoolStatsTest(unittest.TestCase):
+    def test_queued(self):
+        stats = PoolStats(2)
+        stats.in_flight = 5
+        self.assertEqual(stats.as_dict()['queued'], 3)
+        stats.in_flight = 1
+        self.assertEqual(stats.queued, 0)
+
+
+class HandlerExecutorTest(AsyncTestCase):
+    def setUp(self):
+        super(HandlerExecutorTest, self).setUp()
+        self.executor = HandlerExecutor(thread_workers=2, process_workers=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        super(HandlerExecutorTest, self).tearDown()
+
+    @gen_test
+    def test_thread(self):
+        def handler(msg, n):
+            return msg.raw['text'], n, threading.current_thread().name
+
+        text, n, thread = yield self.executor.run('thread', handler, make_msg(), {'n': 1})
+        self.assertEqual((text, n), ('hi', 1))
+        self.assertNotEqual(thread, threading.current_thread().name)
+        self.assertEqual(self.executor.get_stats()['thread']['completed'], 1)
+
+    @gen_test(timeout=30)
+    def test_process(self):
+        output = yield self.executor.run('process', where, make_msg(), {'suffix': '!'})
+        text, pid = output.split(' ')
+        self.assertEqual(text, 'hi')
+        self.assertNotEqual(pid, '%s!' % os.getpid())
+
+    @gen_test
+    def test_failure(self):
+        before = metrics.EXECUTOR_RUNS.get(('thread', 'error'))
+        with self.assertRaises(ValueError):
+            yield self.executor.run('thread', fail, make_msg(), {})
+        stats = self.executor.get_stats()['thread']
+        self.assertEqual((stats['failed'], stats['in_flight']), (1, 0))
+        self.assertEqual(metrics.EXECUTOR_RUNS.get(('thread', 'error')), before + 1)
+
+    @gen_test
+    def test_timeout(self):
+        with self.assertRaises(HandlerTimeout):
+            yield self.executor.run('thread', slow, make_msg(), {}, timeout=0.05)
+        self.assertEqual(self.executor.get_stats()['thread']['timeouts'], 1)
+
+    @gen_test
+    def test_saturation_metrics(self):
+        futures = [self.executor.run('thread', slow, make_msg(), {}) for _ in range(3)]
+        yield gen.moment
+        rendered = metrics.REGISTRY.render()
+        self.assertIn('jin_executor_workers{pool="thread"} 2', rendered)
+        self.assertIn('jin_executor_in_flight{pool="thread"} 3', rendered)
+        self.assertIn('jin_executor_queued{pool="thread"} 1', rendered)
+        yield futures
+        self.assertIn('jin_executor_queued{pool="thread"} 0', metrics.REGISTRY.render())
+
+    def test_check_kind(self):
+        self.assertRaises(ValueError, HandlerExecutor.check_kind, 'fiber')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+from tornado.testing import AsyncTestCase, gen_test
+
+from jin import SlackBot
+from jin import metrics
+from jin.directory import Directory
+from jin.filters import HandlerFilter
+from jin.message import Message
+from jin.utils import ObjectDict
+
+
+def make_directory():
+    return Directory(
+        [{'id': 'U1', 'name': 'alice'}, {'id': 'U2', 'name': 'bob'}],
+        [{'id': 'C1', 'name': 'general'}],
+        [{'id': 'G1', 'name': 'secret'}])
+
+
+def make_msg(text='hi', channel='C1', user='U1'):
+    return Message({'type': 'message', 'text': text, 'channel': channel, 'user': user}, None)
+
+
+class ResolveTest(unittest.TestCase):
+    def test_names_and_ids(self):
+        f = HandlerFilter(channels=['#general', 'secret', 'C1'], users=['@alice', 'U2'])
+        channel_ids, user_ids, complete = f.resolve(make_directory())
+        self.assertEqual(channel_ids, frozenset(['C1', 'G1']))
+        self.assertEqual(user_ids, frozenset(['U1', 'U2']))
+        self.assertTrue(complete)
+
+    def test_not_filtering(self):
+        f = HandlerFilter(direct_only=True)
+        self.assertEqual(f.resolve(make_directory()), (None, None, True))
+
+    def test_unresolved(self):
+        f = HandlerFilter(channels=['general', 'random'], users='carol')
+        channel_ids, user_ids, complete = f.resolve(make_directory())
+        self.assertEqual(channel_ids, frozenset(['C1']))
+        self.assertEqual(user_ids, frozenset())
+        self.assertFalse(complete)
+
+    def test_ids_without_directory(self):
+        # Direct message channels are never in directory, ids pass as they are
+        f = HandlerFilter(channels=['D123', 'C9', 'general'], users=['W42'])
+        channel_ids, user_ids, complete = f.resolve(None)
+        self.assertEqual(channel_ids, frozenset(['D123', 'C9']))
+        self.assertEqual(user_ids, frozenset(['W42']))
+        self.assertFalse(complete)
+
+    def test_make(self):
+        self.assertIsNone(HandlerFilter.make(channels=None, users=(), direct_only=False))
+        self.assertIsNotNone(HandlerFilter.make(mentions_bot=True))
+
+
+class CheckTest(unittest.TestCase):
+    def check(self, msg, **kwargs):
+        f = HandlerFilter(**kwargs)
+        return f.check(msg, f.resolve(make_directory()), 'UBOT')
+
+    def test_channels(self):
+        self.assertIsNone(self.check(make_msg(), channels=['general']))
+        self.assertEqual(self.check(make_msg(channel='G1'), channels=['general']), 'channels')
+
+    def test_users(self):
+        self.assertIsNone(self.check(make_msg(), users=['alice']))
+        self.assertEqual(self.check(make_msg(user='U2'), users=['alice']), 'users')
+
+    def test_direct_only(self):
+        self.assertIsNone(self.check(make_msg(channel='D1'), direct_only=True))
+        self.assertEqual(self.check(make_msg(), direct_only=True), 'direct_only')
+        # channel_created and the like have a channel object
+        msg = Message({'type': 'channel_created', 'channel': {'id': 'C2'}}, None)
+        self.assertEqual(self.check(msg, direct_only=True), 'direct_only')
+
+    def test_mentions_bot(self):
+        self.assertIsNone(self.check(make_msg('<@UBOT> hi'), mentions_bot=True))
+        self.assertIsNone(self.check(make_msg('hi <@UBOT|bot>'), mentions_bot=True))
+        self.assertEqual(self.check(make_msg('<@U1> hi'), mentions_bot=True), 'mentions_bot')
+        msg = Message({'type': 'message', 'channel': 'C1'}, None)
+        self.assertEqual(self.check(msg, mentions_bot=True), 'mentions_bot')
+
+    def test_first_failing(self):
+        msg = make_msg('hi', channel='C9', user='U2')
+        self.assertEqual(self.check(msg, channels=['general'], users=['alice']), 'channels')
+        self.assertEqual(self.check(msg, users=['alice'], mentions_bot=True), 'users')
+
+
+class HandleMessageTest(AsyncTestCase):
+    def setUp(self):
+        super(HandleMessageTest, self).setUp()
+        self.bot = bot = SlackBot({'SLACK_TOKEN': 'x', 'DEBUG': False})
+        bot.selfinfo = ObjectDict(id='UBOT')
+        bot.directory = make_directory()
+        self.handled = []
+
+        @bot.on_event('message', channels=['general'], users=['alice'])
+        def general_alice(msg):
+            self.handled.append('general_alice')
+
+        @bot.match_text('deploy', mentions_bot=False, direct_only=True)
+        def deploy(msg):
+            self.handled.append('deploy')
+
+        @bot.on_event('message')
+        def everything(msg):
+            self.handled.append('everything')
+
+    def rejections(self, handler, name):
+        return metrics.FILTER_REJECTIONS.get(('%s.%s' % (__name__, handler), name))
+
+    @gen_test
+    def test_rejections(self):
+        before = self.rejections('general_alice', 'users')
+        yield self.bot.handle_message(make_msg(user='U2'))
+        self.assertEqual(self.handled, ['everything'])
+        self.assertEqual(self.rejections('general_alice', 'users'), before + 1)
+
+        before = self.rejections('deploy', 'direct_only')
+        self.handled[:] = []
+        yield self.bot.handle_message(make_msg('deploy'))
+        self.assertEqual(self.handled, ['general_alice', 'everything'])
+        self.assertEqual(self.rejections('deploy', 'direct_only'), before + 1)
+
+        self.handled[:] = []
+        yield self.bot.handle_message(make_msg('deploy', channel='D1'))
+        self.assertEqual(self.handled, ['deploy', 'everything'])
+
+    @gen_test
+    def test_resolve_later(self):
+        # A channel created after start is found once it's in directory
+        @self.bot.on_event('message', channels=['new'])
+        def new_channel(msg):
+            self.handled.append('new_channel')
+
+        yield self.bot.handle_message(make_msg(channel='C2', user='U2'))
+        self.assertEqual(self.handled, ['everything'])
+
+        self.bot.directory.channels.append({'id': 'C2', 'name': 'new'})
+        self.handled[:] = []
+        yield self.bot.handle_message(make_msg(channel='C2', user='U2'))
+        self.assertEqual(self.handled, ['everything', 'new_channel'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import unittest
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from jin.errors import APIRateLimited
+from jin.message import Reply
+from jin.outbound import TokenBucket, OutboundScheduler
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        now = bucket.updated
+        for _ in range(3):
+            self.assertEqual(bucket.delay(now), 0)
+            bucket.consume(now)
+        self.assertAlmostEqual(bucket.delay(now), 0.5)
+        self.assertEqual(bucket.delay(now + 0.5), 0)
+        bucket.consume(now + 0.5)
+        self.assertAlmostEqual(bucket.delay(now + 0.5), 0.5)
+
+    def test_capacity(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        now = bucket.updated + 60
+        bucket.consume(now)
+        bucket.consume(now)
+        # Idle time doesn't build up more than the burst
+        self.assertGreater(bucket.delay(now), 0)
+
+
+class OutboundSchedulerTest(AsyncTestCase):
+    def make_scheduler(self, fail=None, **kwargs):
+        self.sent = []
+
+        @gen.coroutine
+        def send(reply):
+            error = fail and fail(reply)
+            if error:
+                raise error
+            self.sent.append((reply.channel_id, reply.text, time.time()))
+            raise gen.Return({'ok': True, 'ts': str(len(self.sent))})
+
+        return OutboundScheduler(send, **kwargs)
+
+    @gen_test
+    def test_order_and_channel_rate(self):
+        outbound = self.make_scheduler(rate=100, burst=100, channel_rate=20, channel_burst=2)
+        futures = [outbound.put(Reply('C1', 'a%d' % i)) for i in range(5)]
+        futures.append(outbound.put(Reply('C2', 'b0')))
+        start = time.time()
+        results = yield futures
+        self.assertEqual([r['ok'] for r in results], [True] * 6)
+        self.assertEqual([text for c, text, _ in self.sent if c == 'C1'],
+                         ['a%d' % i for i in range(5)])
+        # C2 doesn't wait behind the throttled C1
+        self.assertLess(self.sent[[i[1] for i in self.sent].index('b0')][2] - start, 0.04)
+        # 2 in burst, then 3 at 20/s
+        self.assertGreater(time.time() - start, 0.12)
+        self.assertEqual(outbound.queue_depth(), 0)
+
+    @gen_test
+    def test_coalesce(self):
+        outbound = self.make_scheduler(concurrency=1, coalesce=True)
+        futures = [outbound.put(Reply('C1', 'line %d' % i)) for i in range(3)]
+        futures.append(outbound.put(Reply('C1', 'attachment', attachments='[]')))
+        yield futures
+        self.assertEqual([text for _, text, _ in self.sent],
+                         ['line 0\nline 1\nline 2', 'attachment'])
+        self.assertEqual(outbound.get_stats()['coalesced'], 2)
+
+    @gen_test
+    def test_rate_limited(self):
+        limited = []
+
+        def fail(reply):
+            if not limited:
+                limited.append(reply.text)
+                return APIRateLimited('429', retry_after=0.1)
+
+        outbound = self.make_scheduler(fail=fail)
+        start = time.time()
+        rv = yield outbound.put(Reply('C1', 'hi'))
+        self.assertEqual(rv['ok'], True)
+        self.assertEqual(limited, ['hi'])
+        self.assertGreater(time.time() - start, 0.09)
+        self.assertEqual(outbound.get_stats()['rate_limited'], 1)
+
+    @gen_test
+    def test_max_retries(self):
+        outbound = self.make_scheduler(
+            fail=lambda reply: APIRateLimited('429', retry_after=0.01), max_retries=2)
+        with self.assertRaises(APIRateLimited):
+            yield outbound.put(Reply('C1', 'hi'))
+        self.assertEqual(outbound.get_stats()['dropped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import re
+import unittest
+
+from jin import SlackBot
+from jin.patterns import PatternSet, MAX_GROUPS
+
+
+class PatternSetTest(unittest.TestCase):
+    def test_match(self):
+        ps = PatternSet()
+        hello = ps.add('hello')
+        status = ps.add(r'status (?P<service>\w+)')
+        deploy = ps.add(r'deploy (?P<app>\w+) to (?P<env>\w+)')
+        ignore_case = ps.add(re.compile(r'help', re.I))
+
+        self.assertEqual(ps.match('hello world'), {hello: {}})
+        self.assertEqual(ps.match('status db'), {status: {'service': 'db'}})
+        self.assertEqual(ps.match('deploy web to prod'), {deploy: {'app': 'web', 'env': 'prod'}})
+        self.assertEqual(ps.match('HELP'), {ignore_case: {}})
+        # Anchored at the start
+        self.assertEqual(ps.match('say hello'), {})
+
+    def test_same_pattern_same_id(self):
+        ps = PatternSet()
+        self.assertEqual(ps.add(r'a(?P<x>\d)'), ps.add(r'a(?P<x>\d)'))
+        self.assertEqual(len(ps), 1)
+
+    def test_overlapping_patterns(self):
+        ps = PatternSet()
+        a = ps.add(r'(?P<word>\w+)')
+        b = ps.add(r'ping (?P<n>\d+)')
+        c = ps.add('ping')
+        self.assertEqual(ps.match('ping 3'), {a: {'word': 'ping'}, b: {'n': '3'}, c: {}})
+
+    def test_same_group_names(self):
+        ps = PatternSet()
+        a = ps.add(r'add (?P<n>\d+)')
+        b = ps.add(r'(?P<n>\w+) (?P<m>\d+)')
+        self.assertEqual(ps.match('add 1'), {a: {'n': '1'}, b: {'n': 'add', 'm': '1'}})
+
+    def test_many_patterns(self):
+        ps = PatternSet()
+        ids = [ps.add(r'cmd%d (?P<arg>\w+)' % i) for i in range(MAX_GROUPS * 2)]
+        self.assertEqual(ps.match('cmd150 x'), {ids[150]: {'arg': 'x'}})
+
+    def test_backref(self):
+        ps = PatternSet()
+        pid = ps.add(r'(\w)\1')
+        ps.add(r'(\w)x')
+        self.assertIn(pid, ps.match('aa'))
+        self.assertNotIn(pid, ps.match('ab'))
+
+    def test_numbered_conditional(self):
+        ps = PatternSet()
+        help_ = ps.add('help')
+        status = ps.add(r'status (?P<service>\w+)')
+        pid = ps.add(r'(a)?(?(1)b|c)d')
+        for text in ('abd', 'cd', 'ad', 'help', 'status db'):
+            expected = re.match(r'(a)?(?(1)b|c)d', text) is not None
+            self.assertEqual(pid in ps.match(text), expected, text)
+        self.assertEqual(ps.match('help'), {help_: {}})
+        self.assertEqual(ps.match('status db'), {status: {'service': 'db'}})
+
+    def test_named_conditional(self):
+        ps = PatternSet()
+        help_ = ps.add('help')
+        status = ps.add(r'status (?P<service>\w+)')
+        pid = ps.add(r'(?P<x>a)?(?(x)b|c)d')
+        self.assertEqual(ps.match('abd'), {pid: {'x': 'a'}})
+        self.assertEqual(ps.match('cd'), {pid: {'x': None}})
+        self.assertEqual(ps.match('ad'), {})
+        # Others on the same set are not broken by it
+        self.assertEqual(ps.match('help'), {help_: {}})
+        self.assertEqual(ps.match('status db'), {status: {'service': 'db'}})
+
+    def test_invalid_pattern(self):
+        ps = PatternSet()
+        ok = ps.add('ok')
+        self.assertRaises(ValueError, ps.add, 'bad (unbalanced')
+        self.assertEqual(len(ps), 1)
+        # Other patterns still match
+        self.assertEqual(ps.match('ok'), {ok: {}})
+
+    def test_invalid_pattern_on_registration(self):
+        bot = SlackBot({'SLACK_TOKEN': 'x', 'DEBUG': False})
+        with self.assertRaises(ValueError):
+            bot.match_text(r'status (?P<service>\w+')(lambda msg, service: None)
+        self.assertNotIn('message', bot._handler_index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from tornado.testing import AsyncTestCase, gen_test
+
+from jin import SlackBot
+from jin.record import Recorder, Replayer, read_recording
+
+
+def make_frames(n):
+    return [(1000 + i * 0.001, json.dumps({
+        'type': 'message', 'text': 'hi %d' % i, 'ts': str(i), 'channel': 'C1', 'user': 'U1'}))
+        for i in range(n)]
+
+
+class ReplayerTest(AsyncTestCase):
+    @gen_test
+    def test_replay(self):
+        bot = SlackBot({'SLACK_TOKEN': 'x', 'DEBUG': False})
+        replies = []
+
+        @bot.match_text('hi (?P<n>\\d+)')
+        def hi(msg, n):
+            replies.append(n)
+            return msg.reply('hello %s' % n)
+
+        # All to one channel, which is limited to 1 reply/s outside replay
+        replayer = Replayer(bot, speed=0)
+        stats = yield replayer.replay(make_frames(50))
+        self.assertEqual(stats['frames'], 50)
+        self.assertEqual(stats['api_calls'], 50)
+        self.assertLess(stats['elapsed'], 5)
+        self.assertEqual(replies, [str(i) for i in range(50)])
+        _, method, kwargs = replayer.client.calls[-1]
+        self.assertEqual(method, 'chat.postMessage')
+        self.assertEqual(kwargs['text'], b'hello 49')
+
+
+class RecorderTest(AsyncTestCase):
+    def setUp(self):
+        super(RecorderTest, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(RecorderTest, self).tearDown()
+
+    def test_rotate(self):
+        path = os.path.join(self.tmp_dir, 'rec.gz')
+        recorder = Recorder(path, max_bytes=200, backup_count=2, buffer_size=2)
+        for _, frame in make_frames(30):
+            recorder.write(frame)
+        recorder.close()
+
+        self.assertTrue(os.path.exists(path + '.2'))
+        self.assertFalse(os.path.exists(path + '.3'))
+        frames = [json.loads(frame)['ts'] for _, frame in read_recording(path)]
+        # The oldest ones are rotated away, the rest are in order
+        self.assertEqual(frames, [str(i) for i in range(30 - len(frames), 30)])
+
+
+if __name__ == '__main__':
+    unittest.main()
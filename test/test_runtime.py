@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+
+from jin import SlackBot
+from jin.cache import make_cache_key
+from jin.message import Message
+from jin.runtime import Runtime
+
+
+class ForWorkspaceTest(unittest.TestCase):
+    def setUp(self):
+        self.bot = SlackBot({'SLACK_TOKEN': 'x', 'DEBUG': False,
+                             'SCHEDULE_PATH': '/tmp/jobs.json'})
+
+    def test_jobs(self):
+        @self.bot.every(60)
+        def tick(bot):
+            pass
+
+        job = self.bot.schedule_message('Standup time!', channels=['general'], cron='0 10 * * 1-5')
+        t1 = self.bot.for_workspace('T1', 'x1')
+        self.assertIs(self.bot.workspace_bots['T1'], t1)
+        self.assertEqual(t1.config.SCHEDULE_PATH, '/tmp/jobs.T1.json')
+        copied = t1.scheduler.get(job.id)
+        self.assertIsNot(copied, job)
+        self.assertEqual((copied.text, copied.channels), ('Standup time!', ['general']))
+        # Function jobs are registered on start, by the shared specs
+        self.assertEqual(len(t1.scheduler), 1)
+        self.assertEqual(t1._job_specs, self.bot._job_specs)
+
+    def test_cache_key(self):
+        t1 = self.bot.for_workspace('T1', 'x1')
+        t2 = self.bot.for_workspace('T2', 'x2')
+        raw = {'type': 'message', 'text': 'status', 'channel': 'C1', 'user': 'U1'}
+        key1 = make_cache_key(Message(raw, t1), {})
+        key2 = make_cache_key(Message(raw, t2), {})
+        self.assertNotEqual(key1, key2)
+        self.assertIn(('workspace', 'T1'), key1)
+
+    def test_shard(self):
+        runtime = Runtime(self.bot, dict(('T%d' % i, 'x') for i in range(10)), 3)
+        shards = [runtime.shard(i, 3) for i in range(3)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(runtime.workspaces))
+
+
+if __name__ == '__main__':
+    unittest.main()
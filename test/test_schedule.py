@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+import shutil
+import datetime
+import tempfile
+import unittest
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from jin.schedule import (
+    CronTrigger, IntervalTrigger, DateTrigger, Scheduler, make_trigger)
+
+
+def ts(*args):
+    return time.mktime(datetime.datetime(*args).timetuple())
+
+
+def next_run(expr, *args):
+    rv = CronTrigger(expr).next_run(None, ts(*args))
+    return rv and datetime.datetime.fromtimestamp(rv)
+
+
+class CronTriggerTest(unittest.TestCase):
+    def test_weekdays(self):
+        # Saturday
+        self.assertEqual(next_run('0 9 * * 1-5', 2026, 10, 17, 10, 0),
+                         datetime.datetime(2026, 10, 19, 9, 0))
+        # Sunday is 0 or 7
+        self.assertEqual(next_run('0 9 * * 7', 2026, 10, 17, 10, 0),
+                         datetime.datetime(2026, 10, 18, 9, 0))
+
+    def test_day_or_weekday(self):
+        # The 13th or Friday, whichever comes first
+        self.assertEqual(next_run('0 0 13 * 5', 2026, 10, 1),
+                         datetime.datetime(2026, 10, 2))
+        self.assertEqual(next_run('0 0 13 * 5', 2026, 10, 10),
+                         datetime.datetime(2026, 10, 13))
+        # Only the day when weekday is *
+        self.assertEqual(next_run('0 0 13 * *', 2026, 10, 1),
+                         datetime.datetime(2026, 10, 13))
+
+    def test_steps(self):
+        self.assertEqual(next_run('*/15 * * * *', 2026, 10, 18, 10, 7),
+                         datetime.datetime(2026, 10, 18, 10, 15))
+        self.assertEqual(next_run('5-20/10 * * * *', 2026, 10, 18, 10, 16),
+                         datetime.datetime(2026, 10, 18, 11, 5))
+        self.assertEqual(next_run('0 0/12 * * *', 2026, 10, 18, 13, 0),
+                         datetime.datetime(2026, 10, 19, 0, 0))
+        self.assertEqual(next_run('0 9,17 * * *', 2026, 10, 18, 9, 0),
+                         datetime.datetime(2026, 10, 18, 17, 0))
+
+    def test_aliases(self):
+        self.assertEqual(next_run('@daily', 2026, 10, 18, 15, 30),
+                         datetime.datetime(2026, 10, 19))
+        self.assertEqual(next_run('@monthly', 2026, 12, 18),
+                         datetime.datetime(2027, 1, 1))
+
+    def test_never(self):
+        self.assertIsNone(next_run('0 0 30 2 *', 2026, 10, 18))
+
+    def test_invalid(self):
+        for expr in ('* * * *', '60 * * * *', '* * 0 * *', '*/0 * * * *', '5-1 * * * *', 'a * * * *'):
+            self.assertRaises(ValueError, CronTrigger, expr)
+
+
+class TriggerTest(unittest.TestCase):
+    def test_interval_skips_missed(self):
+        trigger = IntervalTrigger(60)
+        self.assertEqual(trigger.next_run(None, 1000), 1060)
+        self.assertEqual(trigger.next_run(1060, 1061), 1120)
+        # Down for a while, missed runs are not made up one by one
+        self.assertEqual(trigger.next_run(1060, 1400), 1420)
+
+    def test_date(self):
+        trigger = DateTrigger(datetime.datetime(2026, 10, 18, 9, 0))
+        self.assertEqual(trigger.next_run(None, 0), ts(2026, 10, 18, 9, 0))
+        self.assertIsNone(trigger.next_run(trigger.when, 0))
+
+    def test_make_trigger(self):
+        self.assertRaises(ValueError, make_trigger)
+        self.assertRaises(ValueError, make_trigger, every=1, cron='@daily')
+        self.assertRaises(ValueError, make_trigger, every=0)
+
+
+class SchedulerTest(AsyncTestCase):
+    def setUp(self):
+        super(SchedulerTest, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'jobs.json')
+        self.runs = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(SchedulerTest, self).tearDown()
+
+    @gen.coroutine
+    def run_job(self, job):
+        self.runs.append(job.id)
+
+    def test_stable_job_id(self):
+        scheduler = Scheduler(self.run_job)
+        job = scheduler.add(IntervalTrigger(60), text='hi', channels='general')
+        again = scheduler.add(IntervalTrigger(60), text='hi', channels=['general'])
+        self.assertEqual(job.id, again.id)
+        self.assertEqual(len(scheduler), 1)
+        other = scheduler.add(IntervalTrigger(60), text='hi', users=['general'])
+        self.assertNotEqual(job.id, other.id)
+
+    def test_load_keeps_dirty(self):
+        scheduler = Scheduler(self.run_job)
+        scheduler.add(IntervalTrigger(60), text='saved', job_id='saved')
+        scheduler.save(self.path)
+        self.assertFalse(scheduler.dirty)
+
+        scheduler = Scheduler(self.run_job)
+        self.assertEqual(scheduler.load(self.path), 1)
+        self.assertFalse(scheduler.dirty)
+
+        scheduler = Scheduler(self.run_job)
+        scheduler.add(IntervalTrigger(60), text='new', job_id='new')
+        scheduler.load(self.path)
+        self.assertTrue(scheduler.dirty)
+        self.assertEqual(sorted(j.id for j in scheduler.jobs()), ['new', 'saved'])
+
+    @gen_test
+    def test_catch_up(self):
+        scheduler = Scheduler(self.run_job)
+        job = scheduler.add(IntervalTrigger(60), text='hi', job_id='missed')
+        # Due 10 minutes ago, e.g. the bot was down
+        job.next_run = time.time() - 600
+        scheduler.add(IntervalTrigger(60), text='later', job_id='later')
+        scheduler.save(self.path)
+
+        scheduler = Scheduler(self.run_job)
+        scheduler.load(self.path)
+        scheduler.start()
+        yield gen.sleep(0.05)
+        scheduler.stop()
+        # Once, not once for each missed run
+        self.assertEqual(self.runs, ['missed'])
+        self.assertGreater(scheduler.get('missed').next_run, time.time())
+        self.assertTrue(scheduler.dirty)
+
+    @gen_test
+    def test_concurrency(self):
+        release = []
+
+        @gen.coroutine
+        def run_job(job):
+            self.runs.append(job.id)
+            while not release:
+                yield gen.sleep(0.01)
+
+        scheduler = Scheduler(run_job, concurrency=2)
+        for i in range(3):
+            scheduler.add(DateTrigger(time.time() - 1), text='hi', job_id=str(i))
+        scheduler.start()
+        yield gen.sleep(0.03)
+        self.assertEqual(self.runs, ['0', '1'])
+        release.append(1)
+        yield gen.sleep(0.05)
+        self.assertEqual(self.runs, ['0', '1', '2'])
+        # One-off jobs are gone once run
+        self.assertEqual(len(scheduler), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
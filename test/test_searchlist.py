@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import unittest
+
+from jin.utils import SearchList, make_record_class
+
+
+def make_users(n):
+    return [{'id': 'U%d' % i, 'name': 'user%d' % i} for i in range(n)]
+
+
+class SearchListTest(unittest.TestCase):
+    def test_get(self):
+        sl = SearchList(make_users(3), ['id', 'name'])
+        self.assertEqual(sl.get(id='U1')['name'], 'user1')
+        self.assertEqual(sl.get(name='user2')['id'], 'U2')
+        self.assertIsNone(sl.get(id='U9'))
+        # Not indexed
+        self.assertEqual(sl.get(id='U1', name='user1')['id'], 'U1')
+        self.assertIsNone(sl.get(id='U1', name='user2'))
+
+    def test_update_item(self):
+        sl = SearchList(make_users(3), ['id', 'name'])
+        item = sl.get(id='U1')
+        sl.update_item(item, name='renamed')
+        self.assertIs(sl.get(name='renamed'), item)
+        self.assertIsNone(sl.get(name='user1'))
+        self.assertIs(sl.get(id='U1'), item)
+
+    def test_upsert(self):
+        sl = SearchList(make_users(3), ['id', 'name'])
+        item = sl.upsert({'id': 'U1', 'name': 'renamed'})
+        self.assertIs(sl.get(id='U1'), item)
+        self.assertIs(sl.get(name='renamed'), item)
+        self.assertEqual(len(sl), 3)
+
+        new = sl.upsert({'id': 'U3', 'name': 'user3'})
+        self.assertIs(sl.get(id='U3'), new)
+        self.assertEqual(len(sl), 4)
+
+    def test_duplicate_keys(self):
+        sl = SearchList([
+            {'id': 'C1', 'name': 'general'},
+            {'id': 'C2', 'name': 'general'},
+        ], ['id', 'name'])
+        first, second = sl
+        self.assertIs(sl.get(name='general'), first)
+        # Narrowed by the index, then matched on the rest
+        self.assertIs(sl.get(name='general', id='C2'), second)
+
+        # The next item with the key takes the place
+        sl.update_item(first, name='random')
+        self.assertIs(sl.get(name='general'), second)
+        self.assertIs(sl.get(name='random'), first)
+
+        sl.remove(second)
+        self.assertIsNone(sl.get(name='general'))
+        sl.update_item(first, name='general')
+        self.assertIs(sl.get(name='general'), first)
+
+    def test_compound_index(self):
+        sl = SearchList([
+            {'id': 'C1', 'name': 'a', 'is_archived': True},
+            {'id': 'C2', 'name': 'a', 'is_archived': False},
+        ], ['id', ('is_archived', 'name')])
+        self.assertEqual(sl.get(name='a', is_archived=False)['id'], 'C2')
+        sl.update_item(sl.get(id='C1'), is_archived=False)
+        self.assertEqual(sl.get(name='a', is_archived=False)['id'], 'C2')
+        sl.remove(sl.get(id='C2'))
+        self.assertEqual(sl.get(name='a', is_archived=False)['id'], 'C1')
+
+    def test_records(self):
+        cls = make_record_class('User', ('id', 'name'))
+        sl = SearchList(make_users(2), ['id', 'name'], cls)
+        item = sl.upsert({'id': 'U1', 'name': 'renamed', 'extra': 1})
+        self.assertIsInstance(item, cls)
+        self.assertIs(sl.get(name='renamed'), item)
+
+    def test_interned(self):
+        cls = make_record_class('User', ('id', 'name'))
+        strings = {}
+        name = ''.join(['ali', 'ce'])
+        users = SearchList([{'id': 'U1', 'name': name}], ['id'], cls, strings)
+        others = SearchList([{'id': 'U2', 'name': ''.join(['ali', 'ce'])}], ['id'], cls, strings)
+        self.assertIs(others[0]['name'], name)
+        users.update_item(users[0], name=''.join(['b', 'ob']))
+        self.assertIs(users[0]['name'], strings['bob'])
+
+    def test_upsert_is_not_linear(self):
+        # Upserting existing items doesn't scan the list
+        sl = SearchList(make_users(20000), ['id', 'name'])
+        start = time.time()
+        for user in make_users(20000):
+            sl.upsert(dict(user, real_name='x'))
+        self.assertLess(time.time() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
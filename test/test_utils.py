@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+
+from jin.utils import Backoff
+
+
+class BackoffTest(unittest.TestCase):
+    def test_bounds(self):
+        backoff = Backoff(base=1, cap=10)
+        for n in range(8):
+            delay = min(10, 2 ** n)
+            for _ in range(20):
+                backoff.attempts = n
+                self.assertTrue(delay / 2.0 <= backoff.next() <= delay)
+        self.assertEqual(backoff.attempts, 8)
+
+    def test_reset(self):
+        backoff = Backoff(base=0.5, cap=60)
+        for _ in range(5):
+            backoff.next()
+        self.assertGreaterEqual(backoff.next(), 8)
+        backoff.reset()
+        self.assertEqual(backoff.attempts, 0)
+        self.assertLessEqual(backoff.next(), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()